@@ -0,0 +1,251 @@
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_HTML = os.path.join(SCRIPT_DIR, "..", "test.html")
+
+# id объявления из test.html, на место которого подставляются сгенерированные
+SAMPLE_ID = "1a174383651333169"
+
+SEARCH_PAGE = """<!DOCTYPE html>
+<html lang="bg"><head><meta charset="windows-1251"><title>{district}</title></head>
+<body>
+<div class="pagination">{next_link}</div>
+<div class="ads2023">
+{items}
+</div>
+</body></html>"""
+
+DETAIL_PAGE = """<!DOCTYPE html>
+<html lang="bg"><head><meta charset="windows-1251"><title>{title}</title></head>
+<body>
+<div class="advHeader"><div class="title">{title}</div></div>
+<div id="cena">{price} EUR</div>
+<span id="cenakv">({price_sqm} EUR/кв.м)</span>
+<div class="adParams">
+  <div>Тип имот: <strong>{rooms_text}</strong></div>
+  <div>Площ: <strong>{area} кв.м</strong></div>
+  <div>Етаж: <strong>{floor}-ти</strong></div>
+  <div>Строителство: <strong>{construction}</strong>, <strong>{year} г.</strong></div>
+</div>
+<div class="location">гр. София, {district}</div>
+<div id="description_div">{description}</div>
+<div class="photos">{images}</div>
+<div class="name">Агенция {agency}</div>
+<div class="phone">0888 {phone}</div>
+</body></html>"""
+
+CITY_PAGE = """<!DOCTYPE html>
+<html lang="bg"><head><meta charset="windows-1251"><title>{city}</title></head>
+<body><ul class="locations">
+{links}
+</ul></body></html>"""
+
+# Районы страницы локаций: название и слаг, как на imot.bg
+DISTRICTS = [("Лозенец", "lozenets"), ("Люлин 5", "lyulin-5"), ("Дружба 1", "druzhba-1"),
+             ("Младост 3", "mladost-3"), ("Надежда 1", "nadezhda-1"), ("Студентски град", "studentski-grad")]
+
+CAPTCHA_PAGE = "<html><body><div class='captcha'>Моля, потвърдете, че не сте робот</div></body></html>"
+
+ROOMS = ["Едностаен", "Двустаен", "Тристаен", "Многостаен"]
+CONSTRUCTION = ["Тухла", "Панел", "ЕПК", "Гредоред"]
+WORDS = ("светъл апартамент южно изложение тераса близо до метро ремонтиран "
+         "обзаведен асансьор паркомясто ново строителство акт 16 gas").split()
+
+
+def load_item_template(path: str = TEST_HTML) -> str:
+    """Первый блок div.item из сохранённой выдачи imot.bg с плейсхолдерами {id} и {base}"""
+    with open(path, encoding="cp1251", errors="replace") as f:
+        html = f.read()
+    start = html.index('<div class="item')
+    end = html.index('<div class="item', start + 10)
+    block = html[start:end].replace("{", "{{").replace("}", "}}")
+    block = block.replace(SAMPLE_ID, "{id}")
+    return re.sub(r"(https?:)?//www\.imot\.bg", "{base}", block)
+
+
+class FakeImotConfig:
+    """Параметры стенда: объём выдачи, задержки и доля ошибок"""
+
+    def __init__(self, pages=5, per_page=20, latency_ms=50, jitter_ms=20,
+                 captcha_rate=0.0, rate_429=0.0, rate_404=0.0, seed=42):
+        self.pages = pages
+        self.per_page = per_page
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.captcha_rate = captcha_rate
+        self.rate_429 = rate_429
+        self.rate_404 = rate_404  # Доля снятых объявлений (страница объявления отвечает 404)
+        self.seed = seed
+
+
+class FakeImotServer:
+    """Локальный HTTP-стенд, имитирующий выдачу и страницы объявлений imot.bg"""
+
+    def __init__(self, config: FakeImotConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeImotConfig()
+        self.item_template = load_item_template()
+        self.random = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.stats = {"city": 0, "search": 0, "detail": 0, "photo": 0, "captcha": 0, "429": 0, "404": 0}
+        handler = type("FakeImotHandler", (_Handler,), {"stand": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeImotServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-imot", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def roll(self, rate: float) -> bool:
+        with self.lock:
+            return rate > 0 and self.random.random() < rate
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] += 1
+
+    def delay(self) -> None:
+        cfg = self.config
+        with self.lock:
+            jitter = self.random.uniform(-cfg.jitter_ms, cfg.jitter_ms)
+        time.sleep(max(0.0, cfg.latency_ms + jitter) / 1000)
+
+    @staticmethod
+    def listing_id(district: str, page: int, index: int) -> str:
+        digest = hashlib.sha1(f"{district}/{page}/{index}".encode()).hexdigest()
+        return f"1b{int(digest[:15], 16):017d}"[:19]
+
+    def city_page(self, city: str) -> str:
+        """Страница локаций: ссылки на районы с числом объявлений"""
+        total = self.config.pages * self.config.per_page
+        links = "\n".join(
+            f'<li><a href="{self.base_url}/obiavi/prodazhbi/{city}/{slug}">{name} ({total * (n + 1)})</a></li>'
+            for n, (name, slug) in enumerate(DISTRICTS)
+        )
+        return CITY_PAGE.format(city=city, links=links)
+
+    def search_page(self, city: str, district: str, page: int) -> str:
+        items = "\n".join(
+            self.item_template.format(id=self.listing_id(district, page, i), base=self.base_url)
+            for i in range(self.config.per_page)
+        )
+        next_link = ""
+        if page < self.config.pages:
+            next_link = (f'<a href="{self.base_url}/obiavi/prodazhbi/{city}/{district}/p-{page + 1}" '
+                         f'class="saveSlink next"><span>Напред</span></a>')
+        return SEARCH_PAGE.format(district=district, items=items, next_link=next_link)
+
+    def detail_page(self, listing_id: str) -> str:
+        rnd = random.Random(listing_id)
+        rooms = rnd.choice(ROOMS)
+        area = rnd.randint(35, 140)
+        price = area * rnd.randint(1500, 3200)
+        images = "".join(
+            f'<img src="{self.base_url}/photos/{listing_id}_{n}.jpg" class="carouselimg">'
+            for n in range(rnd.randint(1, 4))
+        )
+        return DETAIL_PAGE.format(
+            title=f"Продава {rooms.lower()} апартамент",
+            price=f"{price:,}".replace(",", " "),
+            price_sqm=f"{price // area:,}".replace(",", " "),
+            rooms_text=rooms,
+            area=area,
+            floor=rnd.randint(1, 15),
+            construction=rnd.choice(CONSTRUCTION),
+            year=rnd.randint(1965, 2025),
+            district="Дружба 1",
+            description=" ".join(rnd.choice(WORDS) for _ in range(60)),
+            images=images,
+            agency=rnd.randint(1, 40),
+            phone=rnd.randint(100000, 999999),
+        )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stand: FakeImotServer = None
+
+    def do_GET(self):
+        stand = self.stand
+        stand.delay()
+        path = urlparse(self.path).path
+
+        if stand.roll(stand.config.rate_429):
+            stand.count("429")
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        city = re.match(r"^/obiavi/prodazhbi/([\w-]+)/?$", path)
+        if city:
+            stand.count("city")
+            return self.reply(200, stand.city_page(city.group(1)))
+        search = re.match(r"^/obiavi/prodazhbi/([\w-]+)/([\w-]+)(?:/p-(\d+))?/?$", path)
+        detail = re.match(r"^/obiava-(\w+)", path)
+        if search:
+            stand.count("search")
+            if stand.roll(stand.config.captcha_rate):
+                stand.count("captcha")
+                return self.reply(200, CAPTCHA_PAGE)
+            page = int(search.group(3) or 1)
+            if page > stand.config.pages:
+                return self.reply(404, "<html><body>Няма резултати</body></html>")
+            return self.reply(200, stand.search_page(search.group(1), search.group(2), page))
+        if detail:
+            stand.count("detail")
+            if stand.roll(stand.config.rate_404):
+                stand.count("404")
+                return self.reply(404, "<html><body>Обявата не е намерена</body></html>")
+            return self.reply(200, stand.detail_page(detail.group(1)))
+        if path.startswith("/photos/"):
+            stand.count("photo")
+            # одна квартира у нескольких агентств: фото повторяются под разными URL
+            listing_id, _, number = path[len("/photos/"):].rpartition("_")
+            apartment = int(hashlib.sha1(listing_id.encode()).hexdigest(), 16) % 40
+            body = hashlib.sha256(f"{apartment}_{number}".encode()).digest() * 64
+            return self.reply(200, body, content_type="image/jpeg")
+        return self.reply(404, "<html><body>Not found</body></html>")
+
+    def reply(self, status: int, body, content_type: str = "text/html; charset=windows-1251"):
+        data = body if isinstance(body, bytes) else body.encode("cp1251", errors="replace")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    server = FakeImotServer(port=8765).start()
+    print(f"Стенд imot.bg: {server.base_url}/obiavi/prodazhbi/grad-sofiya/druzhba-1")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
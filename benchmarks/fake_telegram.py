@@ -0,0 +1,109 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Imot", "username": "imot_test_bot"}
+
+
+class FakeTelegramServer:
+    """
+    Локальная замена Bot API: отвечает на методы, которые вызывает бот,
+    и запоминает, когда какой чат получил сообщение (для замера задержки ответа).
+    Бот направляется сюда через TELEGRAM_BASE_URL.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.replies = {}  # chat_id -> время первого сообщения (time.perf_counter)
+        self.webhook = None
+        self.message_id = 0
+        self.replied = threading.Condition(self.lock)
+        handler = type("FakeTelegramHandler", (_Handler,), {"stand": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeTelegramServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fake-telegram", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def wait_replies(self, count: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self.replied:
+            while len(self.replies) < count:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self.replied.wait(left)
+        return True
+
+    def call(self, method: str, params: dict):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if method == "getMe":
+                return BOT_USER
+            if method == "setWebhook":
+                self.webhook = params.get("url")
+                return True
+            if method == "deleteWebhook":
+                self.webhook = None
+                return True
+            if method in ("sendMessage", "editMessageText", "sendDocument"):
+                chat_id = int(params.get("chat_id", 0))
+                self.message_id += 1
+                self.replies.setdefault(chat_id, time.perf_counter())
+                self.replied.notify_all()
+                return {"message_id": self.message_id, "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+            return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    stand: FakeTelegramServer = None
+
+    def do_POST(self):
+        match = re.match(r"^/bot[^/]+/(\w+)$", urlparse(self.path).path)
+        if not match:
+            return self.reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(body or b"{}")
+        else:
+            params = dict(parse_qsl(body.decode("utf-8")))
+        self.reply(200, {"ok": True, "result": self.stand.call(match.group(1), params)})
+
+    do_GET = do_POST
+
+    def reply(self, status: int, payload: dict):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,59 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, которых не должно быть при старте бота: грузятся лениво при первом экспорте
+HEAVY_MODULES = ("pandas", "sqlalchemy", "openpyxl", "numpy", "twisted", "scrapy", "excel_exporter")
+
+LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def measure(module: str):
+    """Импорт модуля в чистом интерпретаторе с -X importtime; возвращает {модуль: (self_us, cumulative_us)}"""
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", "0:import-benchmark")
+    env["METRICS_PORT"] = "0"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Импорт {module} завершился с ошибкой:\n{proc.stderr[-2000:]}")
+    timings = {}
+    for line in proc.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            timings[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бюджет времени импорта бота (-X importtime)")
+    parser.add_argument("--module", default="bot")
+    parser.add_argument("--budget-ms", type=float, default=500, help="допустимое время импорта")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    timings = measure(args.module)
+    total_ms = timings[args.module][1] / 1000
+    print(f"Импорт {args.module}: {total_ms:.1f} мс (бюджет {args.budget_ms:.0f} мс)")
+    for name, (_, cumulative) in sorted(timings.items(), key=lambda kv: -kv[1][1])[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} мс  {name}")
+
+    heavy = sorted({name.split(".")[0] for name in timings} & set(HEAVY_MODULES))
+    failed = False
+    if heavy:
+        print(f"❌ При старте загружены тяжёлые модули: {', '.join(heavy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"❌ Время импорта {total_ms:.1f} мс превышает бюджет {args.budget_ms:.0f} мс")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
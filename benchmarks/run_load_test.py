@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "imot_bg.settings")
+
+from scrapy.crawler import CrawlerProcess  # noqa: E402
+from scrapy.utils.project import get_project_settings  # noqa: E402
+
+from benchmarks.fake_imot import FakeImotConfig, FakeImotServer  # noqa: E402
+from imot_bg import metrics  # noqa: E402
+from imot_bg.profiling import peak_rss_mb  # noqa: E402
+from imot_bg.spiders.imot_debug import ImotBgSpider  # noqa: E402
+from imot_bg.targets import CrawlTarget  # noqa: E402
+
+HTTP_HANDLER = "scrapy.core.downloader.handlers.http.HTTPDownloadHandler"
+
+
+def build_settings(args, stand: FakeImotServer, workdir: str):
+    """Настройки проекта, перенаправленные на локальный стенд и одноразовое хранилище"""
+    settings = get_project_settings()
+    overrides = {
+        "IMOT_BASE_URL": stand.base_url,
+        "IMOT_SEARCH_PLAYWRIGHT": args.playwright,
+        "CONCURRENT_REQUESTS": args.concurrency,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": args.concurrency,
+        "DOWNLOAD_DELAY": 0,
+        "AUTOTHROTTLE_ENABLED": False,
+        "RETRY_TIMES": 2,
+        "METRICS_PORT": 0,
+        "METRICS_SUMMARY_DIR": workdir,
+        "JOBS_DIR": workdir,
+        "DEADLETTER_PATH": os.path.join(workdir, "deadletter", "deadletter.jsonl"),
+        "DISTRICT_CATALOG_PATH": os.path.join(workdir, "districts.json"),
+        "LOG_LEVEL": args.log_level,
+        "TELNETCONSOLE_ENABLED": False,
+    }
+    if not args.playwright:
+        overrides["DOWNLOAD_HANDLERS"] = {"http": HTTP_HANDLER, "https": HTTP_HANDLER}
+    if args.postgres:
+        # одноразовая БД Postgres задаётся через DB_* в окружении
+        overrides["ITEM_PIPELINES"] = {"imot_bg.pipelines.PostgresPipeline": 300}
+    else:
+        overrides["ITEM_PIPELINES"] = {"benchmarks.sqlite_pipeline.SqlitePipeline": 300}
+        overrides["BENCHMARK_SQLITE_PATH"] = os.path.join(workdir, "listings.sqlite")
+    if args.images:
+        # общий каталог фото между запусками — проверка пропуска уже сохранённых URL
+        images_dir = args.images_dir or os.path.join(workdir, "images")
+        overrides["ITEM_PIPELINES"]["imot_bg.pipelines.ListingImagesPipeline"] = 200
+        overrides["FILES_STORE"] = images_dir
+        overrides["IMAGES_INDEX_PATH"] = os.path.join(images_dir, "index.sqlite")
+    settings.setdict(overrides, priority="cmdline")
+    return settings
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="imot_bench_")
+    config = FakeImotConfig(
+        pages=args.pages, per_page=args.per_page, latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms, captcha_rate=args.captcha_rate, rate_429=args.rate_429,
+        rate_404=args.rate_404,
+    )
+    targets = [CrawlTarget("sofia", f"district-{n}") for n in range(1, args.districts + 1)]
+
+    with FakeImotServer(config, port=args.stand_port) as stand:
+        process = CrawlerProcess(build_settings(args, stand, workdir))
+        crawler = process.create_crawler(ImotBgSpider)
+        process.crawl(crawler, targets=targets, job_id="benchmark")
+        started = time.perf_counter()
+        process.start()
+        elapsed = time.perf_counter() - started
+        served = dict(stand.stats)
+
+    items = crawler.stats.get_value("item_scraped_count", 0)
+    p50, p95 = metrics.FETCH_SECONDS.quantile(0.5), metrics.FETCH_SECONDS.quantile(0.95)
+    return {
+        "targets": len(targets),
+        "expected_listings": len(targets) * args.pages * args.per_page,
+        "items": items,
+        # районы, которым PostgresPipeline засчитал бы пропуск обхода (без капчи и ошибок)
+        "completed_targets": sorted(district for _, district in crawler.spider.completed or ()),
+        "dead_letters": {key.split("/", 1)[1]: value for key, value in crawler.stats.get_stats().items()
+                         if key.startswith("deadletter/")},
+        "files": {key.split("/", 1)[1]: value for key, value in crawler.stats.get_stats().items()
+                  if key.startswith("file_status_count/")},
+        "elapsed_seconds": round(elapsed, 2),
+        "listings_per_second": round(items / elapsed, 2) if elapsed else None,
+        "request_latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+        "request_latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "server": served,
+        "workdir": workdir,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест паука на локальном стенде imot.bg")
+    parser.add_argument("--districts", type=int, default=1, help="число районов (целей) в одном задании")
+    parser.add_argument("--pages", type=int, default=5, help="страниц выдачи на район")
+    parser.add_argument("--per-page", type=int, default=20, help="объявлений на странице")
+    parser.add_argument("--latency-ms", type=float, default=50, help="средняя задержка ответа стенда")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--captcha-rate", type=float, default=0.0, help="доля страниц выдачи с капчей")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--rate-404", type=float, default=0.0, help="доля снятых объявлений (404)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--playwright", action="store_true", help="грузить выдачу через Playwright")
+    parser.add_argument("--postgres", action="store_true", help="писать в Postgres из DB_* вместо SQLite")
+    parser.add_argument("--images", action="store_true", help="качать фото через ListingImagesPipeline")
+    parser.add_argument("--stand-port", type=int, default=0, help="фиксированный порт стенда (URL фото не меняются)")
+    parser.add_argument("--images-dir", help="каталог хранилища фото (по умолчанию — во временном каталоге)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="сохранить отчёт в JSON-файл")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
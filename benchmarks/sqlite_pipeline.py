@@ -0,0 +1,78 @@
+import json
+import sqlite3
+
+from itemadapter import ItemAdapter
+
+from imot_bg import metrics
+from imot_bg.items import ImotItem
+
+COLUMNS = ImotItem.DB_COLUMNS
+
+
+class SqlitePipeline:
+    """
+    Одноразовое хранилище для нагрузочных тестов: тот же порядок работы,
+    что у PostgresPipeline (кортежи ImotItem.as_db_row, upsert пачкой по source_id), но в SQLite.
+    """
+
+    def __init__(self, path, commit_batch=50):
+        self.path = path
+        self.commit_batch = max(1, commit_batch)
+        self.conn = None
+        self.pending_rows = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            path=crawler.settings.get('BENCHMARK_SQLITE_PATH', 'benchmark.sqlite'),
+            commit_batch=crawler.settings.getint('PIPELINE_COMMIT_BATCH', 50),
+        )
+
+    def open_spider(self, spider):
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS sofia_apartments "
+            f"({', '.join(COLUMNS)}, PRIMARY KEY (source_id))"
+        )
+
+    def close_spider(self, spider):
+        if self.conn:
+            self.commit(spider)
+            self.conn.close()
+
+    def commit(self, spider):
+        if self.pending_rows:
+            with metrics.DB_INSERT_SECONDS.time():
+                self.conn.executemany(
+                    f"INSERT OR REPLACE INTO sofia_apartments ({', '.join(COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                    [tuple(self.to_sqlite(v) for v in row) for row in self.pending_rows.values()],
+                )
+        with metrics.DB_COMMIT_SECONDS.time():
+            self.conn.commit()
+        stored_ids = list(self.pending_rows)
+        self.pending_rows = {}
+        if stored_ids:
+            metrics.DB_BATCH_SIZE.observe(len(stored_ids))
+        checkpoint = getattr(spider, 'checkpoint', None)
+        if checkpoint and stored_ids:
+            checkpoint.mark_stored(stored_ids)
+
+    @staticmethod
+    def to_sqlite(value):
+        if hasattr(value, 'isoformat'):
+            return str(value)
+        if isinstance(value, list):
+            return json.dumps(value, ensure_ascii=False)
+        return value
+
+    def process_item(self, item, spider):
+        if isinstance(item, ImotItem):
+            row = item.as_db_row()
+        else:
+            adapter = ItemAdapter(item)
+            row = tuple(adapter.get(column) for column in COLUMNS)
+        self.pending_rows[row[0]] = row
+        if len(self.pending_rows) >= self.commit_batch:
+            self.commit(spider)
+        return item
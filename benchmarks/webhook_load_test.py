@@ -0,0 +1,144 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.fake_telegram import FakeTelegramServer  # noqa: E402
+
+BOT_LAUNCHER = os.path.join(ROOT_DIR, "bot_launcher.py")
+WEBHOOK_PATH = "/telegram"
+SECRET = "benchmark-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_update(update_id: int, chat_id: int) -> dict:
+    """Обновление Telegram: пользователь chat_id отправляет /start"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+def wait_healthy(port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/healthz")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Вебхук не поднялся на порту {port} за {timeout} с")
+
+
+def percentile(values, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="imot_webhook_")
+    port = free_port()
+    with FakeTelegramServer(latency_ms=args.api_latency_ms) as telegram:
+        env = {
+            **os.environ,
+            "BOT_TOKEN": "123456:benchmark",
+            "TELEGRAM_BASE_URL": telegram.base_url,
+            "WEBHOOK_URL": f"http://127.0.0.1:{port}",
+            "WEBHOOK_LISTEN": "127.0.0.1",
+            "WEBHOOK_SECRET": SECRET,
+            "METRICS_PORT": "0",
+            "DB_HOST": "",  # без БД: рассылка уведомлений не запускается
+        }
+        bot = subprocess.Popen(
+            [sys.executable, BOT_LAUNCHER, "--mode", "webhook", "--port", str(port),
+             "--concurrency", str(args.concurrency)],
+            cwd=workdir, env=env,
+        )
+        try:
+            wait_healthy(port, timeout=30)
+
+            def send(chat_id: int) -> float:
+                body = json.dumps(start_update(chat_id, chat_id))
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                sent = time.perf_counter()
+                conn.request("POST", WEBHOOK_PATH, body, {
+                    "Content-Type": "application/json",
+                    "X-Telegram-Bot-Api-Secret-Token": SECRET,
+                })
+                status = conn.getresponse().status
+                conn.close()
+                if status != 200:
+                    raise RuntimeError(f"Вебхук ответил {status}")
+                return sent
+
+            chat_ids = range(1000, 1000 + args.updates)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.clients) as pool:
+                sent_at = dict(zip(chat_ids, pool.map(send, chat_ids)))
+            complete = telegram.wait_replies(args.updates, timeout=60)
+            elapsed = time.perf_counter() - started
+            latencies = [telegram.replies[c] - sent_at[c] for c in chat_ids if c in telegram.replies]
+        finally:
+            bot.terminate()
+            bot.wait(timeout=30)
+
+    p50, p95 = percentile(latencies, 0.5), percentile(latencies, 0.95)
+    return {
+        "updates": args.updates,
+        "answered": len(latencies),
+        "complete": complete,
+        "concurrent_updates": args.concurrency,
+        "api_latency_ms": args.api_latency_ms,
+        "elapsed_seconds": round(elapsed, 2),
+        "updates_per_second": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "reply_latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+        "reply_latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        "webhook_registered": telegram.webhook,
+        "api_calls": dict(telegram.calls),
+        "workdir": workdir,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота в режиме вебхука на фейковом Bot API")
+    parser.add_argument("--updates", type=int, default=200, help="сколько пользователей отправят /start")
+    parser.add_argument("--clients", type=int, default=20, help="параллельных HTTP-клиентов вебхука")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent_updates бота")
+    parser.add_argument("--api-latency-ms", type=float, default=50, help="задержка ответа фейкового Bot API")
+    parser.add_argument("--output", help="сохранить отчёт в JSON-файл")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,32 @@
 import logging
 import os
 import sys
+import json
+import re
+import time
 import asyncio
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, Message
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, CallbackQueryHandler,
-    ContextTypes, ConversationHandler
+    Application, ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler,
+    ContextTypes, ConversationHandler, filters
 )
 from dotenv import load_dotenv
-from excel_exporter import ExcelExporter
+from imot_bg import metrics
+from imot_bg.profiling import profiled, profiling_enabled
+from imot_bg.logging_utils import setup_queue_logging
+from imot_bg.targets import listing_id_from_url
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 SPIDER_SCRIPT = os.path.join(SCRIPT_DIR, "run_spider_async.py")
 
-# Логирование
-logging.basicConfig(
+# Логирование: запись в файл в фоновом потоке, не в цикле событий бота
+setup_queue_logging(
+    "bot.log",
     level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.FileHandler("bot.log"), logging.StreamHandler()]
+    json_format=os.getenv("LOG_JSON", "").lower() in ("1", "true", "yes"),
 )
 logger = logging.getLogger(__name__)
 
@@ -30,6 +39,161 @@ if not BOT_TOKEN:
 
 SELECTING_ACTION, SELECTING_DISTRICT, SELECTING_PROPERTY_TYPE = range(3)
 
+PROPERTY_TYPES = ["1-СТАЕН", "2-СТАЕН", "3-СТАЕН", "4-СТАЕН", "5-СТАЕН", "МНОГОСТАЕН", "ГАРАЖ"]
+# callback_data кнопок состояний диалога: слаг района и тип недвижимости. Явные шаблоны,
+# чтобы кнопки вне диалога (alert_del:, partial_export:, restart) не принимались за район/тип
+DISTRICT_CALLBACK = r"^(?!(?:restart|subscribe)$)[a-z0-9-]+$"
+PROPERTY_TYPE_CALLBACK = "^(" + "|".join(PROPERTY_TYPES) + "|all)$"
+
+# Снимок оценщика перечитывается после парсинга и не реже, чем раз в N секунд
+VALUATION_MAX_AGE = float(os.getenv("VALUATION_MAX_AGE", "3600"))
+
+# Каталог районов: кэш паука imot_districts и его срок жизни (см. DISTRICT_CATALOG_* в settings.py)
+DISTRICT_CATALOG_PATH = os.getenv("DISTRICT_CATALOG_PATH", "cache/districts.json")
+DISTRICT_CATALOG_TTL = float(os.getenv("DISTRICT_CATALOG_TTL", str(7 * 24 * 3600)))
+DISTRICTS_PER_PAGE = 10
+
+# Как часто проверять alert_outbox (0 — не рассылать уведомления)
+ALERTS_POLL_SECONDS = float(os.getenv("ALERTS_POLL_SECONDS", "30"))
+
+# Не чаще одного редактирования статуса в N секунд (лимиты Telegram на edit)
+PROGRESS_EDIT_INTERVAL = float(os.getenv("BOT_PROGRESS_INTERVAL", "5"))
+
+# Режим получения обновлений: polling или webhook (встроенный сервер imot_bg.webhook)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Сколько обновлений обрабатывается одновременно (1 — строго по очереди);
+# обновления одного чата всё равно идут по очереди (ChatSerializedApplication)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "32"))
+# Слоты PTB: апдейт занимает слот, ещё ожидая очереди своего чата, поэтому с запасом
+PTB_UPDATE_SLOTS = 256
+CHAT_PENDING_LIMIT = 2  # Апдейтов чата в ожидании сверх обрабатываемого; остальные отбрасываются
+# Другой адрес Bot API (локальный сервер Bot API или фейковый эндпоинт в тестах)
+TELEGRAM_BASE_URL = os.getenv("TELEGRAM_BASE_URL")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публичный https-адрес; без него setWebhook не вызывается
+# Без WEBHOOK_SECRET вебхук слушает только loopback (за обратным прокси)
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Обязателен с WEBHOOK_URL или WEBHOOK_LISTEN не loopback
+
+
+class ChatSerializedApplication(Application):
+    """
+    Application, в котором обновления одного чата обрабатываются строго по очереди,
+    а разных чатов — параллельно. Иначе состояние ConversationHandler не сериализуется:
+    двойное нажатие кнопки типа недвижимости запускало бы два экспорта.
+    Семафор concurrent_updates у PTB занимается до process_update, поэтому он берётся
+    с запасом (PTB_UPDATE_SLOTS), а предел update_limit — собственный семафор, который
+    занимается уже под блокировкой чата: ждущие своей очереди апдейты не держат слоты
+    других чатов. У чата не больше CHAT_PENDING_LIMIT ждущих апдейтов, лишние
+    отбрасываются (на нажатие кнопки — ответ «подождите»).
+    """
+
+    def __init__(self, update_limit: int = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.update_slots = asyncio.Semaphore(update_limit)
+        self.update_limit = update_limit
+        self.chat_locks: Dict[int, asyncio.Lock] = {}
+        self.chat_waiting: Dict[int, int] = {}
+
+    async def process_update(self, update: object) -> None:
+        chat = (update.effective_chat or update.effective_user) if isinstance(update, Update) else None
+        if chat is None:
+            async with self.update_slots:
+                return await super().process_update(update)
+        key = chat.id
+        if self.chat_waiting.get(key, 0) > CHAT_PENDING_LIMIT:
+            # один обрабатывается, CHAT_PENDING_LIMIT ждут — повторные нажатия не копим
+            logger.info(f"⏳ Апдейт чата {key} отброшен: предыдущие ещё обрабатываются")
+            if update.callback_query:
+                await update.callback_query.answer("⏳ Подождите, предыдущий запрос ещё выполняется")
+            return
+        lock = self.chat_locks.setdefault(key, asyncio.Lock())
+        self.chat_waiting[key] = self.chat_waiting.get(key, 0) + 1
+        try:
+            async with lock, self.update_slots:
+                await super().process_update(update)
+        finally:
+            self.chat_waiting[key] -= 1
+            if not self.chat_waiting[key]:
+                del self.chat_waiting[key], self.chat_locks[key]
+
+@dataclass
+class CrawlJob:
+    """Идущий парсинг района: его статус-сообщения, последний прогресс и запросы частичного отчёта"""
+    district: str
+    messages: List[Message] = field(default_factory=list)
+    progress: Dict = field(default_factory=dict)
+    last_text: str = ""
+    last_edit: float = 0.0
+    partial_running: bool = False
+
+    def title(self) -> str:
+        return self.district.replace('-', ' ').title()
+
+    async def set_status(self, text: str, running: bool = True, force: bool = False) -> None:
+        """Редактирование статус-сообщений с ограничением частоты; одинаковый текст не отправляется"""
+        now = time.monotonic()
+        if text == self.last_text or (not force and now - self.last_edit < PROGRESS_EDIT_INTERVAL):
+            return
+        self.last_text, self.last_edit = text, now
+        markup = progress_keyboard(self.district) if running else None
+        for message in self.messages:
+            try:
+                await message.edit_text(text, reply_markup=markup)
+            except TelegramError as e:
+                logger.debug(f"Статус не обновлён: {e}")
+
+
+def progress_keyboard(district: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("📄 Частичный отчёт", callback_data=f"partial_export:{district}")]
+    ])
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "оценивается..."
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"~{minutes} мин {seconds} с" if minutes else f"~{seconds} с"
+
+
+def format_progress(job: CrawlJob) -> str:
+    p = job.progress
+    return (
+        f"🔍 Парсинг: {job.title()}\n"
+        f"📄 Страниц: {p.get('pages_done', 0)}/{p.get('pages_total', 0)}\n"
+        f"🏠 Объявлений: {p.get('listings_done', 0)}/{p.get('listings_total', 0)}\n"
+        f"💾 Сохранено: {p.get('stored', 0)}\n"
+        f"⚠️ Ошибок: {p.get('errors', 0)}\n"
+        f"⏱ Осталось: {format_duration(p.get('eta'))}"
+    )
+
+async def export_report(city: str, district: str, **kwargs) -> tuple:
+    """
+    Экспорт в Excel в рабочем потоке, чтобы не блокировать цикл событий бота.
+    excel_exporter (pandas, SQLAlchemy, openpyxl) импортируется при первом экспорте,
+    а не при старте бота. Возвращает путь к файлу и новую отметку "только новых"
+    (None для остальных отчётов) — её сохраняет save_watermark после отправки файла.
+    """
+    def work():
+        from excel_exporter import ExcelExporter
+        exporter = ExcelExporter()
+        return exporter.export_to_excel(city, district, **kwargs), exporter.watermark
+
+    return await asyncio.to_thread(work)
+
+async def save_watermark(user_id: int, city: str, district: str, keyword: Optional[str], watermark) -> None:
+    def work():
+        from excel_exporter import ExcelExporter
+        exporter = ExcelExporter()
+        try:
+            exporter.save_watermark(user_id, city, district, keyword, watermark)
+        finally:
+            exporter.close()
+
+    await asyncio.to_thread(work)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user
     logger.info(f"/start от {user.id}")
@@ -38,6 +202,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def show_action_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, user) -> int:
     keyboard = [
         [InlineKeyboardButton("📦 Из базы", callback_data="from_cache")],
+        [InlineKeyboardButton("🆕 Только новые", callback_data="only_new")],
         [InlineKeyboardButton("🔄 Новый поиск", callback_data="new_search")]
     ]
     markup = InlineKeyboardMarkup(keyboard)
@@ -51,17 +216,104 @@ async def show_action_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, u
 
     return SELECTING_ACTION
 
+def district_catalog(application):
+    """
+    Каталог районов из кэша паука imot_districts (перечитывается при изменении файла).
+    Устаревший или отсутствующий каталог обновляется в фоне, а пока отдаётся что есть;
+    попытки обновления — не чаще раза в DISTRICT_CATALOG_TTL / 10.
+    """
+    from imot_bg.districts import DistrictCatalog
+    try:
+        mtime = os.path.getmtime(DISTRICT_CATALOG_PATH)
+    except OSError:
+        mtime = None
+    cached = application.bot_data.get("district_catalog")
+    if cached is None or cached[0] != mtime:
+        cached = application.bot_data["district_catalog"] = (mtime, DistrictCatalog.load(DISTRICT_CATALOG_PATH))
+    catalog = cached[1]
+    if (not catalog.is_fresh("sofia", DISTRICT_CATALOG_TTL)
+            and not application.bot_data.get("districts_refresh")
+            # неудачное или пустое обновление не перезапускается на каждой клавиатуре
+            and time.monotonic() - application.bot_data.get("districts_attempt", float("-inf"))
+            >= DISTRICT_CATALOG_TTL / 10):
+        application.bot_data["districts_attempt"] = time.monotonic()
+        application.bot_data["districts_refresh"] = application.create_task(refresh_districts(application))
+    return catalog
+
+async def refresh_districts(application) -> None:
+    logger.info("🗺 Обновляю каталог районов")
+    try:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, SPIDER_SCRIPT, "sofia", "--refresh-districts",
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+            env={**os.environ, "SPIDER_LOG_CONSOLE_LEVEL": "WARNING"}
+        )
+        return_code = await process.wait()
+        if return_code != 0:
+            logger.error(f"❌ Обновление каталога районов завершилось с кодом {return_code}")
+    finally:
+        application.bot_data.pop("districts_refresh", None)
+
+def districts_keyboard(districts: List[Dict], page: int) -> InlineKeyboardMarkup:
+    pages = max(1, -(-len(districts) // DISTRICTS_PER_PAGE))
+    page = min(max(page, 0), pages - 1)
+    chunk = districts[page * DISTRICTS_PER_PAGE:(page + 1) * DISTRICTS_PER_PAGE]
+    buttons = [
+        InlineKeyboardButton(f"{d['name']} ({d['count']})" if d.get("count") else d["name"], callback_data=d["slug"])
+        for d in chunk
+    ]
+    keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ Назад", callback_data=f"dpage:{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("Далее ▶️", callback_data=f"dpage:{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    return InlineKeyboardMarkup(keyboard)
+
+async def show_districts(query, context: ContextTypes.DEFAULT_TYPE, page: int = 0) -> None:
+    districts = district_catalog(context.application).districts("sofia")
+    pages = max(1, -(-len(districts) // DISTRICTS_PER_PAGE))
+    page = min(max(page, 0), pages - 1)
+    text = "🏙 Выберите район или напишите его название"
+    if pages > 1:
+        text += f" (стр. {page + 1}/{pages})"
+    await query.edit_message_text(text + ":", reply_markup=districts_keyboard(districts, page))
+
 async def select_district(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
     context.user_data["mode"] = query.data
+    await show_districts(query, context)
+    return SELECTING_DISTRICT
 
-    keyboard = [
-        [InlineKeyboardButton("Люлин 5", callback_data="lyulin-5")],
-        [InlineKeyboardButton("Дружба 1", callback_data="druzhba-1")],
-        [InlineKeyboardButton("Лозенец", callback_data="lozenets")]
-    ]
-    await query.edit_message_text("🏙 Выберите район:", reply_markup=InlineKeyboardMarkup(keyboard))
+async def district_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    await show_districts(query, context, int(query.data.split(":", 1)[1]))
+    return SELECTING_DISTRICT
+
+async def district_by_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Район, введённый текстом в любом написании: 'младост 3', 'Mladost3', 'кв. Младост-3'"""
+    import difflib
+    from imot_bg.districts import slugify_district
+    catalog = district_catalog(context.application)
+    districts = {d["slug"]: d for d in catalog.districts("sofia")}
+    slug = catalog.resolve("sofia", update.message.text)
+    if slug in districts:
+        matches = [slug]
+    else:
+        matches = difflib.get_close_matches(slugify_district(update.message.text), list(districts), n=4, cutoff=0.6)
+    if not matches:
+        await update.message.reply_text("🤷 Такого района нет в каталоге. Выберите из списка или попробуйте другое написание.")
+        return SELECTING_DISTRICT
+    keyboard = [[InlineKeyboardButton(districts[m]["name"], callback_data=m)] for m in matches]
+    await update.message.reply_text(
+        "✅ Нашёл район:" if len(matches) == 1 else "🔎 Возможно, вы имели в виду:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
     return SELECTING_DISTRICT
 
 async def handle_district(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -72,17 +324,10 @@ async def handle_district(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     context.user_data["district"] = district
     mode = context.user_data.get("mode")
 
-    if mode == "from_cache":
-        keyboard = [
-            [InlineKeyboardButton("1-СТАЕН", callback_data="1-СТАЕН"),
-             InlineKeyboardButton("2-СТАЕН", callback_data="2-СТАЕН")],
-            [InlineKeyboardButton("3-СТАЕН", callback_data="3-СТАЕН"),
-             InlineKeyboardButton("4-СТАЕН", callback_data="4-СТАЕН")],
-            [InlineKeyboardButton("5-СТАЕН", callback_data="5-СТАЕН"),
-             InlineKeyboardButton("МНОГОСТАЕН", callback_data="МНОГОСТАЕН")],
-            [InlineKeyboardButton("ГАРАЖ", callback_data="ГАРАЖ")],
-            [InlineKeyboardButton("ВСЕ ТИПЫ", callback_data="all")]
-        ]
+    if mode in ("from_cache", "only_new"):
+        buttons = [InlineKeyboardButton(t, callback_data=t) for t in PROPERTY_TYPES]
+        keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+        keyboard.append([InlineKeyboardButton("ВСЕ ТИПЫ", callback_data="all")])
         await query.edit_message_text(
             "🏘 Выберите тип недвижимости:",
             reply_markup=InlineKeyboardMarkup(keyboard)
@@ -91,100 +336,499 @@ async def handle_district(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
     else:
-        loading_msg = await query.edit_message_text("🔍 Запускаю парсинг новых объявлений...")
-        logger.info(f"🚀 Запуск Scrapy: {sys.executable} {SPIDER_SCRIPT} sofia {district} true")
-
-        try:
-            process = await asyncio.create_subprocess_exec(
-                sys.executable, SPIDER_SCRIPT, "sofia", district, "true",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+        crawls = context.application.bot_data.setdefault("crawls", {})
+        job = crawls.get(district)
+        if job:
+            # парсинг района уже идёт — подписываемся на него вместо второго паука
+            status_msg = await query.edit_message_text(
+                job.last_text or "⏳ Парсинг этого района уже идёт...",
+                reply_markup=progress_keyboard(district)
             )
-
-            async def log_stream(stream, name):
-                while True:
-                    line = await stream.readline()
-                    if not line:
-                        break
-                    logger.info(f"[{name}] {line.decode().rstrip()}")
+            job.messages.append(status_msg)
+            logger.info(f"⏳ Повторный запрос района {district}: подключён к идущему парсингу")
+            return SELECTING_ACTION
+
+        # задание регистрируется до первого await: параллельный запрос того же района из
+        # другого чата подключится к нему, а не запустит второго паука
+        job = crawls[district] = CrawlJob(district)
+        status_msg = await query.edit_message_text(
+            "🔍 Запускаю парсинг новых объявлений...",
+            reply_markup=progress_keyboard(district)
+        )
+        job.messages.append(status_msg)
+        # паук работает в фоне: обработчик не держит очередь апдейтов и кнопка частичного отчёта отвечает
+        context.application.create_task(run_crawl(job, context.application))
+        return SELECTING_ACTION
+
+class ProgressChannel:
+    """
+    Канал JSON-событий прогресса от паука: pipe с pass_fds на POSIX, на Windows
+    (нет pass_fds и connect_read_pipe для дескрипторов) — локальный TCP-сокет,
+    к которому паук подключается сам по IMOT_PROGRESS_ADDR.
+    """
+
+    def __init__(self):
+        self.env: Dict[str, str] = {}
+        self.pass_fds = ()
+        self.read_fd = None
+        self.write_fd = None
+        self.server = None
+        self.connected = None
+        self.transport = None
+
+    async def open(self) -> "ProgressChannel":
+        if os.name == "nt":
+            self.connected = asyncio.get_running_loop().create_future()
+
+            async def on_connect(reader, writer):
+                if self.connected.done():
+                    writer.close()  # второе подключение не ждём
+                else:
+                    self.connected.set_result((reader, writer))
+
+            self.server = await asyncio.start_server(on_connect, "127.0.0.1", 0)
+            port = self.server.sockets[0].getsockname()[1]
+            self.env = {"IMOT_PROGRESS_ADDR": f"127.0.0.1:{port}"}
+        else:
+            self.read_fd, self.write_fd = os.pipe()
+            self.pass_fds = (self.write_fd,)
+            self.env = {"IMOT_PROGRESS_FD": str(self.write_fd)}
+        return self
+
+    def spawned(self) -> None:
+        """Подпроцесс запущен (или не запустился): пишущий конец pipe у бота больше не нужен"""
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    async def reader(self, process) -> Optional[asyncio.StreamReader]:
+        """Поток строк прогресса; None — паук завершился, так и не подключившись"""
+        if self.server is None:
+            reader = asyncio.StreamReader()
+            self.transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(self.read_fd, "rb", 0))
+            self.read_fd = None
+            return reader
+        exited = asyncio.ensure_future(process.wait())
+        await asyncio.wait({self.connected, exited}, return_when=asyncio.FIRST_COMPLETED)
+        exited.cancel()
+        if not self.connected.done():
+            return None
+        reader, self.transport = self.connected.result()
+        return reader
+
+    def close(self) -> None:
+        self.spawned()
+        if self.read_fd is not None:
+            os.close(self.read_fd)
+            self.read_fd = None
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+async def read_progress(job: CrawlJob, channel: ProgressChannel, process) -> None:
+    """Чтение JSON-событий прогресса паука из канала и обновление статуса"""
+    reader = await channel.reader(process)
+    if reader is None:
+        return
+    async for line in reader:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if event.get("event") in ("progress", "finished"):
+            job.progress = event
+            await job.set_status(format_progress(job))
+
+# уровень строки лога паука: текстовый формат "... [WARNING] ..." или JSON с "level"
+SPIDER_LEVEL_RE = re.compile(r'\[(DEBUG|INFO|WARNING|ERROR|CRITICAL)\]|"level": "(DEBUG|INFO|WARNING|ERROR|CRITICAL)"')
+
+def spider_line_level(text: str, default: int) -> int:
+    match = SPIDER_LEVEL_RE.search(text)
+    return logging.getLevelName(match.group(1) or match.group(2)) if match else default
+
+async def log_stream(stream, name):
+    # на stderr паук пишет только WARNING+ (и трейсбеки) — строки без уровня тоже WARNING,
+    # чтобы ошибки не понижались до INFO и не отсекались лимитом spider_output
+    default = logging.WARNING if name == "stderr" else logging.INFO
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        text = line.decode(errors="replace").rstrip()
+        logger.log(spider_line_level(text, default), "[%s] %s", name, text,
+                   extra={"event": "spider_output"})
+
+async def run_crawl(job: CrawlJob, application) -> None:
+    """Парсинг района в подпроцессе с каналом прогресса, затем отчёт всем подписанным чатам"""
+    district = job.district
+    crawls = application.bot_data["crawls"]
+    logger.info(f"🚀 Запуск Scrapy: {sys.executable} {SPIDER_SCRIPT} sofia {district} true")
+    try:
+        channel = await ProgressChannel().open()
+        try:
+            try:
+                # полный лог паук пишет в spider.log сам, в вывод — только предупреждения;
+                # прогресс — отдельным каналом (IMOT_PROGRESS_FD или IMOT_PROGRESS_ADDR)
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, SPIDER_SCRIPT, "sofia", district, "true",
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    pass_fds=channel.pass_fds,
+                    env={**os.environ, "SPIDER_LOG_CONSOLE_LEVEL": "WARNING", **channel.env}
+                )
+            finally:
+                channel.spawned()
 
             await asyncio.gather(
                 log_stream(process.stdout, "stdout"),
-                log_stream(process.stderr, "stderr")
+                log_stream(process.stderr, "stderr"),
+                read_progress(job, channel, process)
             )
+        finally:
+            channel.close()
 
-            return_code = await process.wait()
-            if return_code != 0:
-                logger.error(f"❌ Паук завершился с ошибкой: код {return_code}")
-                await loading_msg.edit_text("❌ Ошибка при парсинге. См. логи.")
-                return await offer_restart(update, context)
+        return_code = await process.wait()
+        if return_code != 0:
+            logger.error(f"❌ Паук завершился с ошибкой: код {return_code}")
+            await job.set_status("❌ Ошибка при парсинге. См. логи.", running=False, force=True)
+            return
 
-            logger.info("✅ Паук успешно завершён.")
-            await loading_msg.edit_text("✅ Парсинг завершён, формирую отчёт...")
+        logger.info("✅ Паук успешно завершён.")
+        # снимок оценщика устарел — перечитываем в фоне, если он уже загружен
+        if application.bot_data.get("valuation") is not None:
+            application.create_task(load_valuation(application, force=True))
+        await job.set_status("✅ Парсинг завершён, формирую отчёт...", running=False, force=True)
+        crawls.pop(district, None)
 
-            exporter = ExcelExporter()
-            export_path = exporter.export_to_excel("sofia", district)
+        export_path, _ = await export_report("sofia", district)
 
-            if not export_path or not os.path.exists(export_path):
-                logger.warning("⚠️ Отчёт не создан.")
-                await loading_msg.edit_text("⚠️ Не удалось сформировать отчёт.")
-                return await offer_restart(update, context)
+        if not export_path or not os.path.exists(export_path):
+            logger.warning("⚠️ Отчёт не создан.")
+            await job.set_status("⚠️ Не удалось сформировать отчёт.", running=False, force=True)
+            return
 
-            with open(export_path, "rb") as file:
-                await query.message.reply_document(
+        for message in job.messages:
+            with open(export_path, "rb") as file, metrics.TELEGRAM_UPLOAD_SECONDS.time():
+                await message.reply_document(
                     document=file,
                     filename=os.path.basename(export_path),
-                    caption=f"🏡 Результаты для района {district.replace('-', ' ').title()}"
+                    caption=f"🏡 Результаты для района {job.title()}"
                 )
 
-            return await offer_restart(update, context)
-
-        except Exception as e:
-            logger.exception("❌ Ошибка при парсинге:")
-            await loading_msg.edit_text(f"❌ Внутренняя ошибка: {str(e)}")
-            return ConversationHandler.END
+    except Exception as e:
+        logger.exception("❌ Ошибка при парсинге:")
+        await job.set_status(f"❌ Внутренняя ошибка: {str(e)}", running=False, force=True)
+    finally:
+        crawls.pop(district, None)
+        for message in job.messages:
+            try:
+                await send_restart_offer(message)
+            except TelegramError as e:
+                logger.warning(f"⚠️ Не удалось отправить предложение нового запроса: {e}")
+
+async def partial_export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отчёт по уже сохранённым объявлениям, не дожидаясь конца парсинга"""
+    query = update.callback_query
+    district = query.data.split(":", 1)[1]
+    job = context.application.bot_data.get("crawls", {}).get(district)
+    if not job:
+        await query.answer("Парсинг уже завершён — полный отчёт придёт отдельным сообщением")
+        return
+    if job.partial_running:
+        await query.answer("⏳ Частичный отчёт уже формируется")
+        return
+    job.partial_running = True
+    try:
+        await query.answer("📄 Формирую частичный отчёт...")
+        export_path, _ = await export_report("sofia", district)
+        if not export_path or not os.path.exists(export_path):
+            await query.message.reply_text("⚠️ Пока нечего выгружать.")
+            return
+        with open(export_path, "rb") as file, metrics.TELEGRAM_UPLOAD_SECONDS.time():
+            await query.message.reply_document(
+                document=file,
+                filename=os.path.basename(export_path),
+                caption=f"📄 Частичные результаты для района {job.title()} "
+                        f"(сохранено {job.progress.get('stored', 0)}, парсинг продолжается)"
+            )
+    finally:
+        job.partial_running = False
 
 async def handle_property_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
 
     selected_type = query.data
+    context.user_data["property_type"] = selected_type
     district = context.user_data.get("district")
-    logger.info(f"🏘 Тип недвижимости: {selected_type} | Район: {district}")
+    only_new = context.user_data.get("mode") == "only_new"
+    logger.info(f"🏘 Тип недвижимости: {selected_type} | Район: {district} | Только новые: {only_new}")
 
     msg = await query.edit_message_text("📦 Получаю данные из базы...")
 
     try:
-        exporter = ExcelExporter()
-        export_path = exporter.export_to_excel("sofia", district, keyword=None if selected_type == "all" else selected_type)
+        # "только новые" — изменения после отметки пользователя по этому району и типу
+        keyword = None if selected_type == "all" else selected_type
+        export_path, watermark = await export_report(
+            "sofia", district,
+            keyword=keyword,
+            user_id=update.effective_user.id,
+            only_new=only_new
+        )
+
+        if export_path is None and only_new:
+            await msg.edit_text("🆕 С прошлого отчёта новых или переоценённых объявлений нет.")
+            return await offer_restart(update, context, subscribe=True)
 
         if not export_path or not os.path.exists(export_path):
             logger.warning("⚠️ Отчёт не создан.")
             await msg.edit_text("⚠️ Не удалось сформировать отчёт.")
             return await offer_restart(update, context)
 
-        with open(export_path, "rb") as file:
+        with open(export_path, "rb") as file, metrics.TELEGRAM_UPLOAD_SECONDS.time():
             await query.message.reply_document(
                 document=file,
                 filename=os.path.basename(export_path),
-                caption=f"🏡 Результаты ({selected_type}) для района {district.replace('-', ' ').title()}"
+                caption=f"{'🆕 Новые и переоценённые' if only_new else '🏡 Результаты'} ({selected_type}) "
+                        f"для района {district.replace('-', ' ').title()}"
             )
+        if watermark is not None:
+            # файл доставлен — следующая дельта начнётся отсюда
+            await save_watermark(update.effective_user.id, "sofia", district, keyword, watermark)
 
-        return await offer_restart(update, context)
+        return await offer_restart(update, context, subscribe=True)
 
     except Exception as e:
         logger.exception("❌ Ошибка при обработке отчета:")
         await msg.edit_text(f"❌ Внутренняя ошибка: {str(e)}")
         return ConversationHandler.END
 
-async def offer_restart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def send_restart_offer(message: Message, subscribe: bool = False) -> None:
     keyboard = [[InlineKeyboardButton("🔄 Новый запрос", callback_data="restart")]]
-    await update.callback_query.message.reply_text(
+    if subscribe:
+        keyboard.append([InlineKeyboardButton("🔔 Уведомлять о новых", callback_data="subscribe")])
+    await message.reply_text(
         "✅ Готово! Хотите выполнить новый запрос?",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
+
+async def offer_restart(update: Update, context: ContextTypes.DEFAULT_TYPE, subscribe: bool = False) -> int:
+    await send_restart_offer(update.callback_query.message, subscribe=subscribe)
+    return SELECTING_ACTION
+
+async def alerts_call(application, method: str, *args):
+    """
+    Вызов AlertStore в рабочем потоке. Хранилище (psycopg2) создаётся при первом
+    обращении; одно соединение на бота, вызовы сериализуются блокировкой.
+    """
+    lock = application.bot_data.setdefault("alerts_lock", asyncio.Lock())
+    async with lock:
+        def work():
+            from imot_bg.alerts import AlertStore
+            store = application.bot_data.get("alert_store")
+            if store is None:
+                store = application.bot_data["alert_store"] = AlertStore()
+            return getattr(store, method)(*args)
+
+        return await asyncio.to_thread(work)
+
+def parse_alert_args(args: List[str], catalog) -> Dict:
+    """
+    /alert <район> [rooms=2|3+] [price=80000-120000] [area=60] [type=2-СТАЕН] [balcony] [metro]
+    Район — в любом написании ('младост 3', 'Mladost3'), сводится к слагу каталога,
+    как у объявлений в базе: иначе поиск сохранился бы, но никогда не сработал.
+    """
+    import difflib
+    from imot_bg.districts import slugify_district
+    words = []
+    for arg in args:
+        if "=" in arg or arg.lower() in ("balcony", "metro"):
+            break
+        words.append(arg)
+    if not words:
+        raise ValueError("укажите район")
+    name = " ".join(words)
+    district = catalog.resolve("sofia", name)
+    if district is None:
+        slugs = [d["slug"] for d in catalog.districts("sofia")]
+        matches = difflib.get_close_matches(slugify_district(name), slugs, n=3, cutoff=0.6)
+        hint = f" Возможно: {', '.join(matches)}" if matches else ""
+        raise ValueError(f"района «{name}» нет в каталоге.{hint}")
+    criteria = {"district": district}
+    for arg in args[len(words):]:
+        key, _, value = arg.partition("=")
+        key = key.lower()
+        if key == "rooms":
+            if value != "3+":
+                int(value)
+            criteria["rooms"] = value
+        elif key == "price":
+            low, _, high = value.partition("-")
+            criteria["min_price"] = float(low) if low else None
+            criteria["max_price"] = float(high) if high else None
+        elif key == "area":
+            criteria["min_area"] = float(value)
+        elif key == "type":
+            criteria["keyword"] = value
+        elif key in ("balcony", "metro"):
+            criteria["balcony" if key == "balcony" else "near_metro"] = True
+        else:
+            raise ValueError(f"неизвестный параметр {arg}")
+    return criteria
+
+async def save_search(update: Update, context: ContextTypes.DEFAULT_TYPE, criteria: Dict) -> None:
+    from imot_bg.alerts import SavedSearch
+    search = SavedSearch(id=None, user_id=update.effective_user.id, city="sofia", **criteria)
+    search.id = await alerts_call(context.application, "save_search", search)
+    logger.info(f"🔔 Сохранён поиск {search.id} пользователя {search.user_id}: {search.describe()}")
+    await update.effective_message.reply_text(
+        f"🔔 Буду присылать новые объявления: {search.describe()}\nСписок подписок — /alerts"
+    )
+
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Подписка на район и тип недвижимости последнего отчёта"""
+    query = update.callback_query
+    await query.answer()
+    district = context.user_data.get("district")
+    if not district:
+        await query.message.reply_text("⚠️ Сначала выберите район.")
+        return SELECTING_ACTION
+    property_type = context.user_data.get("property_type")
+    keyword = None if property_type in (None, "all") else property_type
+    await save_search(update, context, {"district": district, "keyword": keyword})
     return SELECTING_ACTION
 
+async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        criteria = parse_alert_args(context.args, district_catalog(context.application))
+    except ValueError as e:
+        await update.message.reply_text(
+            f"⚠️ {e}\nПример: /alert lyulin-5 rooms=2 price=80000-120000 area=60 balcony"
+        )
+        return
+    await save_search(update, context, criteria)
+
+async def list_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    searches = await alerts_call(context.application, "list_searches", update.effective_user.id)
+    if not searches:
+        await update.message.reply_text("У вас нет подписок. Добавить: /alert <район> [rooms=2] [price=мин-макс]")
+        return
+    keyboard = [
+        [InlineKeyboardButton(f"❌ {search.describe()}", callback_data=f"alert_del:{search.id}")]
+        for search in searches
+    ]
+    await update.message.reply_text("🔔 Ваши подписки (нажмите, чтобы удалить):",
+                                    reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def delete_alert(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    search_id = int(query.data.split(":", 1)[1])
+    deleted = await alerts_call(context.application, "delete_search", update.effective_user.id, search_id)
+    await query.answer("Подписка удалена" if deleted else "Подписка не найдена")
+    if deleted:
+        await query.edit_message_text("🔕 Подписка удалена. Список подписок — /alerts")
+
+def format_alerts(rows: List[Dict], limit: int = 10) -> str:
+    lines = ["🔔 Новое по вашим подпискам:"]
+    for row in rows[:limit]:
+        price = f"{row['price']:.0f} EUR" if row.get("price") is not None else "цена не указана"
+        if row["change"] == "price" and row.get("previous_price") is not None:
+            price += f" (было {row['previous_price']:.0f})"
+        mark = "🆕" if row["change"] == "new" else "💱"
+        lines.append(f"{mark} {row.get('title') or 'Объявление'} — {price}\n{row['url']}")
+    if len(rows) > limit:
+        lines.append(f"…и ещё {len(rows) - limit}")
+    return "\n\n".join(lines)
+
+async def deliver_alerts(application) -> None:
+    """Одно сообщение на пользователя со всеми его неотправленными уведомлениями"""
+    rows = await alerts_call(application, "pending")
+    if not rows:
+        return
+    by_user: Dict[int, List[Dict]] = {}
+    for row in rows:
+        by_user.setdefault(row["user_id"], []).append(row)
+    done = []
+    for user_id, user_rows in by_user.items():
+        try:
+            await application.bot.send_message(user_id, format_alerts(user_rows),
+                                               disable_web_page_preview=True)
+        except RetryAfter as e:
+            # лимит Telegram: остальным — в следующий проход
+            logger.warning(f"⚠️ Лимит Telegram, рассылка отложена на {e.retry_after} с")
+            break
+        except (Forbidden, BadRequest) as e:
+            # бот заблокирован, чат удалён — повтор не поможет, снимаем из очереди
+            logger.warning(f"⚠️ Уведомление пользователю {user_id} не доставлено: {e}")
+        except TelegramError as e:
+            # сетевой сбой и т.п. — остаются в alert_outbox до следующего прохода
+            logger.warning(f"⚠️ Уведомление пользователю {user_id} отложено: {e}")
+            continue
+        done += [row["id"] for row in user_rows]
+    await alerts_call(application, "mark_sent", done)
+    logger.info(f"🔔 Обработано уведомлений: {len(done)} из {len(rows)}")
+
+async def load_valuation(application, force: bool = False):
+    """
+    ValuationEngine из bot_data; загружается в рабочем потоке при первом запросе,
+    после парсинга (force) и когда снимок старше VALUATION_MAX_AGE.
+    """
+    lock = application.bot_data.setdefault("valuation_lock", asyncio.Lock())
+    async with lock:
+        engine = application.bot_data.get("valuation")
+        if force or engine is None or engine.age() > VALUATION_MAX_AGE:
+            def work():
+                from imot_bg.valuation import ValuationEngine
+                return ValuationEngine.from_db()
+
+            engine = application.bot_data["valuation"] = await asyncio.to_thread(work)
+        return engine
+
+def format_valuation(valuation) -> str:
+    group = " / ".join(str(part) for part in valuation.group[1:] if part)  # без ключа города
+    lines = [
+        f"📐 {valuation.price_sqm:.0f} EUR/м² — {valuation.verdict}",
+        f"Перцентиль: {valuation.percentile:.0f}% (дороже {valuation.percentile:.0f}% аналогов)",
+        f"Медиана группы: {valuation.median_sqm:.0f} EUR/м², аналогов: {valuation.group_size} ({group})",
+    ]
+    if valuation.comparables:
+        lines.append("\nБлижайшие аналоги:")
+        for comp in valuation.comparables:
+            area = f"{comp['area']:.0f} м², " if comp['area'] == comp['area'] else ""
+            lines.append(f"• {area}{comp['price_sqm']:.0f} EUR/м² — {comp['url']}")
+    return "\n".join(lines)
+
+async def valuate_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ссылка на объявление imot.bg → мгновенная оценка по снимку в памяти"""
+    source_id = listing_id_from_url(update.message.text)
+    if not source_id:
+        return
+    engine = await load_valuation(context.application)
+    valuation = engine.evaluate_id(source_id)
+    if valuation is None and source_id in engine.listings:
+        await update.message.reply_text("🤷 В базе пока нет аналогов этого объявления в его районе.")
+        return
+    if valuation is None:
+        await update.message.reply_text(
+            "🤷 Этого объявления нет в базе. Запустите новый поиск по его району и пришлите ссылку ещё раз."
+        )
+        return
+    await update.message.reply_text(format_valuation(valuation), disable_web_page_preview=True)
+
+async def alerts_loop(application) -> None:
+    while True:
+        try:
+            await deliver_alerts(application)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("❌ Ошибка рассылки уведомлений:")
+        await asyncio.sleep(ALERTS_POLL_SECONDS)
+
 async def restart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.callback_query.answer()
     context.user_data.clear()
@@ -212,34 +856,84 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 async def post_init(application):
     await application.bot.set_my_commands([
         ("start", "Начать работу"),
+        ("alert", "Подписаться на новые объявления"),
+        ("alerts", "Мои подписки"),
         ("cancel", "Отменить действие")
     ])
-
-def main():
-    application = ApplicationBuilder() \
+    if ALERTS_POLL_SECONDS > 0 and os.getenv("DB_HOST"):
+        application.bot_data["alerts_task"] = asyncio.create_task(alerts_loop(application))
+
+async def post_shutdown(application):
+    task = application.bot_data.pop("alerts_task", None)
+    if task:
+        task.cancel()
+    store = application.bot_data.pop("alert_store", None)
+    if store:
+        store.close()
+
+def main(mode: Optional[str] = None, port: Optional[int] = None, concurrent_updates: Optional[int] = None):
+    mode = mode or BOT_MODE
+    update_limit = concurrent_updates or BOT_CONCURRENT_UPDATES
+    builder = ApplicationBuilder() \
+        .application_class(ChatSerializedApplication, {"update_limit": update_limit}) \
         .token(BOT_TOKEN) \
+        .concurrent_updates(max(PTB_UPDATE_SLOTS, update_limit)) \
         .post_init(post_init) \
-        .build()
-
+        .post_shutdown(post_shutdown)
+    if TELEGRAM_BASE_URL:
+        base_url = TELEGRAM_BASE_URL.rstrip("/")
+        builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+    application = builder.build()
+
+    # кнопка статуса парсинга: раньше обработчиков состояний, в любом состоянии диалога и вне его
+    partial_handler = CallbackQueryHandler(partial_export, pattern="^partial_export:")
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             SELECTING_ACTION: [
-                CallbackQueryHandler(select_district, pattern="^(from_cache|new_search)$"),
-                CallbackQueryHandler(restart, pattern="^restart$")
+                partial_handler,
+                CallbackQueryHandler(select_district, pattern="^(from_cache|only_new|new_search)$"),
+                CallbackQueryHandler(restart, pattern="^restart$"),
+                CallbackQueryHandler(subscribe, pattern="^subscribe$")
+            ],
+            SELECTING_DISTRICT: [
+                partial_handler,
+                CallbackQueryHandler(district_page, pattern="^dpage:"),
+                CallbackQueryHandler(handle_district, pattern=DISTRICT_CALLBACK),
+                MessageHandler(filters.TEXT & ~filters.COMMAND & ~filters.Regex(r"imot\.bg/"), district_by_name)
             ],
-            SELECTING_DISTRICT: [CallbackQueryHandler(handle_district)],
-            SELECTING_PROPERTY_TYPE: [CallbackQueryHandler(handle_property_type)]
+            SELECTING_PROPERTY_TYPE: [partial_handler, CallbackQueryHandler(handle_property_type, pattern=PROPERTY_TYPE_CALLBACK)]
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[
+            CommandHandler("cancel", cancel),
+            # "Новый запрос" со старого сообщения — из любого состояния
+            CallbackQueryHandler(restart, pattern="^restart$")
+        ],
         per_message=False
     )
 
     application.add_handler(conv_handler)
+    application.add_handler(partial_handler)
+    application.add_handler(CommandHandler("alert", alert_command))
+    application.add_handler(CommandHandler("alerts", list_alerts))
+    application.add_handler(CallbackQueryHandler(delete_alert, pattern="^alert_del:"))
+    application.add_handler(MessageHandler(filters.Regex(r"imot\.bg/\S*obiava-"), valuate_link))
     application.add_error_handler(error_handler)
 
-    logger.info("✅ Бот запущен")
-    application.run_polling()
+    # Метрики экспорта и отправки файлов (0 — отключить)
+    metrics.start_http_server(int(os.getenv("METRICS_PORT", "9411")))
+
+    logger.info(f"✅ Бот запущен ({mode}, одновременно обновлений: {application.update_limit})")
+    # BOT_PROFILE=1 — профилирование всего цикла бота до остановки (отчёты в exports/)
+    with profiled("bot", enabled=profiling_enabled("BOT_PROFILE")):
+        if mode == "webhook":
+            from imot_bg.webhook import serve_webhook
+            asyncio.run(serve_webhook(
+                application, WEBHOOK_URL, listen=WEBHOOK_LISTEN, port=port or WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+            ))
+        else:
+            application.run_polling()
 
 if __name__ == "__main__":
     main()
@@ -1,19 +1,14 @@
-import asyncio
-from twisted.internet import asyncioreactor
+import argparse
 
-def install_reactor():
-    """Безопасная установка реактора"""
-    try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        asyncioreactor.install(loop)
-    except Exception:
-        pass
 
 if __name__ == "__main__":
-    install_reactor()
-
-    # ВАЖНО: импортировать bot только после установки реактора
+    parser = argparse.ArgumentParser(description="Запуск Telegram-бота")
+    parser.add_argument("--mode", choices=("polling", "webhook"), help="по умолчанию — BOT_MODE из .env")
+    parser.add_argument("--port", type=int, help="порт вебхука (WEBHOOK_PORT)")
+    parser.add_argument("--concurrency", type=int, help="обновлений одновременно (BOT_CONCURRENT_UPDATES)")
+    args = parser.parse_args()
+
+    # Бот не использует Twisted/Scrapy (паук запускается отдельным процессом),
+    # поэтому реактор здесь не ставится — это только замедляло бы старт.
     from bot import main
-    main()
-
+    main(mode=args.mode, port=args.port, concurrent_updates=args.concurrency)
@@ -1,11 +1,15 @@
 import os
+import argparse
 import pandas as pd
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
 import datetime
 import re
 import logging
-from typing import List, Dict, Optional
+from typing import List, Dict, NamedTuple, Optional
+from imot_bg import metrics
+from imot_bg.profiling import profiled
+from imot_bg.storage import city_key
 
 # Настройка логирования
 logging.basicConfig(
@@ -18,6 +22,17 @@ logger = logging.getLogger(__name__)
 # Загрузка переменных окружения
 load_dotenv()
 
+
+class Watermark(NamedTuple):
+    """
+    Отметка экспорта: время (для подписи "новое") и снимок транзакций txid_current_snapshot().
+    По снимку дельта выбирает строки, чьи изменения (change_txid) не были видны прошлому
+    отчёту, — в том числе закоммиченные позже его, хотя записанные раньше.
+    """
+    exported_at: datetime.datetime
+    snapshot: Optional[str]
+
+
 class ExcelExporter:
     def __init__(self):
         self.db_host = os.getenv("DB_HOST")
@@ -25,6 +40,9 @@ class ExcelExporter:
         self.db_user = os.getenv("DB_USER")
         self.db_password = os.getenv("DB_PASSWORD")
         self.db_name = os.getenv("DB_NAME")
+        self.engine = None
+        # Новая отметка после экспорта only_new; сохраняется вызывающим после доставки файла
+        self.watermark: Optional[Watermark] = None
 
     @staticmethod
     def sanitize_filename(text: str) -> str:
@@ -44,6 +62,80 @@ class ExcelExporter:
             f"{self.db_host}:{self.db_port}/{self.db_name}"
         )
 
+    def get_engine(self):
+        """Один engine на экспорт: запрос данных и отметка пользователя идут через него"""
+        if self.engine is None:
+            self.validate_db_connection()
+            self.engine = create_engine(self.build_db_uri())
+        return self.engine
+
+    def close(self) -> None:
+        if self.engine is not None:
+            self.engine.dispose()
+            self.engine = None
+
+    def ensure_watermark_table(self) -> None:
+        with self.get_engine().begin() as conn:
+            conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS export_watermarks (
+                user_id BIGINT NOT NULL,
+                city TEXT NOT NULL,
+                district TEXT NOT NULL,
+                keyword TEXT NOT NULL DEFAULT 'all',
+                exported_at TIMESTAMP NOT NULL,
+                snapshot TEXT,
+                PRIMARY KEY (user_id, city, district, keyword)
+            )
+            """))
+            conn.execute(text("ALTER TABLE export_watermarks ADD COLUMN IF NOT EXISTS snapshot TEXT"))
+            conn.execute(text(
+                "ALTER TABLE export_watermarks ADD COLUMN IF NOT EXISTS keyword TEXT NOT NULL DEFAULT 'all'"))
+            key_columns = conn.execute(text("""
+            SELECT array_length(conkey, 1) FROM pg_constraint
+            WHERE conrelid = 'export_watermarks'::regclass AND contype = 'p'
+            """)).scalar()
+            if key_columns == 3:
+                # старые отметки сдвигались любым отчётом (и по другому типу) — им нельзя верить,
+                # следующий "только новые" по каждому типу будет полным
+                conn.execute(text("DELETE FROM export_watermarks"))
+                conn.execute(text("ALTER TABLE export_watermarks DROP CONSTRAINT export_watermarks_pkey"))
+                conn.execute(text("ALTER TABLE export_watermarks ADD PRIMARY KEY (user_id, city, district, keyword)"))
+
+    @staticmethod
+    def watermark_keyword(keyword: Optional[str]) -> str:
+        """Отметка ведётся отдельно по каждому типу недвижимости ('all' — все типы)"""
+        return keyword if keyword and keyword.lower() != "all" else "all"
+
+    def read_watermark(self, conn, user_id: int, city: str, district: str, keyword: Optional[str]) -> tuple:
+        """
+        Отметка прошлого экспорта пользователя по району и типу и новая отметка.
+        Должен быть первым запросом транзакции REPEATABLE READ: новый снимок совпадает
+        со снимком, в котором затем читаются данные, — всё, чего отчёт не увидел
+        (в том числе пачки, закоммиченные во время экспорта), попадёт в следующую дельту.
+        """
+        row = conn.execute(text("""
+        SELECT LOCALTIMESTAMP, txid_current_snapshot()::text, w.exported_at, w.snapshot
+        FROM (SELECT 1) AS now
+        LEFT JOIN export_watermarks w
+            ON w.user_id = :user_id AND w.city = :city AND w.district = :district AND w.keyword = :keyword
+        """), {"user_id": user_id, "city": city.lower(), "district": district.lower(),
+               "keyword": self.watermark_keyword(keyword)}).one()
+        previous = Watermark(row[2], row[3]) if row[2] is not None else None
+        return previous, Watermark(row[0], row[1])
+
+    def save_watermark(self, user_id: int, city: str, district: str, keyword: Optional[str],
+                       watermark: Watermark) -> None:
+        """Сдвиг отметки — только после того, как дельта дошла до пользователя"""
+        with self.get_engine().begin() as conn:
+            conn.execute(text("""
+            INSERT INTO export_watermarks (user_id, city, district, keyword, exported_at, snapshot)
+            VALUES (:user_id, :city, :district, :keyword, :exported_at, :snapshot)
+            ON CONFLICT (user_id, city, district, keyword)
+            DO UPDATE SET exported_at = EXCLUDED.exported_at, snapshot = EXCLUDED.snapshot
+            """), {"user_id": user_id, "city": city.lower(), "district": district.lower(),
+                   "keyword": self.watermark_keyword(keyword),
+                   "exported_at": watermark.exported_at, "snapshot": watermark.snapshot})
+
     def apply_filters(self, query: str, params: dict, filters: dict) -> tuple:
         """Добавление фильтров к SQL запросу"""
         if filters.get("apartment_type"):
@@ -85,38 +177,75 @@ class ExcelExporter:
 
         return query, params
 
-    def get_data_from_db(self, city: str, district: str, filters: dict = None) -> pd.DataFrame:
-        """Получение данных из базы данных"""
-        self.validate_db_connection()
-        engine = create_engine(self.build_db_uri())
+    def get_data_from_db(self, city: str, district: str, filters: dict = None,
+                         since: Optional[Watermark] = None,
+                         collapse_duplicates: bool = True, conn=None) -> pd.DataFrame:
+        """
+        Получение данных из базы данных.
+        Условие по city_key и NOT archived отсекает партиции: запрос читает только
+        активные объявления одного города, сколько бы ни накопилось архива и истории.
+        С since — только объявления, впервые найденные или переоценённые после отметки:
+        изменения, невидимые в её снимке транзакций (индекс sofia_apartments_change_idx);
+        у отметок без снимка (до его появления) — по updated_at.
+        conn — соединение открытой транзакции (снимок отметки), иначе своё.
+        С collapse_duplicates почти-дубликаты (общий cluster_id) сворачиваются в одну
+        строку — самую свежую — с числом копий в колонке copies.
+        """
+        engine = self.get_engine()
 
-        base_query = """
-        SELECT 
+        columns = """
             title, price, currency, price_sqm, area, 
             floor, construction_type, year_built, description,
-            district, city, url, agency, phone,
-            scraped_at::date AS scraped_date
+            district, city, url, images[1] AS photo, agency, phone,
+            scraped_at::date AS scraped_date"""
+        if since is not None:
+            columns += """,
+            previous_price,
+            CASE WHEN first_seen > :since THEN 'новое' ELSE 'цена изменена' END AS change"""
+        base_query = """
         FROM sofia_apartments
-        WHERE LOWER(city) = :city AND LOWER(district) = :district
+        WHERE city_key = :city_key AND NOT archived AND LOWER(district) = :district
         """
-        params = {"city": city.lower(), "district": district.lower()}
+        params = {"city_key": city_key(city), "district": district.lower()}
+
+        if since is not None:
+            params["since"] = since.exported_at
+            if since.snapshot:
+                base_query += (
+                    " AND change_txid >= txid_snapshot_xmin(CAST(:snapshot AS txid_snapshot))"
+                    " AND NOT txid_visible_in_snapshot(change_txid, CAST(:snapshot AS txid_snapshot))"
+                )
+                params["snapshot"] = since.snapshot
+            else:
+                base_query += " AND updated_at > :since"
 
         if filters:
             base_query, params = self.apply_filters(base_query, params, filters)
 
-        base_query += " ORDER BY scraped_at DESC"
+        if collapse_duplicates:
+            cluster = "COALESCE(cluster_id, source_id)"
+            base_query = f"""
+        SELECT {columns}, copies FROM (
+            SELECT DISTINCT ON ({cluster}) *, COUNT(*) OVER (PARTITION BY {cluster}) AS copies
+            {base_query}
+            ORDER BY {cluster}, scraped_at DESC
+        ) AS listings
+        ORDER BY scraped_at DESC"""
+        else:
+            base_query = f"SELECT {columns} {base_query} ORDER BY scraped_at DESC"
 
         try:
-            with engine.connect() as conn:
-                logger.info("🔌 Установлено соединение с БД")
+            if conn is not None:
                 df = pd.read_sql(text(base_query), conn, params=params)
-                logger.info(f"📊 Получено записей: {len(df)}")
-                return df
+            else:
+                with engine.connect() as conn:
+                    logger.info("🔌 Установлено соединение с БД")
+                    df = pd.read_sql(text(base_query), conn, params=params)
+            logger.info(f"📊 Получено записей: {len(df)}")
+            return df
         except Exception as e:
             logger.error(f"❌ Ошибка при запросе к БД: {str(e)}")
             raise RuntimeError(f"Ошибка при запросе к БД: {str(e)}")
-        finally:
-            engine.dispose()
 
     def prepare_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
         """Подготовка DataFrame к экспорту"""
@@ -138,9 +267,13 @@ class ExcelExporter:
                 "district": "Район",
                 "city": "Город",
                 "url": "Ссылка",
+                "photo": "Фото",
                 "agency": "Агентство",
                 "phone": "Телефон",
-                "scraped_date": "Дата сбора"
+                "scraped_date": "Дата сбора",
+                "previous_price": "Прежняя цена",
+                "copies": "Копий (агентств)",
+                "change": "Изменение"
             })
         return df
 
@@ -150,10 +283,18 @@ class ExcelExporter:
         district: str,
         listings: Optional[List[Dict]] = None,
         filters: Optional[dict] = None,
-        keyword: Optional[str] = None  # 👈 добавлено
-    ) -> str:
-        """Экспорт данных в Excel файл"""
-        logger.info(f"📤 Начало экспорта: город={city}, район={district}")
+        keyword: Optional[str] = None,  # 👈 добавлено
+        user_id: Optional[int] = None,
+        only_new: bool = False
+    ) -> Optional[str]:
+        """
+        Экспорт данных в Excel файл.
+        only_new=True с user_id выгружает только изменения с прошлой отметки пользователя
+        по району и типу (без отметки — полный отчёт); новая отметка кладётся в self.watermark,
+        сохранить её (save_watermark) — дело вызывающего, после доставки файла.
+        Если изменений нет, возвращает None.
+        """
+        logger.info(f"📤 Начало экспорта: город={city}, район={district}, только новые={only_new}")
 
         if not city or not district:
             raise ValueError("Параметры 'city' и 'district' обязательны")
@@ -167,20 +308,37 @@ class ExcelExporter:
                 filters = filters or {}
                 if keyword and keyword.lower() != "all":
                     filters["apartment_type"] = keyword
-                df = self.get_data_from_db(city, district, filters)
+                since = self.watermark = None
+                with metrics.EXPORT_SECONDS.time(stage="query"):
+                    if only_new and user_id is not None:
+                        self.ensure_watermark_table()
+                        # отметка и данные — в одном снимке REPEATABLE READ
+                        engine = self.get_engine().execution_options(isolation_level="REPEATABLE READ")
+                        with engine.begin() as conn:
+                            since, self.watermark = self.read_watermark(conn, user_id, city, district, keyword)
+                            df = self.get_data_from_db(city, district, filters, since=since, conn=conn)
+                    else:
+                        df = self.get_data_from_db(city, district, filters)
+                if df.empty and only_new and since is not None:
+                    logger.info(f"🆕 Нет изменений с {since.exported_at} для пользователя {user_id}")
+                    return None
                 if df.empty:
                     raise ValueError("Нет данных для экспорта")
 
-            df = self.prepare_dataframe(df)
+            metrics.EXPORT_ROWS.observe(len(df))
+            with metrics.EXPORT_SECONDS.time(stage="transform"):
+                df = self.prepare_dataframe(df)
 
             os.makedirs("exports", exist_ok=True)
             safe_city = self.sanitize_filename(city)
             safe_district = self.sanitize_filename(district)
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{safe_city}_{safe_district}_{timestamp}.xlsx"
+            suffix = "_new" if only_new else ""
+            filename = f"{safe_city}_{safe_district}{suffix}_{timestamp}.xlsx"
             filepath = os.path.join("exports", filename)
 
-            df.to_excel(filepath, index=False, engine='openpyxl')
+            with metrics.EXPORT_SECONDS.time(stage="write"):
+                df.to_excel(filepath, index=False, engine='openpyxl')
             logger.info(f"✅ Файл успешно сохранен: {filepath}")
             print(f"Экспорт завершён: {filepath}")
             return filepath
@@ -188,15 +346,35 @@ class ExcelExporter:
         except Exception as e:
             logger.error(f"❌ Ошибка при экспорте: {str(e)}")
             raise
+        finally:
+            self.close()
 
-def export_to_excel(city: str, district: str, listings: Optional[List[Dict]] = None, filters: Optional[dict] = None, keyword: Optional[str] = None) -> str:
-    """Функция-обертка"""
+def export_to_excel(city: str, district: str, listings: Optional[List[Dict]] = None, filters: Optional[dict] = None,
+                    keyword: Optional[str] = None, user_id: Optional[int] = None, only_new: bool = False) -> Optional[str]:
+    """Функция-обертка: файл остаётся на диске, поэтому отметка сохраняется сразу"""
     exporter = ExcelExporter()
-    return exporter.export_to_excel(city, district, listings, filters, keyword)
+    path = exporter.export_to_excel(city, district, listings, filters, keyword, user_id, only_new)
+    if path and exporter.watermark is not None:
+        try:
+            exporter.save_watermark(user_id, city, district, keyword, exporter.watermark)
+        finally:
+            exporter.close()
+    return path
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Экспорт объявлений в Excel")
+    parser.add_argument("city", nargs="?", default="sofia")
+    parser.add_argument("district", nargs="?", default="lyulin-5")
+    parser.add_argument("--keyword", default="3-СТАЕН", help="тип недвижимости или 'all'")
+    parser.add_argument("--profile", action="store_true", help="профилировать экспорт (отчёты в exports/)")
+    parser.add_argument("--user-id", type=int, help="Telegram id: отметка экспорта пользователя для --only-new")
+    parser.add_argument("--only-new", action="store_true", help="только новые/переоценённые с прошлой отметки")
+    args = parser.parse_args()
+
     try:
-        result = export_to_excel("sofia", "lyulin-5", keyword="3-СТАЕН")
+        with profiled(f"export_{args.city}_{args.district}", enabled=args.profile):
+            result = export_to_excel(args.city, args.district, keyword=args.keyword,
+                                     user_id=args.user_id, only_new=args.only_new)
         print(f"Файл создан: {result}")
     except Exception as e:
         print(f"Ошибка: {str(e)}")
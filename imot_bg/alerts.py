@@ -0,0 +1,281 @@
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extras
+
+from imot_bg.db import connect
+from imot_bg.storage import city_key
+
+logger = logging.getLogger(__name__)
+
+SEARCH_COLUMNS = (
+    'id', 'user_id', 'city', 'district', 'rooms', 'min_price', 'max_price',
+    'min_area', 'keyword', 'balcony', 'near_metro',
+)
+
+CREATE_TABLES = """
+CREATE TABLE IF NOT EXISTS saved_searches (
+    id SERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    city TEXT NOT NULL,
+    district TEXT NOT NULL,
+    rooms TEXT,
+    min_price NUMERIC,
+    max_price NUMERIC,
+    min_area NUMERIC,
+    keyword TEXT,
+    balcony BOOLEAN NOT NULL DEFAULT FALSE,
+    near_metro BOOLEAN NOT NULL DEFAULT FALSE,
+    active BOOLEAN NOT NULL DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS saved_searches_user_idx ON saved_searches (user_id);
+CREATE TABLE IF NOT EXISTS alert_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    search_id INTEGER NOT NULL REFERENCES saved_searches (id) ON DELETE CASCADE,
+    user_id BIGINT NOT NULL,
+    source_id TEXT NOT NULL,
+    change TEXT NOT NULL,
+    price NUMERIC,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP,
+    UNIQUE (search_id, source_id, price)
+);
+CREATE INDEX IF NOT EXISTS alert_outbox_pending_idx ON alert_outbox (id) WHERE sent_at IS NULL;
+"""
+
+
+@dataclass(slots=True)
+class SavedSearch:
+    """
+    Сохранённый поиск пользователя. Критерии те же, что у ExcelExporter.apply_filters:
+    rooms — число или '3+', keyword — подстрока заголовка (тип недвижимости).
+    """
+    id: Optional[int]
+    user_id: int
+    city: str
+    district: str
+    rooms: Optional[str] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    min_area: Optional[float] = None
+    keyword: Optional[str] = None
+    balcony: bool = False
+    near_metro: bool = False
+
+    def index_key(self) -> Tuple[str, str, Optional[str]]:
+        # город — ключом партиции: 'sofia' из бота и 'София' из паука совпадают
+        return city_key(self.city), self.district.lower(), self.rooms
+
+    def matches(self, row: Dict) -> bool:
+        """Проверка всех критериев, кроме района/комнат (их уже отобрал индекс)"""
+        price = row.get('price')
+        if self.min_price is not None and (price is None or price < self.min_price):
+            return False
+        if self.max_price is not None and (price is None or price > self.max_price):
+            return False
+        if self.min_area is not None and (row.get('area') is None or row['area'] < self.min_area):
+            return False
+        if self.keyword and self.keyword.lower() not in (row.get('title') or '').lower():
+            return False
+        description = (row.get('description') or '').lower()
+        if self.balcony and 'балкон' not in description:
+            return False
+        if self.near_metro and 'метро' not in description:
+            return False
+        return True
+
+    def describe(self) -> str:
+        parts = [self.district.replace('-', ' ').title()]
+        if self.keyword:
+            parts.append(self.keyword)
+        if self.rooms:
+            parts.append(f"комнат: {self.rooms}")
+        if self.min_price is not None or self.max_price is not None:
+            parts.append(f"цена: {self.min_price or 0:.0f}–{self.max_price or '∞'}")
+        if self.min_area is not None:
+            parts.append(f"от {self.min_area:.0f} м²")
+        if self.balcony:
+            parts.append("балкон")
+        if self.near_metro:
+            parts.append("метро")
+        return ", ".join(parts)
+
+
+class AlertMatcher:
+    """
+    Индекс сохранённых поисков по (город, район, комнаты).
+    Новое объявление проверяется только против поисков своего района с подходящим
+    числом комнат (конкретное, '3+' или любое), а не против всех поисков сразу.
+    """
+
+    def __init__(self, searches: Iterable[SavedSearch] = ()):
+        self.index = defaultdict(list)
+        self.size = 0
+        for search in searches:
+            self.add(search)
+
+    def add(self, search: SavedSearch) -> None:
+        self.index[search.index_key()].append(search)
+        self.size += 1
+
+    def candidates(self, row: Dict) -> List[SavedSearch]:
+        city = city_key(row.get('city'))
+        district = (row.get('district') or '').lower()
+        rooms = row.get('rooms')
+        found = list(self.index.get((city, district, None), ()))
+        if rooms:
+            found += self.index.get((city, district, str(rooms)), ())
+            if rooms >= 3:
+                found += self.index.get((city, district, '3+'), ())
+        return found
+
+    def match(self, row: Dict) -> List[SavedSearch]:
+        return [search for search in self.candidates(row) if search.matches(row)]
+
+
+def create_tables(cur) -> None:
+    cur.execute(CREATE_TABLES)
+
+
+def load_searches(cur, user_id: Optional[int] = None) -> List[SavedSearch]:
+    """Активные сохранённые поиски (все или одного пользователя)"""
+    query = f"SELECT {', '.join(SEARCH_COLUMNS)} FROM saved_searches WHERE active"
+    if user_id is not None:
+        cur.execute(query + " AND user_id = %s ORDER BY id", (user_id,))
+    else:
+        cur.execute(query)
+    searches = []
+    for row in cur.fetchall():
+        data = dict(zip(SEARCH_COLUMNS, row))
+        for key in ('min_price', 'max_price', 'min_area'):
+            if data[key] is not None:
+                data[key] = float(data[key])
+        searches.append(SavedSearch(**data))
+    return searches
+
+
+class AlertIngest:
+    """
+    Сторона паука: держит AlertMatcher (перечитывается раз в reload_seconds,
+    чтобы новые подписки подхватывались во время обхода) и кладёт совпадения
+    в alert_outbox той же транзакцией, что и пачку объявлений.
+    """
+
+    def __init__(self, reload_seconds: float = 60.0):
+        self.reload_seconds = reload_seconds
+        self.matcher = AlertMatcher()
+        self.loaded_at = None
+        self.queued = 0
+
+    def refresh(self, cur) -> None:
+        now = time.monotonic()
+        if self.loaded_at is None or now - self.loaded_at >= self.reload_seconds:
+            self.matcher = AlertMatcher(load_searches(cur))
+            self.loaded_at = now
+
+    def enqueue(self, cur, rows: Iterable[Dict]) -> int:
+        """
+        rows — новые/переоценённые объявления (dict колонок + change: 'new' или 'price').
+        Повтор того же объявления с той же ценой для поиска не ставится. Возвращает число уведомлений.
+        """
+        self.refresh(cur)
+        if not self.matcher.size:
+            return 0
+        matches = [
+            (search.id, search.user_id, row['source_id'], row['change'], row.get('price'))
+            for row in rows
+            for search in self.matcher.match(row)
+        ]
+        if matches:
+            psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO alert_outbox (search_id, user_id, source_id, change, price) VALUES %s "
+                "ON CONFLICT DO NOTHING",
+                matches,
+            )
+        self.queued += len(matches)
+        return len(matches)
+
+
+class AlertStore:
+    """
+    Сторона бота: сохранённые поиски пользователя и выдача неотправленных уведомлений.
+    Одно соединение на бота; оборванное (перезапуск Postgres) открывается заново.
+    """
+
+    def __init__(self):
+        self.conn = connect()
+        with self.conn, self.conn.cursor() as cur:
+            create_tables(cur)
+
+    def close(self) -> None:
+        if not self.conn.closed:
+            self.conn.close()
+
+    def run(self, work, retry: bool = True):
+        """
+        work(cur) в транзакции. При обрыве соединения оно переоткрывается, а запрос
+        повторяется один раз (retry=False — для вставок, которые нельзя задвоить).
+        """
+        for attempt in range(2):
+            if self.conn.closed:
+                self.conn = connect()
+            try:
+                with self.conn, self.conn.cursor() as cur:
+                    return work(cur)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                self.close()
+                if not retry or attempt:
+                    raise
+                logger.warning(f"⚠️ Соединение с БД подписок потеряно ({e}), переподключаюсь")
+
+    def save_search(self, search: SavedSearch) -> int:
+        columns = [c for c in SEARCH_COLUMNS if c != 'id']
+
+        def work(cur):
+            cur.execute(
+                f"INSERT INTO saved_searches ({', '.join(columns)}) "
+                f"VALUES ({', '.join(['%s'] * len(columns))}) RETURNING id",
+                [getattr(search, c) for c in columns],
+            )
+            return cur.fetchone()[0]
+
+        return self.run(work, retry=False)
+
+    def list_searches(self, user_id: int) -> List[SavedSearch]:
+        return self.run(lambda cur: load_searches(cur, user_id))
+
+    def delete_search(self, user_id: int, search_id: int) -> bool:
+        def work(cur):
+            cur.execute("UPDATE saved_searches SET active = FALSE WHERE id = %s AND user_id = %s",
+                        (search_id, user_id))
+            return cur.rowcount > 0
+
+        return self.run(work)
+
+    def pending(self, limit: int = 500) -> List[Dict]:
+        """Неотправленные уведомления вместе с данными объявления"""
+        def work(cur):
+            cur.execute("""
+            SELECT o.id, o.user_id, o.change, a.title, a.price, a.previous_price, a.area, a.url
+            FROM alert_outbox o
+            JOIN sofia_apartments a ON a.source_id = o.source_id
+            WHERE o.sent_at IS NULL
+            ORDER BY o.id
+            LIMIT %s
+            """, (limit,))
+            keys = ('id', 'user_id', 'change', 'title', 'price', 'previous_price', 'area', 'url')
+            return [dict(zip(keys, row)) for row in cur.fetchall()]
+
+        return self.run(work)
+
+    def mark_sent(self, ids: List[int]) -> None:
+        if not ids:
+            return
+        self.run(lambda cur: cur.execute(
+            "UPDATE alert_outbox SET sent_at = CURRENT_TIMESTAMP WHERE id = ANY(%s)", (ids,)))
@@ -0,0 +1,131 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+class CrawlCheckpoint:
+    """
+    Чекпойнт задания парсинга в локальном SQLite-файле.
+    Хранит фронтир запросов (страницы выдачи и объявления), id объявлений,
+    уже закоммиченных пайплайном, и служебные метаданные задания.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+        self.last_progress = None
+
+    @classmethod
+    def for_job(cls, job_id: str, jobs_dir: str = "jobs") -> "CrawlCheckpoint":
+        """Открытие (или создание) чекпойнта по id задания"""
+        return cls(os.path.join(jobs_dir, f"{job_id}.sqlite"))
+
+    def create_tables(self) -> None:
+        self.conn.executescript("""
+        CREATE TABLE IF NOT EXISTS frontier (
+            url TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            meta TEXT,
+            source_id TEXT,
+            done INTEGER NOT NULL DEFAULT 0,
+            added_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS frontier_pending ON frontier (done, kind);
+        CREATE INDEX IF NOT EXISTS frontier_source_id ON frontier (source_id);
+        CREATE TABLE IF NOT EXISTS stored (
+            source_id TEXT PRIMARY KEY,
+            stored_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS job_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        """)
+        self.conn.commit()
+
+    def record_request(self, url: str, kind: str, meta: Optional[dict] = None,
+                       source_id: Optional[str] = None) -> None:
+        """Добавление запроса во фронтир (повторное добавление игнорируется)"""
+        self.conn.execute(
+            "INSERT OR IGNORE INTO frontier (url, kind, meta, source_id, added_at) VALUES (?, ?, ?, ?, ?)",
+            (url, kind, json.dumps(meta or {}, ensure_ascii=False), source_id, time.time())
+        )
+        self.conn.commit()
+
+    def mark_done(self, url: str) -> None:
+        self.conn.execute("UPDATE frontier SET done = 1 WHERE url = ?", (url,))
+        self.conn.commit()
+
+    def pending(self) -> List[Dict]:
+        """Незавершённые запросы: сначала страницы выдачи, затем объявления"""
+        rows = self.conn.execute(
+            "SELECT url, kind, meta, source_id FROM frontier WHERE done = 0 "
+            "ORDER BY kind = 'listing', added_at"
+        ).fetchall()
+        return [
+            {"url": url, "kind": kind, "meta": json.loads(meta or "{}"), "source_id": source_id}
+            for url, kind, meta, source_id in rows
+        ]
+
+    def mark_stored(self, source_ids: Iterable[str]) -> None:
+        """Фиксация id, закоммиченных в БД; соответствующие объявления считаются выполненными"""
+        now = time.time()
+        rows = [(sid, now) for sid in source_ids if sid]
+        if not rows:
+            return
+        self.conn.executemany("INSERT OR IGNORE INTO stored (source_id, stored_at) VALUES (?, ?)", rows)
+        self.conn.executemany(
+            "UPDATE frontier SET done = 1 WHERE kind = 'listing' AND source_id = ?",
+            [(sid,) for sid, _ in rows]
+        )
+        self.conn.commit()
+
+    def is_stored(self, source_id: Optional[str]) -> bool:
+        if not source_id:
+            return False
+        row = self.conn.execute("SELECT 1 FROM stored WHERE source_id = ?", (source_id,)).fetchone()
+        return row is not None
+
+    def set_meta(self, key: str, value) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO job_meta (key, value) VALUES (?, ?)",
+            (key, json.dumps(value, ensure_ascii=False))
+        )
+        self.conn.commit()
+
+    def get_meta(self, key: str, default=None):
+        row = self.conn.execute("SELECT value FROM job_meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def progress(self) -> Dict[str, int]:
+        """
+        Сводка по заданию: выполнено/осталось запросов и сохранено объявлений.
+        После close() возвращает последнюю сводку, снятую при закрытии.
+        """
+        if self.conn is None:
+            return dict(self.last_progress or {})
+        counts = dict(self.conn.execute(
+            "SELECT kind || ':' || done, COUNT(*) FROM frontier GROUP BY kind, done"
+        ).fetchall())
+        stored = self.conn.execute("SELECT COUNT(*) FROM stored").fetchone()[0]
+        self.last_progress = {
+            "pages_done": counts.get("search:1", 0),
+            "pages_pending": counts.get("search:0", 0),
+            "listings_done": counts.get("listing:1", 0),
+            "listings_pending": counts.get("listing:0", 0),
+            "stored": stored,
+        }
+        return dict(self.last_progress)
+
+    def close(self) -> None:
+        if self.conn:
+            self.progress()
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
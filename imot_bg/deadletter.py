@@ -0,0 +1,96 @@
+import base64
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+import zlib
+from collections import Counter, defaultdict
+from typing import Dict, Optional
+
+# Ответы, после которых повторять запрос бессмысленно: объявление снято с публикации
+PERMANENT_STATUSES = frozenset({404, 410})
+
+# Сигнал Scrapy: объявление снято (source_id, url) — PostgresPipeline переносит его в архив
+listing_delisted = object()
+
+EXAMPLES_PER_STATUS = 5
+
+
+class DeadLetterFormatter(logging.Formatter):
+    """Запись — JSON-строка; фрагмент тела сжимается здесь, в фоновом потоке"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = dict(record.msg)
+        body = entry.pop("body", None)
+        if body:
+            entry["body_sample"] = base64.b64encode(zlib.compress(body, 6)).decode("ascii")
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DeadLetterStore:
+    """
+    Журнал окончательно неудачных запросов: статус, URL, тип запроса, время загрузки,
+    число повторов и сжатое начало тела ответа — вместо полного HTML в рабочем каталоге.
+    Файл JSON Lines ротируется по размеру (max_bytes × backups); сериализация и запись
+    идут в потоке QueueListener, реактор только кладёт запись в очередь.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 5 * 1024 * 1024, backups: int = 3, sample_bytes: int = 2048):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.sample_bytes = sample_bytes
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+        handler.setFormatter(DeadLetterFormatter())
+        self.handler = handler
+        self.queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(self.queue, handler)
+        self.listener.start()
+        self.by_status = Counter()
+        self.by_kind = Counter()
+        self.examples = defaultdict(list)
+        self.delisted = 0
+
+    def record(self, url: str, kind: str, status: Optional[int] = None, reason: Optional[str] = None,
+               elapsed: Optional[float] = None, retries: int = 0, body: bytes = b"", **extra) -> None:
+        key = str(status) if status is not None else (reason or "error")
+        self.by_status[key] += 1
+        self.by_kind[kind] += 1
+        if len(self.examples[key]) < EXAMPLES_PER_STATUS:
+            self.examples[key].append(url)
+        entry = {
+            "ts": round(time.time(), 3),
+            "url": url,
+            "kind": kind,
+            "status": status,
+            "reason": reason,
+            "elapsed_ms": round(elapsed * 1000, 1) if elapsed is not None else None,
+            "retries": retries,
+            "body": body[:self.sample_bytes] if body else None,
+            **extra,
+        }
+        self.put(entry)
+
+    def record_summary(self, **extra) -> None:
+        """Сводка обхода — строкой kind=summary в том же ротируемом журнале, а не отдельным файлом"""
+        self.put({"ts": round(time.time(), 3), "kind": "summary", **extra, **self.summary()})
+
+    def put(self, entry: Dict) -> None:
+        self.queue.put(logging.makeLogRecord({"msg": entry, "levelno": logging.INFO, "levelname": "INFO"}))
+
+    def summary(self) -> Dict:
+        return {
+            "total": sum(self.by_status.values()),
+            "by_status": dict(self.by_status.most_common()),
+            "by_kind": dict(self.by_kind.most_common()),
+            "delisted": self.delisted,
+            "examples": dict(self.examples),
+        }
+
+    def close(self) -> None:
+        if self.listener is not None:
+            self.listener.stop()  # дописывает очередь
+            self.listener = None
+            self.handler.close()
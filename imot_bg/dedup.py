@@ -0,0 +1,202 @@
+import hashlib
+import re
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+# Простое число Мерсенна 2^31 - 1: a * x + b укладывается в uint64 без переполнения
+MERSENNE_PRIME = (1 << 31) - 1
+MIN_DESCRIPTION_LENGTH = 40  # Короче — сравнивать нечего, объявление остаётся в своём кластере
+
+CREATE_TABLES = """
+CREATE TABLE IF NOT EXISTS listing_signatures (
+    source_id TEXT PRIMARY KEY,
+    block TEXT NOT NULL,
+    signature BYTEA NOT NULL,
+    cluster_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS listing_lsh (
+    bucket BIGINT NOT NULL,
+    source_id TEXT NOT NULL,
+    PRIMARY KEY (bucket, source_id)
+);
+CREATE INDEX IF NOT EXISTS listing_lsh_source_idx ON listing_lsh (source_id);
+"""
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", text.lower())).strip()
+
+
+def shingles(text: str, k: int = 5) -> List[int]:
+    """Символьные k-граммы нормализованного текста, захешированные в 31 бит"""
+    text = normalize_text(text)
+    if len(text) <= k:
+        return [zlib.crc32(text.encode("utf-8")) & MERSENNE_PRIME]
+    return list({zlib.crc32(text[i:i + k].encode("utf-8")) & MERSENNE_PRIME
+                 for i in range(len(text) - k + 1)})
+
+
+def parse_number(value) -> Optional[int]:
+    match = re.search(r"\d+", str(value or ""))
+    return int(match.group()) if match else None
+
+
+class MinHashLSH:
+    """
+    MinHash-подписи описаний и LSH-бакеты по полосам подписи.
+    Хеш бакета включает ключ блокировки (район, комнаты, корзина площади, этаж),
+    поэтому кандидатами становятся только объявления того же блока с совпадающей полосой.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, area_bucket: float = 5.0, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.area_bucket = area_bucket
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        """Подпись: минимум (a * x + b) mod p по всем шинглам для каждой перестановки"""
+        hashes = np.array(shingles(text), dtype=np.uint64)
+        values = (np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME
+        return values.min(axis=0).astype(np.uint32)
+
+    def block_key(self, row: Dict) -> str:
+        area = row.get("area")
+        area_key = int(area // self.area_bucket) if area else ""
+        return "|".join(str(part) for part in (
+            (row.get("city") or "").lower(),
+            (row.get("district") or "").lower(),
+            row.get("rooms") or "",
+            area_key,
+            parse_number(row.get("floor")) or "",
+        ))
+
+    def buckets(self, block: str, signature: np.ndarray) -> List[int]:
+        """По одному бакету на полосу: 64-битный хеш (блок, номер полосы, значения полосы)"""
+        result = []
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            digest = hashlib.blake2b(f"{block}#{band}#".encode("utf-8") + chunk, digest_size=8).digest()
+            result.append(int.from_bytes(digest, "big", signed=True))
+        return result
+
+    @staticmethod
+    def similarity(left: np.ndarray, right: np.ndarray) -> float:
+        """Оценка коэффициента Жаккара по доле совпавших позиций подписи"""
+        return float(np.mean(left == right))
+
+
+class Deduplicator:
+    """
+    Кластеризация почти-дубликатов (одна квартира от разных агентств) в пайплайне.
+    Подписи и LSH-бакеты хранятся в Postgres; кандидаты пачки выбираются одним
+    поиском по индексу бакетов — O(полос) на объявление, без сравнения со всей таблицей.
+    Объявление попадает в кластер самого похожего кандидата с similarity >= threshold,
+    иначе образует свой кластер (cluster_id = source_id).
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 16, area_bucket: float = 5.0):
+        self.threshold = threshold
+        self.lsh = MinHashLSH(num_perm=num_perm, bands=bands, area_bucket=area_bucket)
+        self.clustered = 0
+
+    def assign(self, cur, rows: Sequence[Dict]) -> Dict[str, str]:
+        """
+        Cluster id для каждой строки пачки (dict колонок); индекс пополняется в текущей транзакции.
+        На всю пачку — фиксированное число запросов (подписи, кандидаты по всем бакетам,
+        запись подписей и бакетов), чтобы не удлинять транзакцию upsert'а.
+        Строки пачки видят друг друга как кандидатов в порядке следования.
+        """
+        source_ids = [row["source_id"] for row in rows]
+        cur.execute(
+            "SELECT source_id, signature, cluster_id FROM listing_signatures WHERE source_id = ANY(%s)",
+            (source_ids,),
+        )
+        known = {sid: (np.frombuffer(bytes(sig), dtype=np.uint32), cluster) for sid, sig, cluster in cur.fetchall()}
+
+        clusters = {}
+        changed = []  # (row, signature, block, buckets) строк с новым/изменённым описанием
+        for row in rows:
+            source_id = row["source_id"]
+            description = row.get("description") or ""
+            if len(description) < MIN_DESCRIPTION_LENGTH:
+                clusters[source_id] = known.get(source_id, (None, source_id))[1]
+                continue
+            signature = self.lsh.signature(description)
+            previous = known.get(source_id)
+            if previous is not None and np.array_equal(previous[0], signature):
+                # описание не изменилось — кластер и бакеты уже на месте
+                clusters[source_id] = previous[1]
+                continue
+            block = self.lsh.block_key(row)
+            changed.append((row, signature, block, self.lsh.buckets(block, signature)))
+        if not changed:
+            return clusters
+
+        stored = self.candidates(cur, {bucket for *_, buckets in changed for bucket in buckets})
+        batch = {}  # бакеты уже обработанных строк пачки — с их новыми подписями
+        signatures, lsh = [], []
+        for row, signature, block, buckets in changed:
+            source_id = row["source_id"]
+            cluster_id = self.nearest_cluster(source_id, signature, buckets, stored, batch) or source_id
+            clusters[source_id] = cluster_id
+            if cluster_id != source_id:
+                self.clustered += 1
+            signatures.append((source_id, block, signature.tobytes(), cluster_id))
+            lsh += [(bucket, source_id) for bucket in buckets]
+            # следующие строки пачки сравниваются уже с новой подписью и новыми бакетами
+            for bucket in buckets:
+                batch.setdefault(bucket, {})[source_id] = (signature, cluster_id)
+
+        execute_values(cur, """
+        INSERT INTO listing_signatures (source_id, block, signature, cluster_id) VALUES %s
+        ON CONFLICT (source_id) DO UPDATE SET
+            block = EXCLUDED.block, signature = EXCLUDED.signature, cluster_id = EXCLUDED.cluster_id
+        """, signatures)
+        resigned = [row["source_id"] for row, *_ in changed if row["source_id"] in known]
+        if resigned:
+            cur.execute("DELETE FROM listing_lsh WHERE source_id = ANY(%s)", (resigned,))
+        execute_values(cur, "INSERT INTO listing_lsh (bucket, source_id) VALUES %s ON CONFLICT DO NOTHING", lsh)
+        return clusters
+
+    @staticmethod
+    def candidates(cur, buckets) -> Dict[int, Dict[str, tuple]]:
+        """Бакет → {source_id: (подпись, cluster_id)} одним запросом по всем бакетам пачки"""
+        cur.execute("""
+        SELECT l.bucket, s.source_id, s.signature, s.cluster_id
+        FROM listing_lsh l
+        JOIN listing_signatures s ON s.source_id = l.source_id
+        WHERE l.bucket = ANY(%s)
+        """, (list(buckets),))
+        result = {}
+        for bucket, source_id, signature, cluster_id in cur.fetchall():
+            result.setdefault(bucket, {})[source_id] = (np.frombuffer(bytes(signature), dtype=np.uint32), cluster_id)
+        return result
+
+    def nearest_cluster(self, source_id: str, signature: np.ndarray, buckets: List[int],
+                        stored: Dict[int, Dict[str, tuple]], batch: Dict[int, Dict[str, tuple]]) -> Optional[str]:
+        """Кандидаты из индекса, кроме переподписанных в этой пачке (у них старые бакеты), и строки пачки"""
+        processed = {sid for entries in batch.values() for sid in entries}
+        seen = {}
+        for bucket in buckets:
+            seen.update((sid, entry) for sid, entry in stored.get(bucket, {}).items() if sid not in processed)
+            seen.update(batch.get(bucket, {}))
+        seen.pop(source_id, None)
+        best, best_score = None, self.threshold
+        for candidate, cluster_id in seen.values():
+            score = self.lsh.similarity(signature, candidate)
+            if score >= best_score:
+                best, best_score = cluster_id, score
+        return best
+
+
+def create_tables(cur) -> None:
+    cur.execute(CREATE_TABLES)
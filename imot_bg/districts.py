@@ -0,0 +1,112 @@
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional
+
+# Транслитерация по официальной болгарской системе (+ русские буквы для ввода в боте)
+TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p",
+    "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "ts", "ч": "ch",
+    "ш": "sh", "щ": "sht", "ъ": "a", "ь": "y", "ю": "yu", "я": "ya",
+    "ы": "i", "э": "e", "ё": "yo",
+}
+DISTRICT_PREFIXES = re.compile(r"^(кв\.?|ж\.?\s?к\.?|жк|район|квартал|kv\.?|zh\.?\s?k\.?)\s+")
+
+# Пока каталог не загружен: районы, с которыми бот работал раньше
+DEFAULT_DISTRICTS = {
+    "lyulin-5": "Люлин 5",
+    "druzhba-1": "Дружба 1",
+    "lozenets": "Лозенец",
+}
+
+
+def slugify_district(name: str) -> str:
+    """
+    Нормализованный слаг района imot.bg: 'Младост 3', 'mladost3', 'кв. Младост-3'
+    → 'mladost-3'. Кириллица транслитерируется, пробелы/подчёркивания → дефис,
+    число отделяется от названия дефисом.
+    """
+    text = DISTRICT_PREFIXES.sub("", name.strip().lower())
+    text = "".join(TRANSLIT.get(ch, ch) for ch in text)
+    text = re.sub(r"(?<=[a-z])(?=\d)|(?<=\d)(?=[a-z])", "-", text)
+    text = re.sub(r"[^a-z0-9]+", "-", text)
+    return text.strip("-")
+
+
+class DistrictCatalog:
+    """
+    Каталог районов по городам: слаг, название и число объявлений.
+    Собирается пауком imot_districts со страниц локаций imot.bg и кэшируется
+    в JSON-файле; is_fresh(ttl) говорит, пора ли обновить.
+    """
+
+    def __init__(self, path: str, data: Optional[Dict] = None):
+        self.path = path
+        self.data = data or {"cities": {}}
+
+    @classmethod
+    def load(cls, path: str) -> "DistrictCatalog":
+        try:
+            with open(path, encoding="utf-8") as f:
+                return cls(path, json.load(f))
+        except (OSError, ValueError):
+            return cls(path)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def update_city(self, city: str, districts: Dict[str, Dict]) -> None:
+        """districts: слаг → {"name": ..., "count": ...}"""
+        self.data["cities"][city.lower()] = {"updated_at": time.time(), "districts": districts}
+
+    def is_fresh(self, city: str, ttl: float) -> bool:
+        entry = self.data["cities"].get(city.lower())
+        return bool(entry) and time.time() - entry["updated_at"] < ttl
+
+    def districts(self, city: str) -> List[Dict]:
+        """Районы города по убыванию числа объявлений; без каталога — DEFAULT_DISTRICTS"""
+        entry = self.data["cities"].get(city.lower())
+        if not entry:
+            return [{"slug": slug, "name": name, "count": None} for slug, name in DEFAULT_DISTRICTS.items()]
+        return sorted(
+            ({"slug": slug, **info} for slug, info in entry["districts"].items()),
+            key=lambda d: (-(d.get("count") or 0), d["name"]),
+        )
+
+    def known(self, city: str) -> bool:
+        return city.lower() in self.data["cities"]
+
+    def count(self, city: str, slug: str) -> Optional[int]:
+        entry = self.data["cities"].get(city.lower(), {})
+        return entry.get("districts", {}).get(slug, {}).get("count")
+
+    def resolve(self, city: str, name: str) -> Optional[str]:
+        """
+        Слаг района по любому написанию (кириллица/латиница, пробелы/дефисы).
+        Если каталога города нет — нормализованный слаг как есть; если есть,
+        но район в нём не найден — None.
+        """
+        slug = slugify_district(name)
+        entry = self.data["cities"].get(city.lower())
+        if not entry:
+            return slug or None
+        districts = entry["districts"]
+        if slug in districts:
+            return slug
+        for known_slug, info in districts.items():
+            if slugify_district(info.get("name", "")) == slug:
+                return known_slug
+        # "mladost3" и "mladost-3" уже сведены; последний шанс — без дефисов
+        compact = slug.replace("-", "")
+        return next((s for s in districts if s.replace("-", "") == compact), None)
+
+    def crawl_priority(self, city: str, slug: str, max_priority: int = 10) -> int:
+        """Приоритет обхода по числу объявлений: крупные районы (дольше всех) стартуют первыми"""
+        count = self.count(city, slug) or 0
+        return min(max_priority, count // 100)
@@ -0,0 +1,240 @@
+import datetime
+import json
+import logging
+import os
+import select
+import socket
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from imot_bg import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsExtension:
+    """
+    Сбор метрик паука: глубина очереди, время загрузки (Playwright/HTTP),
+    результаты по объявлениям. Эндпоинт /metrics на METRICS_PORT,
+    JSON-сводка в METRICS_SUMMARY_DIR при закрытии паука.
+    """
+
+    def __init__(self, crawler, port, summary_dir, interval):
+        self.crawler = crawler
+        self.port = port
+        self.summary_dir = summary_dir
+        self.interval = interval
+        self.server = None
+        self.poller = None
+        self.started_at = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED', True):
+            raise NotConfigured
+        ext = cls(
+            crawler,
+            port=crawler.settings.getint('METRICS_PORT', 0),
+            summary_dir=crawler.settings.get('METRICS_SUMMARY_DIR', 'metrics'),
+            interval=crawler.settings.getfloat('METRICS_POLL_INTERVAL', 5.0),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(ext.spider_error, signal=signals.spider_error)
+        return ext
+
+    def spider_opened(self, spider):
+        self.started_at = datetime.datetime.now()
+        self.server = metrics.start_http_server(self.port)
+        self.poller = task.LoopingCall(self.poll_engine)
+        self.poller.start(self.interval, now=True)
+
+    def poll_engine(self):
+        """Периодический снимок очереди планировщика и активных загрузок"""
+        engine = self.crawler.engine
+        slot = getattr(engine, '_slot', None) or getattr(engine, 'slot', None)
+        if slot is not None and slot.scheduler is not None:
+            metrics.QUEUE_DEPTH.set(len(slot.scheduler))
+        metrics.REQUESTS_IN_PROGRESS.set(len(engine.downloader.active))
+
+    def response_received(self, response, request, spider):
+        handler = 'playwright' if request.meta.get('playwright') else 'http'
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            metrics.FETCH_SECONDS.observe(latency, handler=handler, status=response.status)
+
+    def item_scraped(self, item, response, spider):
+        metrics.ITEMS_TOTAL.inc(result='stored')
+
+    def item_dropped(self, item, response, exception, spider):
+        metrics.ITEMS_TOTAL.inc(result='dropped')
+
+    def spider_error(self, failure, response, spider):
+        metrics.ERRORS_TOTAL.inc(kind='callback')
+
+    def spider_closed(self, spider, reason):
+        if self.poller and self.poller.running:
+            self.poller.stop()
+        if self.server:
+            self.server.shutdown()
+
+        os.makedirs(self.summary_dir, exist_ok=True)
+        job = getattr(spider, 'job_id', None) or spider.name
+        path = os.path.join(self.summary_dir, f"metrics_{job}_{datetime.datetime.now():%Y%m%d_%H%M%S}.json")
+        elapsed = (datetime.datetime.now() - self.started_at).total_seconds() if self.started_at else None
+        metrics.REGISTRY.dump_json(path, job=job, reason=reason, elapsed_seconds=elapsed)
+        logger.info(f"📈 Сводка метрик сохранена: {path}")
+
+
+def estimate_eta(progress, elapsed):
+    """
+    Оценка оставшегося времени (сек) по темпу обработки объявлений.
+    Необойдённые страницы выдачи пересчитываются в объявления по среднему на страницу.
+    """
+    done = progress.get('listings_done', 0)
+    if not done or not elapsed:
+        return None
+    pages_done = progress.get('pages_done', 0)
+    per_page = (done + progress.get('listings_pending', 0)) / pages_done if pages_done else 0
+    remaining = progress.get('listings_pending', 0) + progress.get('pages_pending', 0) * per_page
+    return round(remaining / (done / elapsed), 1)
+
+
+class ProgressExtension:
+    """
+    Машиночитаемый прогресс обхода для бота: JSON-строка на событие
+    в отдельный файловый дескриптор PROGRESS_FD (не stdout/stderr с логами),
+    а на Windows, где дескриптор не передать, — в локальный сокет PROGRESS_ADDR.
+    Событие progress — снимок чекпойнта раз в PROGRESS_INTERVAL секунд:
+    страницы и объявления (выполнено/всего), сохранено, ошибки, ETA.
+    """
+
+    def __init__(self, crawler, fd, interval, sock=None):
+        self.crawler = crawler
+        self.fd = fd
+        self.sock = sock
+        self.interval = interval
+        self.poller = None
+        self.started_at = None
+        self.spider = None
+        self.pending = b''  # недописанный хвост последней строки
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        fd = crawler.settings.getint('PROGRESS_FD', 0)
+        addr = crawler.settings.get('PROGRESS_ADDR')
+        sock = None
+        try:
+            # читатель может отстать — тогда снимок пропускаем, а не блокируем реактор
+            if fd > 0:
+                os.set_blocking(fd, False)
+            elif addr:
+                host, _, port = addr.rpartition(':')
+                sock = socket.create_connection((host, int(port)), timeout=5)
+                sock.setblocking(False)
+                fd = None
+            else:
+                raise NotConfigured
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Канал прогресса {addr or fd} недоступен: {e}")
+            raise NotConfigured
+        ext = cls(crawler, fd, crawler.settings.getfloat('PROGRESS_INTERVAL', 2.0), sock)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    @staticmethod
+    def encode(event, **data):
+        return (json.dumps({'event': event, **data}, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+
+    def write(self, data):
+        """Сколько байт принял неблокирующий канал (0 — читатель отстал)"""
+        try:
+            if self.sock is not None:
+                return self.sock.send(data)
+            return os.write(self.fd, data)
+        except BlockingIOError:
+            return 0
+
+    def emit(self, event, **data):
+        if self.fd is None and self.sock is None:
+            return
+        try:
+            # сначала хвост прошлой строки — иначе читатель получит обрезанный JSON
+            if self.pending:
+                self.pending = self.pending[self.write(self.pending):]
+                if self.pending:
+                    return  # читатель отстал — снимок пропускаем, а не копим очередь
+            line = self.encode(event, **data)
+            sent = self.write(line)
+            if sent:
+                self.pending = line[sent:]
+        except OSError:
+            # бот закрыл канал — дальше обходим без отчётов о прогрессе
+            self.pending = b''
+            self.close()
+
+    def drain(self, timeout=5.0):
+        """Дописать хвост перед закрытием канала, ожидая читателя не дольше timeout секунд"""
+        target = self.sock if self.sock is not None else self.fd
+        deadline = time.monotonic() + timeout
+        while self.pending and target is not None:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            select.select([], [target], [], left)
+            self.pending = self.pending[self.write(self.pending):]
+
+    def close(self):
+        try:
+            self.drain()
+        except OSError:
+            pass
+        self.pending = b''
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        elif self.fd is not None:
+            os.close(self.fd)
+        self.fd = None
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.started_at = time.monotonic()
+        self.emit('started', job=getattr(spider, 'job_id', None))
+        self.poller = task.LoopingCall(self.report)
+        self.poller.start(self.interval, now=False)
+
+    def snapshot(self):
+        checkpoint = getattr(self.spider, 'checkpoint', None)
+        progress = checkpoint.progress() if checkpoint is not None else {}
+        stats = self.crawler.stats
+        elapsed = time.monotonic() - self.started_at
+        progress.setdefault('stored', stats.get_value('item_scraped_count', 0))
+        return {
+            'pages_done': progress.get('pages_done', 0),
+            'pages_total': progress.get('pages_done', 0) + progress.get('pages_pending', 0),
+            'listings_done': progress.get('listings_done', 0),
+            'listings_total': progress.get('listings_done', 0) + progress.get('listings_pending', 0),
+            'stored': progress['stored'],
+            'errors': stats.get_value('log_count/ERROR', 0),
+            'elapsed': round(elapsed, 1),
+            'eta': estimate_eta(progress, elapsed),
+        }
+
+    def report(self):
+        self.emit('progress', **self.snapshot())
+
+    def spider_closed(self, spider, reason):
+        if self.poller and self.poller.running:
+            self.poller.stop()
+        if self.fd is not None or self.sock is not None:
+            # итоговое событие не пропускаем: close() дождётся, пока читатель его примет
+            self.pending += self.encode('finished', reason=reason, **self.snapshot())
+        self.close()
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import sqlite3
+import time
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не обязателен: без него миниатюры не создаются
+    Image = None
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+
+def content_checksum(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+def content_path(checksum: str, url: str = "") -> str:
+    """Путь файла по хешу содержимого: одинаковое фото любого объявления/агентства — один файл"""
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    if ext not in IMAGE_EXTENSIONS:
+        ext = ".jpg"
+    return f"full/{checksum[:2]}/{checksum[2:4]}/{checksum}{ext}"
+
+
+def thumbnail_path(checksum: str) -> str:
+    return f"thumbs/{checksum[:2]}/{checksum[2:4]}/{checksum}.jpg"
+
+
+def make_thumbnail(body: bytes, size: Tuple[int, int]) -> Optional[bytes]:
+    """JPEG-миниатюра с сохранением пропорций; None — нет Pillow или файл не картинка"""
+    if Image is None:
+        return None
+    try:
+        with Image.open(BytesIO(body)) as image:
+            image.thumbnail(size)
+            buf = BytesIO()
+            image.convert("RGB").save(buf, "JPEG", quality=80)
+            return buf.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+class ImageIndex:
+    """
+    Индекс хранилища фото в SQLite: URL → хеш содержимого и хеш → файл/миниатюра.
+    По нему повторный обход не качает уже сохранённые URL, а одинаковые снимки
+    под разными URL (переопубликование, другое агентство) хранятся один раз.
+    """
+
+    COMMIT_EVERY = 100  # Записей между коммитами; при сбое теряется только повторное скачивание
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            checksum TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            thumbnail TEXT,
+            size INTEGER,
+            stored_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS urls (
+            url TEXT PRIMARY KEY,
+            checksum TEXT NOT NULL REFERENCES blobs (checksum),
+            seen_at REAL
+        );
+        """)
+        self.uncommitted = 0
+
+    def lookup(self, url: str) -> Optional[Dict]:
+        row = self.conn.execute(
+            "SELECT u.checksum, b.path, b.thumbnail FROM urls u JOIN blobs b ON b.checksum = u.checksum "
+            "WHERE u.url = ?", (url,)
+        ).fetchone()
+        return {"checksum": row[0], "path": row[1], "thumbnail": row[2]} if row else None
+
+    def has_blob(self, checksum: str) -> bool:
+        return self.blob_path(checksum) is not None
+
+    def blob_path(self, checksum: str) -> Optional[str]:
+        """Путь уже сохранённого файла: расширение взято из URL, под которым снимок скачан впервые"""
+        row = self.conn.execute("SELECT path FROM blobs WHERE checksum = ?", (checksum,)).fetchone()
+        return row[0] if row else None
+
+    def add_blob(self, checksum: str, path: str, thumbnail: Optional[str], size: int) -> None:
+        self.conn.execute(
+            "INSERT OR IGNORE INTO blobs (checksum, path, thumbnail, size, stored_at) VALUES (?, ?, ?, ?, ?)",
+            (checksum, path, thumbnail, size, time.time()),
+        )
+        self.touch()
+
+    def set_thumbnail(self, checksum: str, thumbnail: str) -> None:
+        self.conn.execute("UPDATE blobs SET thumbnail = ? WHERE checksum = ?", (thumbnail, checksum))
+        self.touch()
+
+    def add_url(self, url: str, checksum: str) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO urls (url, checksum, seen_at) VALUES (?, ?, ?)",
+                          (url, checksum, time.time()))
+        self.touch()
+
+    def touch(self) -> None:
+        self.uncommitted += 1
+        if self.uncommitted >= self.COMMIT_EVERY:
+            self.commit()
+
+    def commit(self) -> None:
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def stats(self) -> Dict[str, int]:
+        blobs, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        urls = self.conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        return {"urls": urls, "files": blobs, "bytes": size}
+
+    def close(self) -> None:
+        if self.conn:
+            self.commit()
+            self.conn.close()
+            self.conn = None
@@ -1,26 +1,50 @@
-import scrapy
+from dataclasses import dataclass
+from datetime import datetime
+from typing import ClassVar, Dict, List, Optional, Tuple
 
-class ImotItem(scrapy.Item):
-    source = scrapy.Field()             # Источник данных (например, 'imot.bg')
-    source_id = scrapy.Field()          # Уникальный ID объявления на сайте
-    title = scrapy.Field()              # Заголовок объявления
-    price = scrapy.Field()              # Цена объекта
-    currency = scrapy.Field()           # Валюта цены (например, 'EUR', 'BGN')
-    price_sqm = scrapy.Field()          # Цена за квадратный метр
-    area = scrapy.Field()               # Площадь объекта (кв.м)
-    rooms = scrapy.Field()              # Количество комнат
-    floor = scrapy.Field()              # Этаж
-    construction_type = scrapy.Field()  # Тип строения (например, тухла, панел)
-    year_built = scrapy.Field()         # Год постройки
-    condition = scrapy.Field()          # Състояние на имота (например, ново строителство)
-    features = scrapy.Field()           # Характеристики / екстри (списък)
-    description = scrapy.Field()        # Описание на имота
-    location = scrapy.Field()           # Местоположение (адрес или квартал)
-    district = scrapy.Field()           # Район
-    city = scrapy.Field()               # Град
-    url = scrapy.Field()                # URL към обявата
-    images = scrapy.Field()             # Списък с URL-та към снимки
-    agency = scrapy.Field()             # Агенция или лице, публикувало обявата
-    phone = scrapy.Field()              # Телефон за контакт
-    scraped_at = scrapy.Field()         # Време на събиране на данните
-    page_found = scrapy.Field()
+
+@dataclass(slots=True)
+class ImotItem:
+    """
+    Объявление imot.bg. Dataclass со __slots__ вместо dict-backed scrapy.Item:
+    меньше памяти и аллокаций на объект, ItemAdapter поддерживает его штатно.
+    """
+    source: str = 'imot.bg'                     # Источник данных
+    source_id: Optional[str] = None             # Уникальный ID объявления на сайте
+    title: Optional[str] = None                 # Заголовок объявления
+    price: Optional[float] = None               # Цена объекта
+    currency: Optional[str] = None              # Валюта цены (например, 'EUR', 'BGN')
+    price_sqm: Optional[float] = None           # Цена за квадратный метр
+    area: Optional[float] = None                # Площадь объекта (кв.м)
+    rooms: Optional[int] = None                 # Количество комнат
+    floor: Optional[str] = None                 # Этаж
+    construction_type: Optional[str] = None     # Тип строения (например, тухла, панел)
+    year_built: Optional[int] = None            # Год постройки
+    description: Optional[str] = None           # Описание на имота
+    location: Optional[str] = None              # Местоположение (адрес или квартал)
+    district: Optional[str] = None              # Район
+    city: Optional[str] = None                  # Град
+    url: Optional[str] = None                   # URL към обявата
+    images: Optional[List[str]] = None          # Списък с URL-та към снимки
+    agency: Optional[str] = None                # Агенция или лице, публикувало обявата
+    phone: Optional[str] = None                 # Телефон за контакт
+    scraped_at: Optional[datetime] = None       # Време на събиране на данните
+    page_found: Optional[int] = None            # Страница выдачи, где найдено объявление
+    cluster_id: Optional[str] = None            # Кластер почти-дубликатов (ставит пайплайн)
+    image_files: Optional[List[Dict]] = None    # Сохранённые фото: url, path, checksum (ListingImagesPipeline)
+
+    # Порядок колонок sofia_apartments для пакетной записи
+    DB_COLUMNS: ClassVar[Tuple[str, ...]] = (
+        'source_id', 'title', 'price', 'currency', 'price_sqm', 'area', 'rooms',
+        'floor', 'construction_type', 'year_built', 'description', 'location',
+        'district', 'city', 'agency', 'phone', 'url', 'scraped_at', 'cluster_id', 'images',
+    )
+
+    def as_db_row(self) -> tuple:
+        """Кортеж значений в порядке DB_COLUMNS — без промежуточного dict"""
+        return (
+            self.source_id, self.title, self.price, self.currency, self.price_sqm, self.area,
+            self.rooms, self.floor, self.construction_type, self.year_built, self.description,
+            self.location, self.district, self.city, self.agency, self.phone, self.url,
+            self.scraped_at, self.cluster_id, self.images,
+        )
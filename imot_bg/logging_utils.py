@@ -0,0 +1,141 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+# Стандартные атрибуты LogRecord — всё остальное попадает в JSON как поля события
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "spider"}
+
+# Лимиты по умолчанию (записей в секунду) для событий горячего пути
+DEFAULT_EVENT_RATES = {
+    "response": 2.0,       # ImotBgDownloaderMiddleware.process_response
+    "listing": 2.0,        # ImotBgSpider.parse_listing
+    "upsert": 2.0,         # PostgresPipeline.process_item (DEBUG)
+    "spider_output": 5.0,  # строки вывода паука в боте
+}
+
+
+class EventRateLimitFilter(logging.Filter):
+    """
+    Ограничение частоты записей по типу события (extra={"event": ...}).
+    Token bucket на каждый тип; записи без event и уровня WARNING+ не ограничиваются.
+    Число подавленных записей добавляется к следующей пропущенной (поле suppressed).
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None, burst: float = 5.0):
+        super().__init__()
+        self.rates = dict(DEFAULT_EVENT_RATES if rates is None else rates)
+        self.burst = burst
+        self.buckets = {}
+        self.suppressed = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        rate = self.rates.get(event)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(event, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self.buckets[event] = (tokens, now)
+                self.suppressed[event] = self.suppressed.get(event, 0) + 1
+                return False
+            self.buckets[event] = (tokens - 1, now)
+            skipped = self.suppressed.pop(event, 0)
+        if skipped:
+            record.suppressed = skipped
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поля из extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SuppressedCountFormatter(logging.Formatter):
+    """Обычный текстовый формат с пометкой о подавленных записях"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        skipped = getattr(record, "suppressed", 0)
+        return f"{text} (+{skipped} подавлено)" if skipped else text
+
+
+def _level(value) -> int:
+    return value if isinstance(value, int) else logging.getLevelName(str(value).upper())
+
+
+def setup_queue_logging(
+    path: Optional[str],
+    level=logging.INFO,
+    json_format: bool = False,
+    rates: Optional[Dict[str, float]] = None,
+    console_level=logging.INFO,
+    fmt: str = "%(asctime)s [%(levelname)s] %(message)s",
+    max_bytes: int = 20 * 1024 * 1024,
+    backup_count: int = 5,
+) -> logging.handlers.QueueListener:
+    """
+    Логирование через QueueHandler/QueueListener: вызывающий поток (реактор,
+    цикл событий бота) только кладёт запись в очередь, форматирование и запись
+    в файл/консоль выполняет фоновый поток. Файл ротируется по размеру.
+    """
+    level = _level(level)
+    console_level = _level(console_level) if console_level is not None else None
+    formatter = JsonFormatter() if json_format else SuppressedCountFormatter(fmt)
+
+    handlers = []
+    if path:
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        file_handler.setFormatter(formatter)
+        file_handler.setLevel(level)
+        handlers.append(file_handler)
+    if console_level is not None:
+        console = logging.StreamHandler()
+        console.setFormatter(formatter)
+        console.setLevel(console_level)
+        handlers.append(console)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(EventRateLimitFilter(rates))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, (logging.handlers.QueueHandler, logging.StreamHandler)):
+            root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(min(level, console_level if console_level is not None else level))
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener: logging.handlers.QueueListener) -> None:
+    """Дописать очередь при выходе (если слушатель ещё не остановлен)"""
+    if getattr(listener, "_thread", None) is not None:
+        listener.stop()
@@ -0,0 +1,295 @@
+# Метрики по всему конвейеру (паук → пайплайн → экспорт → бот).
+# Без зависимостей от Scrapy: модуль используется и пауком, и ботом.
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+RESERVOIR_SIZE = 1024  # Последние значения гистограммы для p50/p95 в JSON-сводке
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{str(v).replace(chr(34), chr(39))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple, object] = {}
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        for key, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {value}"
+
+    def summary(self):
+        return {",".join(map(str, k)) or "total": v for k, v in self.values.items()}
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {
+                    "counts": [0] * len(self.buckets), "sum": 0.0, "count": 0, "recent": []
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+            state["recent"].append(value)
+            if len(state["recent"]) > RESERVOIR_SIZE:
+                del state["recent"][: len(state["recent"]) - RESERVOIR_SIZE]
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер длительности блока в секундах"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        for key, state in self.values.items():
+            for bound, count in zip(self.buckets, state["counts"]):
+                labels = _format_labels(self.label_names, key, 'le="%s"' % bound)
+                yield f"{self.name}_bucket{labels} {count}"
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {state['count']}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {state['sum']}"
+            yield f"{self.name}_count{labels} {state['count']}"
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Квантиль по последним значениям всех наборов меток"""
+        with self.lock:
+            values = [v for state in self.values.values() for v in state["recent"]]
+        return _percentile(values, q)
+
+    def summary(self):
+        result = {}
+        for key, state in self.values.items():
+            result[",".join(map(str, key)) or "total"] = {
+                "count": state["count"],
+                "sum": round(state["sum"], 6),
+                "avg": round(state["sum"] / state["count"], 6) if state["count"] else None,
+                "p50": _percentile(state["recent"], 0.5),
+                "p95": _percentile(state["recent"], 0.95),
+            }
+        return result
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса"""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, labels, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            with metric.lock:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> dict:
+        result = {}
+        for name, metric in list(self.metrics.items()):
+            with metric.lock:
+                result[name] = metric.summary()
+        return result
+
+    def dump_json(self, path: str, **extra) -> str:
+        """Сохранение JSON-сводки всех метрик"""
+        data = {"generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), **extra, "metrics": self.summary()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        return path
+
+
+REGISTRY = MetricsRegistry()
+
+# Метрики конвейера
+QUEUE_DEPTH = REGISTRY.gauge("imot_scheduler_queue_depth", "Запросов в очереди планировщика")
+REQUESTS_IN_PROGRESS = REGISTRY.gauge("imot_requests_in_progress", "Запросов в загрузке")
+FETCH_SECONDS = REGISTRY.histogram(
+    "imot_fetch_seconds", "Время загрузки страницы", ("handler", "status"))
+PARSE_SECONDS = REGISTRY.histogram("imot_parse_seconds", "Время работы callback паука", ("callback",))
+ITEMS_TOTAL = REGISTRY.counter("imot_items_total", "Объявлений по результату", ("result",))
+ERRORS_TOTAL = REGISTRY.counter("imot_errors_total", "Ошибок по типу", ("kind",))
+DB_INSERT_SECONDS = REGISTRY.histogram("imot_db_insert_seconds", "Время upsert пачки объявлений")
+DB_COMMIT_SECONDS = REGISTRY.histogram("imot_db_commit_seconds", "Время коммита пачки")
+DB_BATCH_SIZE = REGISTRY.histogram(
+    "imot_db_batch_size", "Объявлений в закоммиченной пачке", buckets=SIZE_BUCKETS)
+EXPORT_SECONDS = REGISTRY.histogram("imot_export_seconds", "Этапы экспорта в Excel", ("stage",))
+EXPORT_ROWS = REGISTRY.histogram("imot_export_rows", "Строк в экспорте", buckets=SIZE_BUCKETS)
+TELEGRAM_UPLOAD_SECONDS = REGISTRY.histogram(
+    "imot_telegram_upload_seconds", "Время отправки файла в Telegram")
+BOT_UPDATES_TOTAL = REGISTRY.counter("imot_bot_updates_total", "Обновлений вебхука по результату", ("result",))
+
+
+def timed_callback(func):
+    """
+    Декоратор callback паука: суммирует время, проведённое внутри генератора,
+    без учёта обработки уже выданных запросов/объектов движком.
+    """
+    name = func.__name__
+
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            spent = 0.0
+            agen = func(*args, **kwargs)
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        value = await agen.__anext__()
+                    except StopAsyncIteration:
+                        spent += time.perf_counter() - started
+                        break
+                    spent += time.perf_counter() - started
+                    yield value
+            finally:
+                PARSE_SECONDS.observe(spent, callback=name)
+        return async_wrapper
+
+    if not inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def plain_wrapper(*args, **kwargs):
+            with PARSE_SECONDS.time(callback=name):
+                return func(*args, **kwargs)
+        return plain_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        spent = 0.0
+        result = func(*args, **kwargs)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    value = next(result)
+                except StopIteration:
+                    spent += time.perf_counter() - started
+                    break
+                spent += time.perf_counter() - started
+                yield value
+        finally:
+            PARSE_SECONDS.observe(spent, callback=name)
+    return wrapper
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.startswith("/metrics"):
+            body = self.registry.render_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path.startswith("/summary"):
+            body = json.dumps(self.registry.summary(), ensure_ascii=False).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY):
+    """
+    Запуск HTTP-эндпоинта /metrics (Prometheus) и /summary (JSON) в фоновом потоке.
+    Возвращает сервер или None, если порт не задан или занят.
+    """
+    if not port:
+        return None
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logger.warning(f"⚠️ Эндпоинт метрик не запущен на {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+    return server
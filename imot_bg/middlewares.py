@@ -2,8 +2,12 @@ import logging
 import os
 import random
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
 from scrapy.http import Request
 from scrapy.downloadermiddlewares.retry import get_retry_request
+from imot_bg.deadletter import PERMANENT_STATUSES, DeadLetterStore, listing_delisted
+from imot_bg.playwright_pool import is_browser_crash
+from imot_bg.targets import listing_id_from_url
 
 logger = logging.getLogger(__name__)
 
@@ -60,12 +64,11 @@ class ImotBgDownloaderMiddleware:
         else:
             request.cookies = {}
 
-        logger.debug(f"➡️ Запрос к: {request.url}")
+        logger.debug("➡️ Запрос к: %s", request.url, extra={'event': 'request'})
         return None
 
     def process_response(self, request, response, spider):
-        spider.logger.debug(f"👁️ MIDDLEWARE response for: {response.url}")
-        logger.info(f"📥 Ответ {response.status} от {response.url}")
+        logger.info("📥 Ответ %s от %s", response.status, response.url, extra={'event': 'response'})
 
         # Повторяем попытки на коды ошибок 522, 523, 524, 525
         if response.status in {522, 523, 524, 525}:
@@ -75,21 +78,7 @@ class ImotBgDownloaderMiddleware:
                 logger.warning(f"🔁 Повтор запроса из-за статуса {response.status}: {request.url}")
                 return retry_req
 
-        # Логируем и сохраняем нестандартные ответы
-        if response.status != 200:
-            district = request.meta.get('district', 'unknown')
-            page = request.meta.get('page', 'unknown')
-            safe_url = request.url.replace("/", "_").replace(":", "")
-            file_name = f"bad_response_{district}_{page}_{safe_url}.html"
-            path = os.path.join(os.getcwd(), file_name)
-
-            try:
-                with open(path, "w", encoding="utf-8") as f:
-                    f.write(response.text)
-                logger.warning(f"💾 Ответ сохранён в файл: {file_name}")
-            except Exception as e:
-                logger.error(f"❌ Не удалось сохранить ответ: {e}")
-
+        # неудачные ответы записывает DeadLetterMiddleware (сжатый фрагмент тела, с ротацией)
         return response
 
     def process_exception(self, request, exception, spider):
@@ -99,6 +88,101 @@ class ImotBgDownloaderMiddleware:
         logger.info(f"🔧 Downloader middleware активирован для: {spider.name}")
 
 
+class DeadLetterMiddleware:
+    """
+    Окончательно неудачные запросы (ответ >= 400 или исключение после всех повторов
+    RetryMiddleware — поэтому стоит раньше него в DOWNLOADER_MIDDLEWARES) пишутся
+    в DeadLetterStore. 404/410 на странице объявления — объявление снято: отправляется
+    сигнал listing_delisted, а PostgresPipeline переносит его в архив.
+    По завершении обхода — сводка в лог, статистику Scrapy и строкой в тот же журнал.
+    """
+
+    CALLBACK_KINDS = {'parse_listing': 'listing', 'parse_search_results': 'search'}
+
+    def __init__(self, store, crawler):
+        self.store = store
+        self.crawler = crawler
+        self.images_slot = crawler.settings.get('IMAGES_DOWNLOAD_SLOT', 'images')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        store = DeadLetterStore(
+            settings.get('DEADLETTER_PATH', 'deadletter/deadletter.jsonl'),
+            max_bytes=settings.getint('DEADLETTER_MAX_BYTES', 5 * 1024 * 1024),
+            backups=settings.getint('DEADLETTER_BACKUPS', 3),
+            sample_bytes=settings.getint('DEADLETTER_SAMPLE_BYTES', 2048),
+        )
+        s = cls(store, crawler)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def request_kind(self, request):
+        kind = self.CALLBACK_KINDS.get(getattr(request.callback, '__name__', None))
+        if kind:
+            return kind
+        return 'image' if request.meta.get('download_slot') == self.images_slot else 'other'
+
+    def process_response(self, request, response, spider):
+        if response.status < 400:
+            return response
+        kind = self.request_kind(request)
+        self.store.record(
+            request.url, kind, status=response.status,
+            elapsed=request.meta.get('download_latency'),
+            retries=request.meta.get('retry_times', 0),
+            body=response.body,
+            district=request.meta.get('district'),
+            page=request.meta.get('page'),
+        )
+        if response.status in PERMANENT_STATUSES and kind == 'listing':
+            source_id = listing_id_from_url(request.url)
+            if source_id:
+                self.store.delisted += 1
+                self.crawler.signals.send_catch_log(listing_delisted, source_id=source_id, url=request.url)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, IgnoreRequest):
+            # отброшен намеренно (offsite, фильтры, robots.txt) — не сбой загрузки
+            return None
+        self.store.record(
+            request.url, self.request_kind(request), reason=type(exception).__name__,
+            retries=request.meta.get('retry_times', 0),
+            district=request.meta.get('district'),
+            page=request.meta.get('page'),
+        )
+        return None
+
+    def spider_closed(self, spider, reason):
+        summary = self.store.summary()
+        if summary['total']:
+            self.store.record_summary(job=getattr(spider, 'job_id', None) or spider.name, reason=reason)
+        self.store.close()
+        stats = self.crawler.stats
+        for status, count in summary['by_status'].items():
+            stats.set_value(f'deadletter/status/{status}', count)
+        stats.set_value('deadletter/delisted', summary['delisted'])
+        if not summary['total']:
+            return
+        statuses = ", ".join(f"{status}: {count}" for status, count in summary['by_status'].items())
+        logger.warning(f"🪦 Неудачных запросов за обход: {summary['total']} ({statuses}); "
+                       f"снято объявлений: {summary['delisted']}. Журнал: {self.store.path}")
+
+
+class PlaywrightCrashRetryMiddleware:
+    """
+    Запросы, упавшие из-за краха браузера или страницы, отправляются на повтор:
+    PooledPlaywrightDownloadHandler к тому времени переводит пул на новые контексты.
+    """
+
+    def process_exception(self, request, exception, spider):
+        if request.meta.get('playwright') and is_browser_crash(exception):
+            logger.warning(f"💥 Браузер/страница упали на {request.url}: {exception}")
+            return get_retry_request(request, reason='playwright crash', spider=spider)
+        return None
+
+
 class RandomUserAgentMiddleware:
     USER_AGENTS = [
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
@@ -115,4 +199,4 @@ class RandomUserAgentMiddleware:
     def process_request(self, request: Request, spider):
         user_agent = random.choice(self.USER_AGENTS)
         request.headers['User-Agent'] = user_agent
-        logger.debug(f"🎭 User-Agent установлен: {user_agent}")
+        logger.debug("🎭 User-Agent установлен: %s", user_agent, extra={'event': 'request'})
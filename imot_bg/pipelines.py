@@ -1,21 +1,109 @@
-import psycopg2
+from collections import Counter
+from datetime import datetime
+from psycopg2.extras import execute_values
 from itemadapter import ItemAdapter
+from io import BytesIO
+from scrapy import Request, signals
 from scrapy.exceptions import DropItem
+from scrapy.http.request import NO_CALLBACK
+from scrapy.pipelines.files import FilesPipeline
+from scrapy.settings import Settings
+from twisted.internet import threads
 import os
 from dotenv import load_dotenv
+from imot_bg import metrics
+from imot_bg.items import ImotItem
+from imot_bg.alerts import AlertIngest, create_tables as create_alert_tables
+from imot_bg.db import connect
+from imot_bg.dedup import Deduplicator, create_tables as create_dedup_tables
+from imot_bg.storage import ListingStorage, city_key
+from imot_bg.deadletter import listing_delisted
+from imot_bg.images import ImageIndex, content_checksum, content_path, make_thumbnail, thumbnail_path
 
 load_dotenv()
 
+# Строка пачки: колонки ImotItem.DB_COLUMNS + ключ партиции города
+ROW_COLUMNS = ImotItem.DB_COLUMNS + ('city_key',)
+UPDATE_COLUMNS = [c for c in ImotItem.DB_COLUMNS if c not in ('source_id', 'cluster_id')]
+CLUSTER_INDEX = ImotItem.DB_COLUMNS.index('cluster_id')
+PRICE_INDEX = ImotItem.DB_COLUMNS.index('price')
+PRICE_SQM_INDEX = ImotItem.DB_COLUMNS.index('price_sqm')
+SCRAPED_INDEX = ImotItem.DB_COLUMNS.index('scraped_at')
+CITY_INDEX = ImotItem.DB_COLUMNS.index('city')
+DISTRICT_INDEX = ImotItem.DB_COLUMNS.index('district')
+
+# first_seen/updated_at/change_txid ставятся по умолчанию при вставке; при повторной встрече
+# updated_at и change_txid сдвигаются только если изменилась цена (по change_txid строятся дельта-отчёты).
+# Конфликт ищется только среди активных строк города: архивные возвращаются заранее (ListingStorage.revive)
+UPSERT_QUERY = (
+    f"INSERT INTO sofia_apartments ({', '.join(ROW_COLUMNS)}) VALUES %s "
+    f"ON CONFLICT (city_key, archived, source_id) DO UPDATE SET "
+    + ", ".join(f"{c} = EXCLUDED.{c}" for c in UPDATE_COLUMNS)
+    + ", last_seen = CURRENT_TIMESTAMP, missed_crawls = 0"
+    + ", cluster_id = COALESCE(EXCLUDED.cluster_id, sofia_apartments.cluster_id)"
+    + ", previous_price = CASE WHEN sofia_apartments.price IS DISTINCT FROM EXCLUDED.price "
+      "THEN sofia_apartments.price ELSE sofia_apartments.previous_price END"
+    + ", updated_at = CASE WHEN sofia_apartments.price IS DISTINCT FROM EXCLUDED.price "
+      "THEN CURRENT_TIMESTAMP ELSE sofia_apartments.updated_at END"
+    + ", change_txid = CASE WHEN sofia_apartments.price IS DISTINCT FROM EXCLUDED.price "
+      "THEN txid_current() ELSE sofia_apartments.change_txid END"
+    # xmax = 0 — строка вставлена; updated_at = CURRENT_TIMESTAMP — новая или переоценённая
+    + " RETURNING source_id, xmax = 0, updated_at = CURRENT_TIMESTAMP"
+)
+
 class PostgresPipeline:
     """
     Scrapy pipeline для сохранения данных в PostgreSQL.
     Использует параметры подключения из переменных окружения:
     DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+
+    Копит строки-кортежи и пишет их пачками по PIPELINE_COMMIT_BATCH объявлений
+    одним INSERT ... ON CONFLICT; после каждого коммита id объявлений
+    фиксируются в чекпойнте задания (если он есть у паука).
+
+    Таблица партиционирована по городу и признаку архива (imot_bg.storage);
+    после успешного обхода объявления района, не встреченные ARCHIVE_AFTER_MISSED_CRAWLS
+    обходов подряд, переносятся в архивную партицию.
     """
 
-    def __init__(self):
+    def __init__(self, commit_batch=50, alerts=None, dedup=None, storage=None):
         self.conn = None
         self.cur = None
+        self.commit_batch = max(1, commit_batch)
+        self.alerts = alerts
+        self.dedup = dedup
+        self.storage = storage or ListingStorage()
+        # source_id -> строка в порядке ROW_COLUMNS; повтор id в пачке заменяет строку
+        self.pending_rows = {}
+        self.crawl_started = None
+        # (city_key, район) -> записано объявлений за этот запуск
+        self.seen_targets = Counter()
+        # source_id объявлений, ответивших 404/410 (DeadLetterMiddleware); уходят в архив с пачкой
+        self.delisted = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        alerts = None
+        if crawler.settings.getbool('ALERTS_ENABLED', True):
+            alerts = AlertIngest(reload_seconds=crawler.settings.getfloat('ALERTS_RELOAD_SECONDS', 60.0))
+        dedup = None
+        if crawler.settings.getbool('DEDUP_ENABLED', True):
+            dedup = Deduplicator(
+                threshold=crawler.settings.getfloat('DEDUP_THRESHOLD', 0.8),
+                num_perm=crawler.settings.getint('DEDUP_NUM_PERM', 64),
+                bands=crawler.settings.getint('DEDUP_BANDS', 16),
+                area_bucket=crawler.settings.getfloat('DEDUP_AREA_BUCKET', 5.0),
+            )
+        storage = ListingStorage(archive_after=crawler.settings.getint('ARCHIVE_AFTER_MISSED_CRAWLS', 3))
+        pipeline = cls(commit_batch=crawler.settings.getint('PIPELINE_COMMIT_BATCH', 50),
+                       alerts=alerts, dedup=dedup, storage=storage)
+        # архивирование — после закрытия паука, когда известна причина остановки
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(pipeline.listing_delisted, signal=listing_delisted)
+        return pipeline
+
+    def listing_delisted(self, source_id, url):
+        self.delisted.add(source_id)
 
     def open_spider(self, spider):
         # Проверка обязательных env переменных
@@ -26,15 +114,15 @@ class PostgresPipeline:
             raise RuntimeError(f"Missing environment variables: {missing_vars}")
 
         try:
-            self.conn = psycopg2.connect(
-                host=os.getenv("DB_HOST"),
-                port=int(os.getenv("DB_PORT", 5432)),
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD"),
-                dbname=os.getenv("DB_NAME"),
-            )
+            self.conn = connect()
             self.cur = self.conn.cursor()
-            self.create_table()
+            self.storage.create_schema(self.cur)
+            self.crawl_started = self.read_crawl_started(spider)
+            if self.alerts:
+                create_alert_tables(self.cur)
+            if self.dedup:
+                create_dedup_tables(self.cur)
+            self.conn.commit()
             spider.logger.info("✅ Подключение к PostgreSQL установлено.")
         except Exception as e:
             spider.logger.error(f"❌ Ошибка подключения к БД: {e}")
@@ -42,105 +130,319 @@ class PostgresPipeline:
             self.cur = None
             raise e
 
+    def read_crawl_started(self, spider):
+        """
+        Начало обхода по часам БД (с ним сравнивается last_seen). Возобновлённое
+        задание берёт отметку первого запуска из чекпойнта.
+        """
+        checkpoint = getattr(spider, 'checkpoint', None)
+        started = checkpoint.get_meta('crawl_started') if checkpoint else None
+        if started:
+            return datetime.fromisoformat(started)
+        self.cur.execute("SELECT LOCALTIMESTAMP")
+        started = self.cur.fetchone()[0]
+        if checkpoint:
+            checkpoint.set_meta('crawl_started', started.isoformat())
+        return started
+
     def close_spider(self, spider):
         if self.conn:
             try:
-                self.conn.commit()  # один коммит в конце работы паука
-                if self.cur:
-                    self.cur.close()
-                self.conn.close()
-                spider.logger.info("🔌 Соединение с БД закрыто.")
+                self.commit(spider)  # дописываем последнюю неполную пачку
+            except Exception as e:
+                spider.logger.error(f"❌ Ошибка при записи последней пачки: {e}")
+
+    def spider_closed(self, spider, reason):
+        if not self.conn:
+            return
+        try:
+            if reason == 'finished':
+                self.archive_unseen(spider)
+        except Exception as e:
+            self.conn.rollback()
+            metrics.ERRORS_TOTAL.inc(kind='db')
+            spider.logger.error(f"❌ Ошибка архивирования: {e}")
+        try:
+            if self.cur:
+                self.cur.close()
+            self.conn.close()
+            spider.logger.info("🔌 Соединение с БД закрыто.")
+        except Exception as e:
+            spider.logger.error(f"❌ Ошибка при закрытии соединения: {e}")
+        finally:
+            self.conn = None
+            self.cur = None
+
+    def archive_delisted(self, spider):
+        """Снятые с публикации объявления сразу переезжают в архивную партицию"""
+        delisted, self.delisted = self.delisted, set()
+        try:
+            self.cur.execute("SAVEPOINT delisted")
+            archived = self.storage.archive_listings(self.cur, delisted)
+            self.cur.execute("RELEASE SAVEPOINT delisted")
+        except Exception as e:
+            self.cur.execute("ROLLBACK TO SAVEPOINT delisted")
+            metrics.ERRORS_TOTAL.inc(kind='db')
+            spider.logger.error(f"❌ Ошибка архивирования снятых объявлений: {e}")
+            return
+        if archived:
+            spider.logger.info(f"🪦 Сняты с публикации (404/410), перенесены в архив: {archived}")
+
+    def archive_unseen(self, spider):
+        """
+        Пропуск обхода засчитывается только районам, обойденным полностью (spider.completed_targets():
+        выдача до последней страницы, без капчи и ошибок) и из которых в этом запуске что-то
+        записано: недообойдённый район не должен отправлять живые объявления в архив.
+        """
+        completed = spider.completed_targets() if hasattr(spider, 'completed_targets') else set()
+        archived = 0
+        for target in getattr(spider, 'targets', []):
+            key = city_key(target.city)
+            if (key, target.district) not in completed:
+                spider.logger.warning(f"⚠️ {target.city}/{target.district}: обход неполный, архивирование пропущено")
+                continue
+            if not self.seen_targets[key, target.district]:
+                spider.logger.warning(f"⚠️ {target.city}/{target.district}: ничего не записано, архивирование пропущено")
+                continue
+            archived += self.storage.archive_unseen(self.cur, key, target.district, self.crawl_started)
+        self.conn.commit()
+        if archived:
+            spider.logger.info(f"🗄️ В архив перенесено объявлений: {archived}")
+
+    def commit(self, spider):
+        """Запись накопленной пачки одним INSERT, коммит и фиксация id в чекпойнте задания"""
+        stored = self.flush(spider) if self.pending_rows else []
+        stored_ids = [row[0] for row, _ in stored]
+        if stored:
+            self.record_history(stored, spider)
+        if self.alerts and stored:
+            self.queue_alerts(stored, spider)
+        if self.delisted:
+            self.archive_delisted(spider)
+        with metrics.DB_COMMIT_SECONDS.time():
+            self.conn.commit()
+        if stored_ids:
+            metrics.DB_BATCH_SIZE.observe(len(stored_ids))
+            checkpoint = getattr(spider, 'checkpoint', None)
+            if checkpoint:
+                checkpoint.mark_stored(stored_ids)
+            spider.logger.info(f"💾 Закоммичена пачка: {len(stored_ids)} объявлений")
+
+    def flush(self, spider):
+        """
+        Upsert всей пачки через execute_values. Если пачка падает целиком,
+        откатываемся и пишем построчно с savepoint, чтобы одна битая строка
+        не потеряла остальные. Возвращает записанные строки с отметкой изменения:
+        'new' — вставлена, 'price' — изменилась цена, None — без изменений.
+        """
+        rows = list(self.pending_rows.values())
+        self.pending_rows = {}
+        try:
+            with metrics.DB_INSERT_SECONDS.time():
+                self.storage.revive(self.cur, [row[0] for row in rows])
+                rows = self.with_clusters(rows, spider)
+                returned = execute_values(self.cur, UPSERT_QUERY, rows, page_size=len(rows), fetch=True)
+            return self.with_changes(rows, returned)
+        except Exception as e:
+            self.conn.rollback()
+            spider.logger.warning(f"⚠️ Пачка из {len(rows)} строк не записалась ({e}), пишу построчно")
+
+        stored = []
+        for row in rows:
+            try:
+                self.cur.execute("SAVEPOINT item_upsert")
+                self.storage.revive(self.cur, [row[0]])
+                row = self.with_clusters([row], spider)[0]
+                returned = execute_values(self.cur, UPSERT_QUERY, [row], fetch=True)
+                self.cur.execute("RELEASE SAVEPOINT item_upsert")
+                stored += self.with_changes([row], returned)
             except Exception as e:
-                spider.logger.error(f"❌ Ошибка при закрытии соединения: {e}")
-
-    def create_table(self):
-        query = """
-        CREATE TABLE IF NOT EXISTS sofia_apartments (
-            id SERIAL PRIMARY KEY,
-            title TEXT,
-            price NUMERIC,
-            currency TEXT,
-            price_sqm NUMERIC,
-            area NUMERIC,
-            floor TEXT,
-            construction_type TEXT,
-            year_built INTEGER,
-            description TEXT,
-            location TEXT,
-            district TEXT,
-            city TEXT,
-            agency TEXT,
-            phone TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            url TEXT
-        )
+                self.cur.execute("ROLLBACK TO SAVEPOINT item_upsert")
+                metrics.ERRORS_TOTAL.inc(kind='db')
+                spider.logger.error(f"❌ Ошибка при вставке {row[0]}: {e}")
+        return stored
+
+    def with_clusters(self, rows, spider):
+        """
+        Проставление cluster_id почти-дубликатов (MinHash + LSH, imot_bg.dedup).
+        Ошибка дедупликации откатывается к savepoint: строки пишутся без кластера.
         """
-        self.cur.execute(query)
+        if not self.dedup:
+            return rows
+        try:
+            self.cur.execute("SAVEPOINT dedup")
+            clusters = self.dedup.assign(self.cur, [dict(zip(ImotItem.DB_COLUMNS, row)) for row in rows])
+            self.cur.execute("RELEASE SAVEPOINT dedup")
+        except Exception as e:
+            self.cur.execute("ROLLBACK TO SAVEPOINT dedup")
+            metrics.ERRORS_TOTAL.inc(kind='dedup')
+            spider.logger.error(f"❌ Ошибка дедупликации: {e}")
+            return rows
+        return [
+            row[:CLUSTER_INDEX] + (clusters.get(row[0], row[CLUSTER_INDEX]),) + row[CLUSTER_INDEX + 1:]
+            for row in rows
+        ]
+
+    def with_changes(self, rows, returned):
+        changes = {
+            source_id: ('new' if inserted else 'price') if changed else None
+            for source_id, inserted, changed in returned
+        }
+        for row in rows:
+            self.seen_targets[row[-1], row[DISTRICT_INDEX]] += 1
+        return [(row, changes.get(row[0])) for row in rows]
+
+    def record_history(self, stored, spider):
+        """Новые и переоценённые объявления — в помесячно партиционированную listing_history"""
+        history = [
+            (row[0], row[-1], row[PRICE_INDEX], row[PRICE_SQM_INDEX], change,
+             row[SCRAPED_INDEX] or self.crawl_started)
+            for row, change in stored if change
+        ]
+        if not history:
+            return
+        try:
+            self.cur.execute("SAVEPOINT history")
+            self.storage.record_history(self.cur, history)
+            self.cur.execute("RELEASE SAVEPOINT history")
+        except Exception as e:
+            self.cur.execute("ROLLBACK TO SAVEPOINT history")
+            self.storage.months.clear()  # созданные партиции откатились вместе с savepoint
+            metrics.ERRORS_TOTAL.inc(kind='db')
+            spider.logger.error(f"❌ Ошибка записи истории цен: {e}")
+
+    def queue_alerts(self, stored, spider):
+        """
+        Проверка новых/переоценённых объявлений пачки по сохранённым поискам
+        (indexed AlertMatcher) и запись совпадений в alert_outbox до коммита пачки.
+        Ошибка здесь откатывается к savepoint и не теряет саму пачку.
+        """
+        changed = [
+            dict(zip(ImotItem.DB_COLUMNS, row), change=change) for row, change in stored
+            # копия уже известной квартиры от другого агентства — не "новое" объявление
+            if change and not (change == 'new' and row[CLUSTER_INDEX] not in (None, row[0]))
+        ]
+        if not changed:
+            return
+        try:
+            self.cur.execute("SAVEPOINT alerts")
+            queued = self.alerts.enqueue(self.cur, changed)
+            self.cur.execute("RELEASE SAVEPOINT alerts")
+        except Exception as e:
+            self.cur.execute("ROLLBACK TO SAVEPOINT alerts")
+            metrics.ERRORS_TOTAL.inc(kind='alerts')
+            spider.logger.error(f"❌ Ошибка подбора уведомлений: {e}")
+            return
+        if queued:
+            spider.logger.info(f"🔔 В очередь уведомлений: {queued} (изменённых объявлений: {len(changed)})")
 
     def process_item(self, item, spider):
         if not self.conn or not self.cur:
             spider.logger.warning("⚠️ Пропущен item — нет подключения к БД.")
             raise DropItem("Отсутствует соединение с базой данных.")
 
-        adapter = ItemAdapter(item)
-        source_id = adapter.get('source_id')
-        try:
-            data = self.prepare_data(adapter)
-            insert_query = """
-            INSERT INTO sofia_apartments (
-                title, price, currency, price_sqm, area,
-                floor, construction_type, year_built, description,
-                location, district, city, agency, phone, url
-            ) VALUES (
-                %(title)s, %(price)s, %(currency)s, %(price_sqm)s, %(area)s,
-                %(floor)s, %(construction_type)s, %(year_built)s, %(description)s,
-                %(location)s, %(district)s, %(city)s, %(agency)s, %(phone)s, %(url)s
-            )
-            ON CONFLICT (source_id) DO UPDATE SET
-                title = EXCLUDED.title,
-                price = EXCLUDED.price,
-                currency = EXCLUDED.currency,
-                price_sqm = EXCLUDED.price_sqm,
-                area = EXCLUDED.area,
-                floor = EXCLUDED.floor,
-                construction_type = EXCLUDED.construction_type,
-                year_built = EXCLUDED.year_built,
-                description = EXCLUDED.description,
-                location = EXCLUDED.location,
-                district = EXCLUDED.district,
-                city = EXCLUDED.city,
-                agency = EXCLUDED.agency,
-                phone = EXCLUDED.phone,
-                url = EXCLUDED.url
-            """
-            self.cur.execute(insert_query, data)
-            # не коммитим здесь, коммит в close_spider
-            spider.logger.info(f"✅ Объявление обновлено/сохранено: {source_id}")
-        except Exception as e:
-            self.conn.rollback()
-            spider.logger.error(f"❌ Ошибка при вставке {source_id}: {e}")
-            raise DropItem(f"Ошибка вставки в БД: {e}")
+        if isinstance(item, ImotItem):
+            row = item.as_db_row()
+        else:
+            adapter = ItemAdapter(item)
+            row = tuple(adapter.get(column) for column in ImotItem.DB_COLUMNS)
+        source_id = row[0]
+        if not source_id:
+            raise DropItem("Объявление без source_id")
+        key = city_key(row[CITY_INDEX])
+        if key not in self.storage.cities:
+            # партиция нового города создаётся отдельной транзакцией до записи пачки
+            self.storage.ensure_cities(self.cur, [key])
+            self.conn.commit()
+        row += (key,)
+
+        self.pending_rows[source_id] = row
+        spider.logger.debug("✅ Объявление поставлено в пачку: %s", source_id,
+                            extra={'event': 'upsert', 'source_id': source_id})
+        if len(self.pending_rows) >= self.commit_batch:
+            self.commit(spider)
 
         return item
 
-    def prepare_data(self, adapter):
-        scraped_at = adapter.get('scraped_at')
-
-
-        return {
-            'title': adapter.get('title'),
-            'price': adapter.get('price'),
-            'currency': adapter.get('currency'),
-            'price_sqm': adapter.get('price_sqm'),
-            'area': adapter.get('area'),
-            'floor': adapter.get('floor'),
-            'construction_type': adapter.get('construction_type'),
-            'year_built': adapter.get('year_built'),
-            'description': adapter.get('description'),
-            'location': adapter.get('location'),
-            'district': adapter.get('district'),
-            'city': adapter.get('city'),
-            'agency': adapter.get('agency'),
-            'phone': adapter.get('phone'),
-            'url': adapter.get('url'),
-        }
+
+class ListingImagesPipeline(FilesPipeline):
+    """
+    Фото объявлений (ImotItem.images) в контентно-адресуемом хранилище FILES_STORE:
+    файл называется по sha256 содержимого, поэтому один снимок из разных объявлений
+    и агентств хранится один раз. URL, уже есть в индексе (IMAGES_INDEX_PATH), при
+    повторном обходе не скачиваются. Загрузки идут через отдельный слот загрузчика
+    'images' (DOWNLOAD_SLOTS) и не отнимают параллелизм у страниц.
+    Результат — в ImotItem.image_files: url, path, checksum, status.
+    """
+
+    FILES_URLS_FIELD = 'images'
+    FILES_RESULT_FIELD = 'image_files'
+
+    def __init__(self, store_uri, download_func=None, settings=None, *, crawler=None):
+        super().__init__(store_uri, download_func, settings, crawler=crawler)
+        settings = crawler.settings if crawler else Settings(settings)
+        self.index = ImageIndex(settings.get('IMAGES_INDEX_PATH', 'images/index.sqlite'))
+        self.max_per_listing = settings.getint('IMAGES_MAX_PER_LISTING', 10)
+        self.thumbnail_size = tuple(int(v) for v in settings.getlist('IMAGES_THUMBNAIL_SIZE', [320, 240]))
+        self.download_slot = settings.get('IMAGES_DOWNLOAD_SLOT', 'images')
+        self.new_blobs = set()  # сохранённые в этой загрузке снимки, ждущие миниатюру
+
+    def close_spider(self, spider):
+        stats = self.index.stats()
+        self.index.close()
+        spider.logger.info(f"🖼 Фото в хранилище: {stats['files']} файлов ({stats['bytes'] / 1e6:.1f} МБ), "
+                           f"{stats['urls']} URL")
+
+    def get_media_requests(self, item, info):
+        urls = ItemAdapter(item).get(self.files_urls_field) or []
+        return [
+            # фото лежат на CDN вне allowed_domains — без allow_offsite их отбросил бы OffsiteMiddleware
+            Request(url, callback=NO_CALLBACK, meta={'download_slot': self.download_slot, 'allow_offsite': True})
+            for url in urls[:self.max_per_listing]
+        ]
+
+    def media_to_download(self, request, info, *, item=None):
+        """URL из индекса не скачивается: файл уже лежит в хранилище под хешем содержимого"""
+        known = self.index.lookup(request.url)
+        if known is None:
+            return None
+        self.inc_stats(info.spider, 'uptodate')
+        return {'url': request.url, 'path': known['path'], 'checksum': known['checksum'], 'status': 'uptodate'}
+
+    def file_path(self, request, response=None, info=None, *, item=None):
+        if response is not None:
+            # снимок уже в хранилище (другой URL, возможно с другим расширением) — путь из индекса
+            checksum = content_checksum(response.body)
+            return self.index.blob_path(checksum) or content_path(checksum, request.url)
+        known = self.index.lookup(request.url)
+        return known['path'] if known else super().file_path(request, response, info, item=item)
+
+    def media_downloaded(self, response, request, info, *, item=None):
+        """Миниатюра нового снимка делается в пуле потоков: Pillow не блокирует реактор"""
+        result = super().media_downloaded(response, request, info, item=item)
+        if result['checksum'] not in self.new_blobs:
+            return result
+        self.new_blobs.discard(result['checksum'])
+        dfd = threads.deferToThread(make_thumbnail, response.body, self.thumbnail_size)
+        dfd.addCallback(self.thumbnail_ready, result, info)
+        return dfd
+
+    def thumbnail_ready(self, thumbnail, result, info):
+        if thumbnail is not None:
+            path = thumbnail_path(result['checksum'])
+            self.store.persist_file(path, BytesIO(thumbnail), info)
+            self.index.set_thumbnail(result['checksum'], path)
+        return result
+
+    def file_downloaded(self, response, request, info, *, item=None):
+        checksum = content_checksum(response.body)
+        if self.index.has_blob(checksum):
+            # тот же снимок под другим URL — только запоминаем URL
+            self.inc_stats(info.spider, 'deduplicated')
+        else:
+            path = content_path(checksum, request.url)
+            self.store.persist_file(path, BytesIO(response.body), info)
+            self.index.add_blob(checksum, path, None, len(response.body))
+            self.new_blobs.add(checksum)
+        self.index.add_url(request.url, checksum)
+        return checksum
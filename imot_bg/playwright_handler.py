@@ -0,0 +1,74 @@
+import logging
+
+from scrapy import signals
+from scrapy.utils.defer import deferred_from_coro, maybe_deferred_to_future
+from scrapy_playwright.handler import ScrapyPlaywrightDownloadHandler
+
+from imot_bg.playwright_pool import PlaywrightContextPool, is_browser_crash
+
+logger = logging.getLogger(__name__)
+
+
+class PooledPlaywrightDownloadHandler(ScrapyPlaywrightDownloadHandler):
+    """
+    Обработчик scrapy-playwright с пулом контекстов (PlaywrightContextPool).
+    Имя контекста назначается в момент загрузки, а не в очереди загрузчика, и
+    освобождается сразу после неё — и при ответе, и при исключении. Упавший
+    браузер запускается заново при создании следующего контекста.
+
+    Опирается на внутренности scrapy-playwright 0.0.33 (версия закреплена в
+    requirements.txt): атрибуты browser, browser_launch_lock, browser_type,
+    context_wrappers и метод _maybe_launch_browser. При обновлении — перепроверить.
+    """
+
+    def __init__(self, crawler):
+        super().__init__(crawler)
+        self.pool = PlaywrightContextPool.from_settings(crawler.settings)
+        self.pool.handler = self
+        self.lost_browser = None
+        self.downloads = 0
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    def download_request(self, request, spider):
+        if not request.meta.get("playwright"):
+            return super().download_request(request, spider)
+        return deferred_from_coro(self.download_pooled(request, spider))
+
+    async def download_pooled(self, request, spider):
+        context_name = request.meta["playwright_context"] = self.pool.acquire()
+        self.downloads += 1
+        try:
+            # без playwright_include_page страницу закрывает сам scrapy-playwright
+            return await maybe_deferred_to_future(super().download_request(request, spider))
+        except Exception as e:
+            if is_browser_crash(e):
+                self.check_browser()
+            raise
+        finally:
+            await self.pool.release(request.meta.pop("playwright_page", None), context_name)
+
+    def check_browser(self) -> None:
+        """
+        scrapy-playwright 0.0.33 сам упавший браузер не перезапускает. Слоты пула
+        переходят к новым контекстам, а _maybe_launch_browser при создании первого
+        из них запустит новый процесс. Контексты мёртвого браузера закрываются
+        событием close — оно же освобождает их места в PLAYWRIGHT_MAX_CONTEXTS.
+        """
+        browser = getattr(self, "browser", None)
+        if browser is None or browser.is_connected() or browser is self.lost_browser:
+            return
+        self.lost_browser = browser
+        self.pool.browser_lost()
+        logger.warning("💥 Браузер Playwright отключился, будет запущен заново")
+
+    async def _maybe_launch_browser(self) -> None:
+        async with self.browser_launch_lock:
+            browser = getattr(self, "browser", None)
+            if browser is None or not browser.is_connected():
+                logger.info("🌐 Запуск браузера Playwright")
+                self.browser = await self.browser_type.launch(**self.launch_options)
+
+    def spider_closed(self, spider):
+        if self.downloads:  # обработчики http и https — отдельные экземпляры
+            logger.info(f"♻️ Переработано контекстов Playwright: {self.pool.recycled}, "
+                        f"перезапусков браузера: {self.pool.restarts}")
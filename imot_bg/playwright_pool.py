@@ -0,0 +1,126 @@
+import logging
+from collections import defaultdict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Признаки падения браузера/рендерера в сообщениях Playwright
+BROWSER_CRASH_MARKERS = (
+    "target closed",
+    "target page, context or browser has been closed",
+    "browser has been closed",
+    "browser has disconnected",
+    "page crashed",
+)
+
+
+def is_browser_crash(exception) -> bool:
+    """Ошибка вызвана падением браузера, контекста или страницы"""
+    message = str(exception).lower()
+    return any(marker in message for marker in BROWSER_CRASH_MARKERS)
+
+
+class PlaywrightContextPool:
+    """
+    Пул именованных контекстов Playwright.
+    Запросы распределяются по слотам по кругу; после recycle_after страниц слот
+    получает новое поколение контекста, а старый контекст закрывается, как только
+    на нём не останется открытых страниц. Так память браузера не копится за
+    долгий обход, а открытые страницы не обрываются.
+    У слота не больше одного списанного контекста: пока он не закрыт, слот не
+    переходит к следующему поколению. Поэтому живых контекстов не больше 2 × slots.
+    """
+
+    def __init__(self, slots: int = 2, recycle_after: int = 40):
+        self.slots = max(1, slots)
+        self.recycle_after = max(1, recycle_after)
+        self.generations = [0] * self.slots
+        self.assigned = [0] * self.slots
+        self.in_flight = defaultdict(int)
+        self.retired = set()
+        self.contexts = {}
+        self.recycled = 0
+        self.restarts = 0
+        # PooledPlaywrightDownloadHandler: по нему находятся контексты
+        self.handler = None
+        self._next_slot = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        slots = settings.getint("PLAYWRIGHT_CONTEXT_SLOTS", 2)
+        max_contexts = settings.getint("PLAYWRIGHT_MAX_CONTEXTS")
+        if max_contexts and max_contexts < 2 * slots:
+            # новый контекст слота ждёт семафор scrapy-playwright под context_launch_lock,
+            # а страницы списанного контекста — этот lock: без запаса обход встаёт намертво
+            raise ValueError("PLAYWRIGHT_MAX_CONTEXTS должен быть не меньше 2 × PLAYWRIGHT_CONTEXT_SLOTS")
+        return cls(
+            slots=slots,
+            recycle_after=settings.getint("PLAYWRIGHT_CONTEXT_RECYCLE_PAGES", 40),
+        )
+
+    def context_name(self, slot: int, generation: Optional[int] = None) -> str:
+        return f"imot-{slot}-{self.generations[slot] if generation is None else generation}"
+
+    def acquire(self) -> str:
+        """Имя контекста для очередного запроса"""
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self.slots
+        name = self.context_name(slot)
+        self.in_flight[name] += 1
+        self.assigned[slot] += 1
+        previous = self.context_name(slot, self.generations[slot] - 1)
+        if self.assigned[slot] >= self.recycle_after and previous not in self.retired:
+            # следующие запросы этого слота пойдут в новый контекст
+            self.retire(slot)
+        return name
+
+    def retire(self, slot: int) -> None:
+        name = self.context_name(slot)
+        if self.in_flight[name]:
+            self.retired.add(name)
+        else:
+            self.in_flight.pop(name, None)
+        self.generations[slot] += 1
+        self.assigned[slot] = 0
+
+    async def release(self, page, context_name: str) -> None:
+        """Гарантированное закрытие страницы и, при необходимости, списанного контекста"""
+        try:
+            if page is not None:
+                self.contexts[context_name] = page.context
+                if not page.is_closed():
+                    await page.close()
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось закрыть страницу Playwright: {e}")
+        finally:
+            if context_name:
+                self.in_flight[context_name] = max(0, self.in_flight[context_name] - 1)
+                if context_name in self.retired and self.in_flight[context_name] == 0:
+                    await self.close_context(context_name)
+
+    def find_context(self, context_name: str):
+        """Контекст по имени: из закрытых страниц или из обработчика scrapy-playwright"""
+        context = self.contexts.pop(context_name, None)
+        wrapper = getattr(self.handler, "context_wrappers", {}).get(context_name)
+        return wrapper.context if wrapper is not None else context
+
+    async def close_context(self, context_name: str) -> None:
+        self.retired.discard(context_name)
+        self.in_flight.pop(context_name, None)
+        context = self.find_context(context_name)
+        if context is None:
+            # контекст так и не был создан или погиб вместе с браузером
+            return
+        try:
+            await context.close()
+            self.recycled += 1
+            logger.info(f"♻️ Контекст Playwright {context_name} переработан")
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось закрыть контекст {context_name}: {e}")
+
+    def browser_lost(self) -> None:
+        """Браузер упал: все слоты переходят к новым контекстам (их создаст уже новый браузер)"""
+        for slot in range(self.slots):
+            self.retire(slot)
+        self.contexts.clear()
+        self.restarts += 1
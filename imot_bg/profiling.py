@@ -0,0 +1,79 @@
+import cProfile
+import datetime
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Пиковый RSS процесса в МБ (None, если платформа не поддерживает resource)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КБ, macOS — байты
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def profiling_enabled(env_var: str = "BOT_PROFILE") -> bool:
+    return os.getenv(env_var, "").lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def profiled(label: str, output_dir: str = "exports", enabled: bool = True, top: int = 30):
+    """
+    Профилирование блока: cProfile (в текущем потоке) и tracemalloc (весь процесс).
+    Пишет рядом с выгрузками <label>_<время>.pstats, _pstats.txt, _alloc.txt и _summary.json.
+    """
+    if not enabled:
+        yield None
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    safe_label = re.sub(r"[^\w\-_.]", "_", label.strip().lower())
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    base = os.path.join(output_dir, f"profile_{safe_label}_{timestamp}")
+
+    tracemalloc.start(25)
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield base
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        snapshot = tracemalloc.take_snapshot()
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profiler.dump_stats(f"{base}.pstats")
+        with open(f"{base}_pstats.txt", "w", encoding="utf-8") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(top)
+
+        stream = io.StringIO()
+        for stat in snapshot.statistics("lineno")[:top]:
+            stream.write(f"{stat}\n")
+        with open(f"{base}_alloc.txt", "w", encoding="utf-8") as f:
+            f.write(stream.getvalue())
+
+        summary = {
+            "label": label,
+            "elapsed_seconds": round(elapsed, 3),
+            "traced_peak_mb": round(traced_peak / (1024 * 1024), 1),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        with open(f"{base}_summary.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        logger.info(f"🧪 Профиль сохранён: {base}.* | {summary}")
@@ -1,3 +1,4 @@
+import os
 import sys
 import logging
 from shutil import which
@@ -20,16 +21,33 @@ PLAYWRIGHT_LAUNCH_OPTIONS = {
         "--no-sandbox",
         "--disable-setuid-sandbox",
         "--disable-dev-shm-usage",  # Важно для Docker/серверов
-        "--single-process"  # Для стабильности
+        # без --single-process: падение рендерера не роняет весь браузер
     ]
 }
+PLAYWRIGHT_CONTEXT_SLOTS = 2  # Слоты пула контекстов (PooledPlaywrightDownloadHandler)
+# Предел контекстов scrapy-playwright: не меньше 2 × слотов — у каждого слота может
+# дорабатывать списанный контекст, пока уже открыт новый
+PLAYWRIGHT_MAX_CONTEXTS = 2 * PLAYWRIGHT_CONTEXT_SLOTS
 PLAYWRIGHT_MAX_PAGES_PER_CONTEXT = 4  # Оптимально для 8 CONCURRENT_REQUESTS
+PLAYWRIGHT_CONTEXT_RECYCLE_PAGES = 40  # Пересоздавать контекст после N страниц
 PLAYWRIGHT_DEFAULT_NAVIGATION_TIMEOUT = 60000
 
+
+def should_abort_request(request):
+    """Не грузим в браузер картинки, шрифты и медиа — для выдачи нужен только HTML"""
+    return request.resource_type in {"image", "media", "font"}
+
+
+PLAYWRIGHT_ABORT_REQUEST = should_abort_request
+
+# Адрес сайта (подменяется на локальный стенд в benchmarks/)
+IMOT_BASE_URL = "https://www.imot.bg"
+IMOT_SEARCH_PLAYWRIGHT = True  # Страницы выдачи через браузер; False — обычный HTTP
+
 # Обработчики загрузки
 DOWNLOAD_HANDLERS = {
-    "http": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
-    "https": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
+    "http": "imot_bg.playwright_handler.PooledPlaywrightDownloadHandler",
+    "https": "imot_bg.playwright_handler.PooledPlaywrightDownloadHandler",
 }
 
 # Основные настройки
@@ -49,26 +67,92 @@ AUTOTHROTTLE_TARGET_CONCURRENCY = 1.5  # Более консервативно
 # Middlewares
 DOWNLOADER_MIDDLEWARES = {
     'scrapy.downloadermiddlewares.httpauth.HttpAuthMiddleware': None,
+    'imot_bg.middlewares.DeadLetterMiddleware': 80,  # раньше RetryMiddleware: видит только итог повторов
     'scrapy.downloadermiddlewares.retry.RetryMiddleware': 90,
     'scrapy.downloadermiddlewares.redirect.RedirectMiddleware': 100,
     # 'scrapy_playwright.middleware.PlaywrightMiddleware': 800,  # <- УДАЛИТЬ ЭТУ СТРОКУ
     'scrapy.downloadermiddlewares.useragent.UserAgentMiddleware': None,
     'scrapy.downloadermiddlewares.httpproxy.HttpProxyMiddleware': 110,
+    'imot_bg.middlewares.PlaywrightCrashRetryMiddleware': 950,
     # 'scrapy_playwright.middleware.ScrapyPlaywrightDownloadHandler': 543, # <- И ЭТУ ТОЖЕ УДАЛИТЬ
 }
 
+# FIFO-очереди планировщика: страницы разных районов в одном задании чередуются,
+# а не обходятся в глубину по одному району (порядок между целями — через priority)
+SCHEDULER_MEMORY_QUEUE = "scrapy.squeues.FifoMemoryQueue"
+SCHEDULER_DISK_QUEUE = "scrapy.squeues.PickleFifoDiskQueue"
+
 # Retry policy
 RETRY_TIMES = 5  # Увеличено для playwright
-RETRY_HTTP_CODES = [500, 502, 503, 504, 408, 429, 403, 404]
+# 404/410 не повторяются: объявление снято (DeadLetterMiddleware отправляет его в архив)
+RETRY_HTTP_CODES = [500, 502, 503, 504, 408, 429, 403]
 RETRY_PRIORITY_ADJUST = -1  # Для более быстрых повторных попыток
 
 # Pipelines
 ITEM_PIPELINES = {
+    'imot_bg.pipelines.ListingImagesPipeline': 200,
     'imot_bg.pipelines.PostgresPipeline': 300,
 }
+PIPELINE_COMMIT_BATCH = 50  # Коммит в БД каждые N объявлений
+# Фото объявлений (imot_bg.pipelines.ListingImagesPipeline, до записи в БД)
+FILES_STORE = "images"  # Файлы называются по sha256 содержимого: full/ab/cd/<sha256>.jpg
+IMAGES_INDEX_PATH = "images/index.sqlite"  # Индекс URL → файл: уже сохранённые URL не скачиваются
+IMAGES_MAX_PER_LISTING = 10
+IMAGES_THUMBNAIL_SIZE = [320, 240]  # Миниатюры thumbs/...; только при установленном Pillow
+IMAGES_DOWNLOAD_SLOT = "images"
+DOWNLOAD_SLOTS = {
+    # фото качаются в своём слоте: не больше 4 параллельно и без задержки страниц выдачи
+    "images": {"concurrency": 4, "delay": 0},
+}
+# Уведомления по сохранённым поискам (imot_bg.alerts): совпадения пишутся в alert_outbox, рассылает бот
+ALERTS_ENABLED = True
+ALERTS_RELOAD_SECONDS = 60  # Как часто перечитывать сохранённые поиски во время обхода
+# Почти-дубликаты от разных агентств (imot_bg.dedup): MinHash описания + LSH внутри блока
+# район/комнаты/площадь/этаж; совпавшие объявления получают общий cluster_id
+DEDUP_ENABLED = True
+DEDUP_THRESHOLD = 0.8  # Минимальная оценка сходства Жаккара
+DEDUP_NUM_PERM = 64  # Длина подписи
+DEDUP_BANDS = 16  # Полос LSH (по DEDUP_NUM_PERM / DEDUP_BANDS значений)
+DEDUP_AREA_BUCKET = 5  # Ширина корзины площади в м² для ключа блокировки
+# Хранилище (imot_bg.storage): партиции по городу, активные/архив; история цен — по месяцам
+ARCHIVE_AFTER_MISSED_CRAWLS = 3  # Сколько успешных обходов района подряд объявление может не встречаться
+
+# Метрики (imot_bg.extensions.MetricsExtension)
+EXTENSIONS = {
+    'imot_bg.extensions.MetricsExtension': 500,
+    'imot_bg.extensions.ProgressExtension': 510,
+}
+METRICS_PORT = 9410  # /metrics в формате Prometheus, 0 — отключить эндпоинт
+METRICS_SUMMARY_DIR = "metrics"  # JSON-сводка по завершении обхода
+# Журнал неудачных запросов (imot_bg.middlewares.DeadLetterMiddleware): JSON Lines с ротацией,
+# сводка обхода — строка kind=summary в том же журнале
+DEADLETTER_PATH = "deadletter/deadletter.jsonl"
+DEADLETTER_MAX_BYTES = 5 * 1024 * 1024
+DEADLETTER_BACKUPS = 3
+DEADLETTER_SAMPLE_BYTES = 2048  # Сколько байт тела ответа сохранять (сжатыми)
+# Прогресс для бота (imot_bg.extensions.ProgressExtension): JSON-строки в открытый дескриптор
+PROGRESS_FD = int(os.getenv("IMOT_PROGRESS_FD", "0"))  # 0 — не отправлять
+PROGRESS_ADDR = os.getenv("IMOT_PROGRESS_ADDR")  # host:port бота — вместо дескриптора (Windows)
+PROGRESS_INTERVAL = 2.0  # Секунд между снимками прогресса
+
+# Чекпойнты заданий (возобновление по job id)
+JOBS_DIR = "jobs"
+# Каталог районов (паук imot_districts): кэш в JSON, обновляется раз в DISTRICT_CATALOG_TTL секунд
+DISTRICT_CATALOG_PATH = "cache/districts.json"
+DISTRICT_CATALOG_TTL = 7 * 24 * 3600
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 # Логирование
 LOG_LEVEL = 'INFO'
+# run_spider_async.py пишет лог через очередь в фоновом потоке (imot_bg.logging_utils)
+SPIDER_LOG_FILE = "spider.log"  # Ротируемый файл, пусто — без файла
+LOG_JSON = os.getenv("LOG_JSON", "").lower() in ("1", "true", "yes")  # Структурированный JSON
+LOG_CONSOLE_LEVEL = os.getenv("SPIDER_LOG_CONSOLE_LEVEL", "INFO")  # Бот ставит WARNING
+# Не больше N записей в секунду на тип события горячего пути (WARNING+ не ограничиваются)
+LOG_EVENT_RATES = {
+    "response": 2,
+    "listing": 2,
+    "upsert": 2,
+}
 logging.getLogger('scrapy').setLevel(logging.WARNING)
 logging.getLogger('scrapy-playwright').setLevel(logging.INFO)
 logging.getLogger('twisted').setLevel(logging.ERROR)
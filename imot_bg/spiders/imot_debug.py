@@ -1,10 +1,17 @@
 import scrapy
+import difflib
 import re
 import logging
+from urllib.parse import urlparse
 from imot_bg.items import ImotItem
+from imot_bg.checkpoint import CrawlCheckpoint
+from imot_bg.targets import CrawlTarget, city_slug, parse_targets
+from imot_bg.districts import DistrictCatalog, slugify_district
+from imot_bg.deadletter import PERMANENT_STATUSES
+from imot_bg.metrics import timed_callback
 from datetime import datetime
+from scrapy.spidermiddlewares.httperror import HttpError
 from scrapy_playwright.page import PageMethod
-import asyncio
 
 logger = logging.getLogger(__name__)
 
@@ -27,51 +34,152 @@ class ImotBgSpider(scrapy.Spider):
         "Referer": "https://www.imot.bg/"
     }
 
-    def __init__(self, city='София', district='', *args, **kwargs):
+    def __init__(self, city='София', district='', job_id=None, targets=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.city = city
         self.district = district.strip().lower()
-        if not self.district:
-            raise ValueError("❌ Обязательный аргумент 'district' не указан")
-        logger.info(f"🛠️ Паук инициализирован для города: {self.city}, район: {self.district}")
+        # Несколько целей (город/район/приоритет) обходятся в одном процессе
+        if targets:
+            self.targets = parse_targets(targets)
+        elif self.district:
+            self.targets = [CrawlTarget(self.city, self.district)]
+        else:
+            raise ValueError("❌ Обязательный аргумент 'district' (или 'targets') не указан")
+        self.job_id = job_id
+        self.checkpoint = None
+        # (город, район) целей: дошедшие до последней страницы выдачи и с неудачными запросами
+        self.last_pages = set()
+        self.failed_targets = set()
+        self.completed = None
+        self.base_url = 'https://www.imot.bg'
+        self.search_playwright = True
+        logger.info(f"🛠️ Паук инициализирован для целей: "
+                    f"{', '.join(f'{t.city}/{t.district}' for t in self.targets)}")
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.base_url = crawler.settings.get('IMOT_BASE_URL', spider.base_url).rstrip('/')
+        spider.search_playwright = crawler.settings.getbool('IMOT_SEARCH_PLAYWRIGHT', True)
+        host = urlparse(spider.base_url).hostname
+        if host and host not in spider.allowed_domains:
+            # подмена сайта (например, локальный стенд для нагрузочных тестов)
+            spider.allowed_domains = spider.allowed_domains + [host]
+        catalog = DistrictCatalog.load(crawler.settings.get('DISTRICT_CATALOG_PATH', 'cache/districts.json'))
+        spider.targets = spider.resolve_targets(catalog)
+        if spider.job_id:
+            jobs_dir = crawler.settings.get('JOBS_DIR', 'jobs')
+            spider.checkpoint = CrawlCheckpoint.for_job(spider.job_id, jobs_dir)
+            logger.info(f"💾 Чекпойнт задания {spider.job_id}: {spider.checkpoint.path}")
+        return spider
+
+    def resolve_targets(self, catalog):
+        """
+        Слаги целей по каталогу районов ('Младост 3' → 'mladost-3'); районы, которых
+        нет в каталоге города, пропускаются. Без явного приоритета крупные районы идут первыми.
+        """
+        targets = []
+        for target in self.targets:
+            slug = catalog.resolve(target.city, target.district)
+            if not slug:
+                known = [d['slug'] for d in catalog.districts(target.city)]
+                matches = difflib.get_close_matches(slugify_district(target.district), known, n=4, cutoff=0.6)
+                hint = f" Похожие: {', '.join(matches)}" if matches else ""
+                logger.error(f"❌ Район '{target.district}' не найден в каталоге {target.city} "
+                             f"({len(known)} районов), пропускаю.{hint}")
+                continue
+            priority = target.priority or catalog.crawl_priority(target.city, slug)
+            targets.append(target._replace(district=slug, priority=priority))
+        return targets
 
     def start_requests(self):
-        url = f'https://www.imot.bg/obiavi/prodazhbi/grad-sofiya/{self.district}'
-        logger.info(f"🚀 Начинаю парсинг с URL: {url}")
+        if self.checkpoint and self.checkpoint.get_meta('status') == 'finished':
+            logger.info(f"✅ Задание {self.job_id} уже завершено: {self.checkpoint.progress()}")
+            return
+
+        pending = self.checkpoint.pending() if self.checkpoint else []
+        if pending:
+            logger.info(f"♻️ Возобновляю задание {self.job_id}: {len(pending)} незавершённых запросов")
+            for entry in pending:
+                meta = entry['meta']
+                target = self.target_from_meta(meta)
+                if entry['kind'] == 'search':
+                    yield self.search_request(entry['url'], meta.get('page', 1), target)
+                elif not self.checkpoint.is_stored(entry['source_id']):
+                    yield self.listing_request(entry['url'], meta.get('page', 1), target)
+            return
+
+        if self.checkpoint:
+            self.checkpoint.set_meta('targets', [t._asdict() for t in self.targets])
+
+        # Первые страницы всех целей ставятся в очередь сразу: при FIFO-планировщике
+        # страницы разных районов чередуются, а приоритет цели задаёт порядок между ними
+        for target in sorted(self.targets, key=lambda t: -t.priority):
+            url = f'{self.base_url}/obiavi/prodazhbi/{city_slug(target.city)}/{target.district}'
+            logger.info(f"🚀 Начинаю парсинг с URL: {url}")
+            yield self.search_request(url, 1, target)
 
-        yield scrapy.Request(
+    def search_request(self, url, page, target):
+        """Запрос страницы выдачи через Playwright (с записью во фронтир чекпойнта)"""
+        meta = {'page': page, **target._asdict()}
+        if self.checkpoint:
+            self.checkpoint.record_request(url, 'search', meta)
+        playwright_meta = {
+            'playwright': True,
+            # контекст выдаёт PooledPlaywrightDownloadHandler, страницу закрывает scrapy-playwright
+            'playwright_page_methods': [
+                PageMethod("wait_for_selector", "div.item", timeout=60000)
+            ],
+        } if self.search_playwright else {}
+        return scrapy.Request(
             url=url,
             callback=self.parse_search_results,
             meta={
-                'playwright': True,
-                'playwright_include_page': True,
-                'playwright_page_methods': [
-                    PageMethod("wait_for_selector", "div.item", timeout=60000)
-                ],
-                'page': 1,
-                'district': self.district
+                **playwright_meta,
+                **meta,
+                'checkpoint_url': url,
             },
+            priority=target.priority,
+            headers=self.headers,
+            errback=self.parse_error,
+        )
+
+    def listing_request(self, url, page, target):
+        """Запрос страницы объявления (с записью во фронтир чекпойнта)"""
+        meta = {'page': page, **target._asdict()}
+        if self.checkpoint:
+            self.checkpoint.record_request(url, 'listing', meta, source_id=self.extract_id_from_url(url))
+        return scrapy.Request(
+            url=url,
+            callback=self.parse_listing,
+            meta={**meta, 'checkpoint_url': url},
+            # объявления уже найденных страниц забираем раньше следующих страниц выдачи
+            priority=target.priority + 1,
             headers=self.headers,
             errback=self.parse_error
         )
 
+    def target_from_meta(self, meta):
+        """Восстановление цели из meta запроса"""
+        return CrawlTarget(meta.get('city') or self.city, meta.get('district', 'unknown'), meta.get('priority', 0))
+
+    @timed_callback
     def parse_search_results(self, response):
         current_page = response.meta.get('page', 1)
-        district = response.meta.get('district', 'unknown')
-
-        logger.info(f"📄 Парсинг страницы {current_page} | URL: {response.url}")
+        target = self.target_from_meta(response.meta)
 
-        page = response.meta.get("playwright_page")
-        if page:
-            asyncio.create_task(page.close())
+        logger.info("📄 Парсинг страницы %s | URL: %s", current_page, response.url, extra={'event': 'search_page'})
 
         if "captcha" in response.text.lower():
             logger.error("Обнаружена капча! Пропускаю страницу")
+            self.failed_targets.add(self.target_key(target))
             return
 
         listings = response.css('div.item')
         if not listings:
             logger.warning(f"⚠️ На странице {current_page} нет объявлений")
+            self.reached_last_page(target)
+            self.mark_request_done(response)
             return
 
         for item in listings:
@@ -83,75 +191,129 @@ class ImotBgSpider(scrapy.Spider):
                     logger.warning("⚠️ Пропущено объявление без URL")
                     continue
 
+                # уже сохранено в рамках этого задания — повторно не запрашиваем
+                if self.checkpoint and self.checkpoint.is_stored(self.extract_id_from_url(full_url)):
+                    continue
+
                 # сразу идём в parse_listing
-                yield response.follow(
-                    full_url,
-                    callback=self.parse_listing,
-                    meta={'district': district, 'page': current_page},
-                    headers=self.headers,
-                    errback=self.parse_error
-                )
+                yield self.listing_request(full_url, current_page, target)
             except Exception as e:
                 logger.error(f"❌ Ошибка парсинга ссылки на объявление: {str(e)}")
 
         # пагинация
         next_page = response.css('a.next::attr(href)').get()
         if next_page:
-            yield response.follow(
-                next_page,
-                callback=self.parse_search_results,
-                meta={
-                    'playwright': True,
-                    'playwright_include_page': True,
-                    'playwright_page_methods': [
-                        PageMethod("wait_for_selector", "div.item", timeout=60000)
-                    ],
-                    'page': current_page + 1,
-                    'district': district
-                },
-                headers=self.headers,
-                errback=self.parse_error
-            )
+            yield self.search_request(response.urljoin(next_page), current_page + 1, target)
+        else:
+            self.reached_last_page(target)
+
+        self.mark_request_done(response)
+
+    @staticmethod
+    def target_key(target):
+        return city_slug(target.city), target.district
+
+    def reached_last_page(self, target):
+        """Выдача цели пройдена до конца (сохраняется в чекпойнте — для возобновлённых заданий)"""
+        self.last_pages.add(self.target_key(target))
+        if self.checkpoint:
+            stored = {tuple(key) for key in self.checkpoint.get_meta('last_pages', [])}
+            self.checkpoint.set_meta('last_pages', sorted(stored | self.last_pages))
+
+    def completed_targets(self):
+        """
+        Цели, обойденные полностью: выдача пройдена до последней страницы, нет неудачных
+        запросов (капча, ошибки загрузки) и незавершённых записей во фронтире чекпойнта.
+        Только таким районам PostgresPipeline засчитывает пропуск обхода невстреченным объявлениям.
+        """
+        if self.completed is not None:
+            return self.completed
+        last_pages = set(self.last_pages)
+        pending = set()
+        if self.checkpoint:
+            last_pages |= {tuple(key) for key in self.checkpoint.get_meta('last_pages', [])}
+            pending = {
+                self.target_key(self.target_from_meta(entry['meta']))
+                for entry in self.checkpoint.pending()
+                # объявление без id в пайплайн не попадает и выполненным не отмечается
+                if entry['kind'] == 'search' or entry['source_id']
+            }
+        targets = {self.target_key(target) for target in self.targets}
+        return (targets & last_pages) - pending - self.failed_targets
 
+    def mark_request_done(self, response):
+        """Отметка страницы выдачи как обработанной в чекпойнте"""
+        if self.checkpoint and response.meta.get('checkpoint_url'):
+            self.checkpoint.mark_done(response.meta['checkpoint_url'])
+
+    @timed_callback
     def parse_listing(self, response):
-        logger.info(f"🏠 Обрабатываю страницу объявления: {response.url}")
+        logger.info("🏠 Обрабатываю страницу объявления: %s", response.url, extra={'event': 'listing'})
 
-        item = ImotItem()
         description = self.extract_description(response)
 
         rooms_text = response.xpath("//div[contains(text(), 'Тип имот')]/strong/text()").get() or ''
         item_rooms = self.determine_room_count(rooms_text)
 
-        item.update({
-            'source': 'imot.bg',
-            'source_id': self.extract_id_from_url(response.url),
-            'title': self.clean(response.css("div.advHeader div.title::text").get()),
-            'currency': 'EUR',
-            'price': self.clean_price(response.xpath("//div[@id='cena']/text()").get()),
-            'price_sqm': self.clean_price(response.xpath("//span[@id='cenakv']/text()").get()),
-            'area': self.clean_area(response.xpath("//div[contains(text(), 'Площ')]/strong/text()").get()),
-            'rooms': item_rooms,
-            'floor': self.clean(response.xpath("//div[contains(text(), 'Етаж')]/strong/text()").get()),
-            'construction_type': self.clean(
+        item = ImotItem(
+            source='imot.bg',
+            source_id=self.extract_id_from_url(response.url),
+            title=self.clean(response.css("div.advHeader div.title::text").get()),
+            currency='EUR',
+            price=self.clean_price(response.xpath("//div[@id='cena']/text()").get()),
+            price_sqm=self.clean_price(response.xpath("//span[@id='cenakv']/text()").get()),
+            area=self.clean_area(response.xpath("//div[contains(text(), 'Площ')]/strong/text()").get()),
+            rooms=item_rooms,
+            floor=self.clean(response.xpath("//div[contains(text(), 'Етаж')]/strong/text()").get()),
+            construction_type=self.clean(
                 response.xpath("//div[contains(text(), 'Строителство')]/strong[1]/text()").get()),
-            'year_built': self.extract_year(
+            year_built=self.extract_year(
                 response.xpath("//div[contains(text(), 'Строителство')]/strong[2]/text()").get()),
-            'description': description,
-            'location': self.clean(response.css("div.location::text").get()),
-            'district': response.meta.get('district'),
-            'city': self.city,
-            'agency': self.clean(response.css("div.name::text").get()),
-            'phone': self.clean(response.css("div.phone::text").get()),
-            'page_found': response.meta.get('page', 1),
-            'url': response.url,
-        })
-
-        logger.info(f"✅ Сохранён item: {item.get('title')} — {item.get('price')} EUR")
+            description=description,
+            location=self.clean(response.css("div.location::text").get()),
+            district=response.meta.get('district'),
+            city=response.meta.get('city') or self.city,
+            agency=self.clean(response.css("div.name::text").get()),
+            phone=self.clean(response.css("div.phone::text").get()),
+            page_found=response.meta.get('page', 1),
+            url=response.url,
+            images=self.extract_images(response),
+            scraped_at=datetime.now(),
+        )
+
+        logger.info("✅ Сохранён item: %s — %s EUR", item.title, item.price,
+                    extra={'event': 'listing', 'source_id': item.source_id})
         yield item
 
     def parse_error(self, failure):
+        request = failure.request
+        if failure.check(HttpError) and failure.value.response.status in PERMANENT_STATUSES:
+            # объявление снято: повторять нечего, при возобновлении задания не запрашиваем снова
+            response = failure.value.response
+            logger.warning(f"🪦 {response.status}: {response.url}")
+            self.mark_request_done(response)
+            if request.callback == self.parse_listing:
+                return
+        # район обойдён не полностью — его объявлениям пропуск обхода не засчитывается
+        self.failed_targets.add(self.target_key(self.target_from_meta(request.meta)))
         logger.error(f"🔥 Ошибка при обработке запроса: {failure.value}")
 
+    def closed(self, reason):
+        # до закрытия чекпойнта: PostgresPipeline может спросить после этого метода
+        self.completed = self.completed_targets()
+        if self.checkpoint:
+            # 'finished' от Scrapy не значит, что фронтир пуст: страницы с капчей не отмечаются
+            # выполненными, и такое задание должно возобновляться, а не считаться завершённым
+            status = reason
+            if reason == 'finished' and self.checkpoint.pending():
+                status = 'incomplete'
+            self.checkpoint.set_meta('status', status)
+            if status == 'incomplete':
+                logger.warning(f"⚠️ Задание {self.job_id} закрыто с незавершёнными запросами, "
+                               f"его можно возобновить")
+            logger.info(f"💾 Чекпойнт задания {self.job_id}: {self.checkpoint.progress()}")
+            self.checkpoint.close()
+
     @staticmethod
     def extract_description(response):
         description_html = response.xpath("//div[@id='description_div']").get()
@@ -160,6 +322,21 @@ class ImotBgSpider(scrapy.Spider):
             return re.sub(r'<[^>]+>', '', text).strip()
         return None
 
+    @staticmethod
+    def extract_images(response):
+        """URL фото галереи в порядке показа, без повторов (миниатюры и большие версии — один URL)"""
+        urls = response.css(
+            "img.carouselimg::attr(data-src), img.carouselimg::attr(src), "
+            "div#pictures_moving img::attr(data-src), div#pictures_moving img::attr(src)"
+        ).getall()
+        images = []
+        for url in urls:
+            if url and not url.startswith("data:"):
+                url = response.urljoin(url.strip())
+                if url not in images:
+                    images.append(url)
+        return images
+
     @staticmethod
     def determine_room_count(text):
         room_map = {
@@ -0,0 +1,79 @@
+import re
+import logging
+from urllib.parse import urlparse
+
+import scrapy
+
+from imot_bg.districts import DistrictCatalog
+from imot_bg.targets import city_slug
+
+logger = logging.getLogger(__name__)
+
+COUNT_RE = re.compile(r"\(?\s*(\d[\d\s]*)\s*\)?\s*$")
+
+
+class ImotDistrictsSpider(scrapy.Spider):
+    """
+    Сбор каталога районов: страница локаций города на imot.bg → слаги районов,
+    названия и число объявлений. Результат пишется в DISTRICT_CATALOG_PATH.
+    """
+    name = 'imot_districts'
+    allowed_domains = ['imot.bg', 'www.imot.bg']
+
+    custom_settings = {
+        'ITEM_PIPELINES': {},
+        'CONCURRENT_REQUESTS': 1,
+    }
+
+    def __init__(self, city='sofia', *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.city = city.strip().lower()
+        self.base_url = 'https://www.imot.bg'
+        self.search_playwright = True
+        self.catalog = None
+        self.districts = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.base_url = crawler.settings.get('IMOT_BASE_URL', spider.base_url).rstrip('/')
+        spider.search_playwright = crawler.settings.getbool('IMOT_SEARCH_PLAYWRIGHT', True)
+        host = urlparse(spider.base_url).hostname
+        if host and host not in spider.allowed_domains:
+            spider.allowed_domains = spider.allowed_domains + [host]
+        spider.catalog = DistrictCatalog.load(crawler.settings.get('DISTRICT_CATALOG_PATH', 'cache/districts.json'))
+        return spider
+
+    def start_requests(self):
+        url = f'{self.base_url}/obiavi/prodazhbi/{city_slug(self.city)}'
+        logger.info(f"🗺 Загружаю каталог районов: {url}")
+        yield scrapy.Request(url, callback=self.parse_locations,
+                             meta={'playwright': True} if self.search_playwright else {})
+
+    def parse_locations(self, response):
+        """Ссылки вида /obiavi/prodazhbi/<город>/<район> с названием и числом объявлений"""
+        link_re = re.compile(rf"/obiavi/prodazhbi/{re.escape(city_slug(self.city))}/([a-z0-9-]+)/?$")
+        for link in response.css('a[href]'):
+            match = link_re.search(urlparse(response.urljoin(link.attrib['href'])).path)
+            if not match or re.fullmatch(r"p-\d+", match.group(1)):
+                continue
+            text = " ".join(t.strip() for t in link.css('::text').getall() if t.strip())
+            count_match = COUNT_RE.search(text)
+            name = COUNT_RE.sub("", text).strip() if count_match else text
+            if not count_match:
+                # число объявлений иногда стоит рядом со ссылкой, а не внутри неё
+                sibling = " ".join(link.xpath('following-sibling::*[1]//text()').getall()).strip()
+                count_match = COUNT_RE.search(sibling)
+            slug = match.group(1)
+            self.districts[slug] = {
+                'name': name or slug,
+                'count': int(re.sub(r"\s", "", count_match.group(1))) if count_match else None,
+            }
+
+    def closed(self, reason):
+        if not self.districts:
+            logger.warning(f"⚠️ Каталог районов {self.city} пуст, кэш не обновлён ({reason})")
+            return
+        self.catalog.update_city(self.city, self.districts)
+        self.catalog.save()
+        logger.info(f"🗺 Каталог районов {self.city}: {len(self.districts)} районов → {self.catalog.path}")
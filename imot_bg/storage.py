@@ -0,0 +1,231 @@
+import datetime
+import logging
+import re
+import zlib
+from typing import Iterable, Optional
+
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from imot_bg.targets import city_slug
+
+logger = logging.getLogger(__name__)
+
+TABLE = "sofia_apartments"
+HISTORY_TABLE = "listing_history"
+
+# Горячие данные: LIST по городу (city_key), внутри — LIST по archived:
+# активные объявления и холодный архив снятых с сайта.
+# Уникальный ключ обязан включать ключи партиционирования — upsert идёт по (city_key, archived, source_id).
+CREATE_LISTINGS = f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    id SERIAL,
+    source_id TEXT,
+    title TEXT,
+    price NUMERIC,
+    currency TEXT,
+    price_sqm NUMERIC,
+    area NUMERIC,
+    rooms INTEGER,
+    floor TEXT,
+    construction_type TEXT,
+    year_built INTEGER,
+    description TEXT,
+    location TEXT,
+    district TEXT,
+    city TEXT,
+    city_key TEXT NOT NULL,
+    agency TEXT,
+    phone TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    scraped_at TIMESTAMP,
+    first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    change_txid BIGINT DEFAULT txid_current(),
+    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    missed_crawls INTEGER NOT NULL DEFAULT 0,
+    archived BOOLEAN NOT NULL DEFAULT FALSE,
+    previous_price NUMERIC,
+    cluster_id TEXT,
+    url TEXT,
+    images TEXT[]
+) PARTITION BY LIST (city_key);
+CREATE UNIQUE INDEX IF NOT EXISTS {TABLE}_key ON {TABLE} (city_key, archived, source_id);
+CREATE INDEX IF NOT EXISTS {TABLE}_source_idx ON {TABLE} (source_id);
+CREATE INDEX IF NOT EXISTS {TABLE}_delta_idx ON {TABLE} (LOWER(district), updated_at);
+CREATE INDEX IF NOT EXISTS {TABLE}_cluster_idx ON {TABLE} (cluster_id);
+CREATE INDEX IF NOT EXISTS {TABLE}_seen_idx ON {TABLE} (district, last_seen);
+"""
+
+# Транзакция последнего изменения (вставка/новая цена) — для дельта-отчётов по снимку транзакций
+CREATE_CHANGE_INDEX = f"CREATE INDEX IF NOT EXISTS {TABLE}_change_idx ON {TABLE} (LOWER(district), change_txid)"
+
+# История цен: RANGE по месяцу сбора, строка на каждое новое/переоценённое объявление
+CREATE_HISTORY = f"""
+CREATE TABLE IF NOT EXISTS {HISTORY_TABLE} (
+    source_id TEXT NOT NULL,
+    city_key TEXT NOT NULL,
+    price NUMERIC,
+    price_sqm NUMERIC,
+    change TEXT NOT NULL,
+    scraped_at TIMESTAMP NOT NULL
+) PARTITION BY RANGE (scraped_at);
+CREATE INDEX IF NOT EXISTS {HISTORY_TABLE}_source_idx ON {HISTORY_TABLE} (source_id, scraped_at);
+"""
+
+LEGACY_COLUMNS = (
+    'source_id', 'title', 'price', 'currency', 'price_sqm', 'area', 'rooms', 'floor', 'construction_type',
+    'year_built', 'description', 'location', 'district', 'city', 'agency', 'phone', 'created_at',
+    'scraped_at', 'first_seen', 'updated_at', 'previous_price', 'cluster_id', 'url',
+)
+
+
+def city_key(city: Optional[str]) -> str:
+    """Ключ партиции города: 'София', 'sofia' → 'grad-sofiya'"""
+    return city_slug(city) if city and city.strip() else "unknown"
+
+
+def partition_name(key: str) -> str:
+    """Имя партиции города; ключ не латиницей (неизвестный город) — с crc32, чтобы имена не совпали"""
+    name = re.sub(r"[^a-z0-9]+", "_", key.lower()).strip("_")
+    if not key.isascii():
+        name = f"{name}_{zlib.crc32(key.encode('utf-8')):08x}"
+    return f"{TABLE}_{name}"
+
+
+def table_kind(cur, name: str) -> Optional[str]:
+    cur.execute("SELECT c.relkind FROM pg_class c WHERE c.oid = to_regclass(%s)", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+class ListingStorage:
+    """
+    Схема хранения объявлений: партиции по городу (активные + архив), помесячная
+    история цен, перенос в архив объявлений, не встреченных N обходов подряд.
+    Партиции создаются по мере появления новых городов и месяцев.
+    """
+
+    def __init__(self, archive_after: int = 3):
+        self.archive_after = archive_after
+        self.cities = set()
+        self.months = set()
+
+    def create_schema(self, cur) -> None:
+        legacy = table_kind(cur, TABLE) == 'r'
+        if legacy:
+            self.detach_legacy(cur)
+        cur.execute(CREATE_LISTINGS)
+        cur.execute(f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS images TEXT[]")
+        # без DEFAULT в ADD COLUMN: иначе все старые строки получат txid миграции и попадут в дельту
+        cur.execute(f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS change_txid BIGINT")
+        cur.execute(f"ALTER TABLE {TABLE} ALTER COLUMN change_txid SET DEFAULT txid_current()")
+        cur.execute(CREATE_CHANGE_INDEX)
+        cur.execute(CREATE_HISTORY)
+        if legacy:
+            self.migrate_legacy(cur)
+
+    def detach_legacy(self, cur) -> None:
+        """
+        Таблица до партиционирования переименовывается вместе с индексами (имена индексов
+        общие на схему) и дополняется колонками, которых не было в старых версиях.
+        """
+        cur.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s", (TABLE,))
+        for (index,) in cur.fetchall():
+            cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                sql.Identifier(index), sql.Identifier(f"{index}_unpartitioned")))
+        cur.execute(f"ALTER TABLE {TABLE} RENAME TO {TABLE}_unpartitioned")
+        cur.execute(f"""
+        ALTER TABLE {TABLE}_unpartitioned
+            ADD COLUMN IF NOT EXISTS source_id TEXT,
+            ADD COLUMN IF NOT EXISTS rooms INTEGER,
+            ADD COLUMN IF NOT EXISTS scraped_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS previous_price NUMERIC,
+            ADD COLUMN IF NOT EXISTS cluster_id TEXT
+        """)
+
+    def migrate_legacy(self, cur) -> None:
+        """Перенос строк из непартиционированной таблицы; сама она остаётся как резервная копия"""
+        cur.execute(f"SELECT DISTINCT city FROM {TABLE}_unpartitioned")
+        keys = {city: city_key(city) for (city,) in cur.fetchall()}
+        if not keys:
+            return
+        self.ensure_cities(cur, keys.values())
+        # DISTINCT ON: в самых старых таблицах source_id не был уникален
+        execute_values(cur, f"""
+        INSERT INTO {TABLE} ({', '.join(LEGACY_COLUMNS)}, city_key)
+        SELECT DISTINCT ON (COALESCE(l.source_id, l.id::text)) {', '.join('l.' + c for c in LEGACY_COLUMNS)}, m.key
+        FROM {TABLE}_unpartitioned l
+        JOIN (VALUES %s) AS m (city, key) ON m.city IS NOT DISTINCT FROM l.city
+        ORDER BY COALESCE(l.source_id, l.id::text), l.id DESC
+        """, list(keys.items()))
+        logger.info(f"📦 {TABLE}: перенесено {cur.rowcount} строк в партиции, "
+                    f"старая таблица сохранена как {TABLE}_unpartitioned")
+
+    def ensure_cities(self, cur, keys: Iterable[str]) -> None:
+        """Партиция города с подпартициями active/archive"""
+        for key in set(keys) - self.cities:
+            city_part = partition_name(key)
+            cur.execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES IN ({}) PARTITION BY LIST (archived)"
+            ).format(sql.Identifier(city_part), sql.Identifier(TABLE), sql.Literal(key)))
+            for suffix, archived in (("active", False), ("archive", True)):
+                cur.execute(sql.SQL(
+                    "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES IN ({})"
+                ).format(sql.Identifier(f"{city_part}_{suffix}"), sql.Identifier(city_part), sql.Literal(archived)))
+            self.cities.add(key)
+
+    def ensure_months(self, cur, moments: Iterable[datetime.datetime]) -> None:
+        for moment in moments:
+            month = datetime.date(moment.year, moment.month, 1)
+            if month in self.months:
+                continue
+            following = datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+            cur.execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})"
+            ).format(sql.Identifier(f"{HISTORY_TABLE}_{month:%Y_%m}"), sql.Identifier(HISTORY_TABLE),
+                     sql.Literal(month), sql.Literal(following)))
+            self.months.add(month)
+
+    def revive(self, cur, source_ids) -> None:
+        """Объявление снова на сайте: строка переезжает из архива в активную партицию"""
+        cur.execute(
+            f"UPDATE {TABLE} SET archived = FALSE, missed_crawls = 0 WHERE archived AND source_id = ANY(%s)",
+            (list(source_ids),),
+        )
+
+    def archive_listings(self, cur, source_ids) -> int:
+        """Перенос в архив без ожидания пропусков: страница объявления ответила 404/410"""
+        cur.execute(
+            f"UPDATE {TABLE} SET archived = TRUE, missed_crawls = GREATEST(missed_crawls, %s) "
+            f"WHERE NOT archived AND source_id = ANY(%s)",
+            (self.archive_after, list(source_ids)),
+        )
+        return cur.rowcount
+
+    def record_history(self, cur, rows) -> None:
+        """rows: (source_id, city_key, price, price_sqm, change, scraped_at)"""
+        if not rows:
+            return
+        self.ensure_months(cur, {row[5] for row in rows})
+        execute_values(cur, f"INSERT INTO {HISTORY_TABLE} "
+                            f"(source_id, city_key, price, price_sqm, change, scraped_at) VALUES %s", rows)
+
+    def archive_unseen(self, cur, key: str, district: str, crawl_started) -> int:
+        """
+        После полного обхода района: +1 пропуск всем активным объявлениям, не встреченным
+        с начала обхода; набравшие archive_after пропусков переезжают в архивную партицию.
+        """
+        cur.execute(
+            f"UPDATE {TABLE} SET missed_crawls = missed_crawls + 1 "
+            f"WHERE city_key = %s AND NOT archived AND district = %s AND last_seen < %s",
+            (key, district, crawl_started),
+        )
+        cur.execute(
+            f"UPDATE {TABLE} SET archived = TRUE "
+            f"WHERE city_key = %s AND NOT archived AND district = %s AND missed_crawls >= %s",
+            (key, district, self.archive_after),
+        )
+        return cur.rowcount
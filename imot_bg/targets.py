@@ -0,0 +1,79 @@
+import re
+from typing import Iterable, List, NamedTuple, Optional, Union
+
+# Сегменты URL городов на imot.bg
+CITY_SLUGS = {
+    "sofia": "grad-sofiya",
+    "софия": "grad-sofiya",
+    "plovdiv": "grad-plovdiv",
+    "пловдив": "grad-plovdiv",
+    "varna": "grad-varna",
+    "варна": "grad-varna",
+    "burgas": "grad-burgas",
+    "бургас": "grad-burgas",
+}
+
+LISTING_ID_RE = re.compile(r"obiava-(\w+)")
+
+
+class CrawlTarget(NamedTuple):
+    """Цель парсинга: город, район и приоритет (больше — раньше)"""
+    city: str
+    district: str
+    priority: int = 0
+
+
+def city_slug(city: str) -> str:
+    """Сегмент URL для города (неизвестные города передаются как есть)"""
+    key = city.strip().lower()
+    return CITY_SLUGS.get(key, key if key.startswith("grad-") else f"grad-{key}")
+
+
+def listing_id_from_url(url: str) -> Optional[str]:
+    """Id объявления из ссылки imot.bg (как ImotBgSpider.extract_id_from_url)"""
+    match = LISTING_ID_RE.search(url or "")
+    return match.group(1) if match else None
+
+
+def parse_target(text: str) -> CrawlTarget:
+    """Разбор строки вида 'sofia:lyulin-5' или 'sofia:lyulin-5:10'"""
+    parts = [p.strip() for p in text.strip().split(":")]
+    if len(parts) not in (2, 3) or not all(parts[:2]):
+        raise ValueError(f"Некорректная цель '{text}', ожидается <city>:<district>[:<priority>]")
+    try:
+        priority = int(parts[2]) if len(parts) == 3 and parts[2] else 0
+    except ValueError:
+        raise ValueError(f"Приоритет цели '{text}' должен быть целым числом")
+    return CrawlTarget(parts[0].lower(), parts[1].lower(), priority)
+
+
+def parse_targets(value: Union[str, Iterable]) -> List[CrawlTarget]:
+    """Список целей из строки через запятую или из итерируемого (строки/кортежи)"""
+    if isinstance(value, str):
+        value = [v for v in value.split(",") if v.strip()]
+    targets = []
+    for entry in value:
+        if isinstance(entry, CrawlTarget):
+            targets.append(entry)
+        elif isinstance(entry, str):
+            targets.append(parse_target(entry))
+        else:
+            targets.append(CrawlTarget(*entry))
+    return dedupe_targets(targets)
+
+
+def load_targets(path: str) -> List[CrawlTarget]:
+    """Чтение целей из файла: по одной на строку, '#' — комментарий"""
+    with open(path, encoding="utf-8") as f:
+        lines = [line.split("#", 1)[0].strip() for line in f]
+    return parse_targets([line for line in lines if line])
+
+
+def dedupe_targets(targets: List[CrawlTarget]) -> List[CrawlTarget]:
+    """Удаление повторов (город+район) с сохранением максимального приоритета"""
+    best = {}
+    for target in targets:
+        key = (target.city, target.district)
+        if key not in best or target.priority > best[key].priority:
+            best[key] = target
+    return list(best.values())
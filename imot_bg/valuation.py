@@ -0,0 +1,260 @@
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from imot_bg.storage import city_key
+from imot_bg.targets import listing_id_from_url
+
+logger = logging.getLogger(__name__)
+
+# Колонки снимка активных объявлений; внутри кластера почти-дубликатов первой идёт самая свежая копия
+LOAD_QUERY = """
+SELECT source_id, city_key, LOWER(district), rooms, construction_type, price, price_sqm,
+    area, year_built, floor, title, url, COALESCE(cluster_id, source_id)
+FROM sofia_apartments
+WHERE NOT archived AND source_id IS NOT NULL AND price_sqm > 0
+ORDER BY COALESCE(cluster_id, source_id), scraped_at DESC NULLS LAST
+"""
+COLUMNS = ('source_id', 'city_key', 'district', 'rooms', 'construction_type', 'price', 'price_sqm',
+           'area', 'year_built', 'floor', 'title', 'url', 'cluster')
+
+MIN_COMPARABLES = 8  # Меньше — сравниваем с более широкой группой
+
+# Веса признаков в расстоянии до аналогов (на стандартное отклонение признака в группе)
+FEATURE_WEIGHTS = np.array([1.0, 0.5, 0.3])  # площадь, год постройки, этаж
+
+
+def parse_floor(value) -> float:
+    match = re.search(r"\d+", str(value or ""))
+    return float(match.group()) if match else np.nan
+
+
+@dataclass
+class ComparableGroup:
+    """Колонки одной группы (район / комнаты / тип строительства) в виде массивов NumPy"""
+    key: Tuple
+    source_ids: np.ndarray
+    price: np.ndarray
+    price_sqm: np.ndarray
+    features: np.ndarray            # (n, 3): площадь, год, этаж; NaN — нет данных
+    titles: np.ndarray
+    urls: np.ndarray
+    sorted_sqm: np.ndarray = field(init=False)
+    scale: np.ndarray = field(init=False)
+    positions: Dict[str, int] = field(init=False)
+
+    def __post_init__(self):
+        self.sorted_sqm = np.sort(self.price_sqm)
+        self.positions = {sid: i for i, sid in enumerate(self.source_ids)}
+        scale = np.nanstd(self.features, axis=0) if len(self.features) else np.ones(3)
+        self.scale = np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+
+    def __len__(self) -> int:
+        return len(self.price_sqm)
+
+    def size(self, exclude: Optional[str] = None) -> int:
+        """Число аналогов: без самого оцениваемого объявления, если оно в группе"""
+        return len(self) - (exclude in self.positions)
+
+    def percentile(self, price_sqm: float, exclude: Optional[str] = None) -> float:
+        """
+        Доля объявлений группы дешевле за м² (бинарный поиск по отсортированному массиву).
+        exclude — само оцениваемое объявление: в малой группе оно тянуло бы перцентиль к середине.
+        """
+        below = np.searchsorted(self.sorted_sqm, price_sqm, side="left")
+        equal = np.searchsorted(self.sorted_sqm, price_sqm, side="right") - below
+        total = len(self.sorted_sqm)
+        if exclude in self.positions:
+            own = self.price_sqm[self.positions[exclude]]
+            if own < price_sqm:
+                below -= 1
+            elif own == price_sqm:
+                equal -= 1
+            total -= 1
+        return 100.0 * (below + 0.5 * equal) / total
+
+    def median(self, exclude: Optional[str] = None) -> float:
+        values = self.price_sqm
+        if exclude in self.positions:
+            values = np.delete(values, self.positions[exclude])
+        return float(np.median(values))
+
+    def nearest(self, features: np.ndarray, k: int, exclude: Optional[str] = None) -> np.ndarray:
+        """Индексы k ближайших по взвешенному нормированному расстоянию; пропуски признаков не штрафуются"""
+        diff = np.abs(self.features - features) / self.scale
+        diff = np.where(np.isnan(diff), 0.0, diff)
+        distance = diff @ FEATURE_WEIGHTS
+        if exclude is not None:
+            distance = np.where(self.source_ids == exclude, np.inf, distance)
+        k = min(k, int(np.isfinite(distance).sum()))
+        if k <= 0:
+            return np.array([], dtype=int)
+        nearest = np.argpartition(distance, k - 1)[:k]
+        return nearest[np.argsort(distance[nearest])]
+
+
+@dataclass
+class Valuation:
+    source_id: Optional[str]
+    price_sqm: float
+    percentile: float
+    median_sqm: float
+    group: Tuple
+    group_size: int
+    comparables: List[Dict]
+
+    @property
+    def verdict(self) -> str:
+        if self.percentile < 25:
+            return "заметно дешевле аналогов"
+        if self.percentile < 45:
+            return "немного дешевле аналогов"
+        if self.percentile <= 55:
+            return "на уровне рынка"
+        if self.percentile <= 75:
+            return "немного дороже аналогов"
+        return "заметно дороже аналогов"
+
+
+class ValuationEngine:
+    """
+    Оценка объявления относительно сопоставимых: перцентиль цены за м²
+    и ближайшие аналоги по площади/году постройки/этажу.
+    Снимок sofia_apartments держится в памяти колонками NumPy, сгруппированными
+    по (город, район, комнаты, тип строительства) с запасными группами (город, район, комнаты)
+    и (город, район); запрос — бинарный поиск и одна векторная операция по группе, без SQL и pandas.
+    Кластер почти-дубликатов входит в группы одной (самой свежей) копией, но оценить можно
+    любую копию: она сравнивается с группой без своего представителя.
+    """
+
+    def __init__(self, rows: Iterable[Sequence] = ()):
+        self.groups: Dict[Tuple, ComparableGroup] = {}
+        self.listings: Dict[str, Dict] = {}
+        self.loaded_at = time.monotonic()
+        self.build(rows)
+
+    @classmethod
+    def from_connection(cls, conn) -> "ValuationEngine":
+        """Загрузка снимка через DB-API соединение (psycopg2)"""
+        started = time.perf_counter()
+        with conn.cursor() as cur:
+            cur.execute(LOAD_QUERY)
+            engine = cls(cur.fetchall())
+        logger.info(f"📐 Оценщик загружен: {len(engine.listings)} объявлений, "
+                    f"{len(engine.groups)} групп за {time.perf_counter() - started:.2f} с")
+        return engine
+
+    @classmethod
+    def from_db(cls) -> "ValuationEngine":
+        from imot_bg.db import connect
+        conn = connect()
+        try:
+            return cls.from_connection(conn)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def group_keys(listing: Dict) -> List[Tuple]:
+        """Ключи групп от самой узкой к самой широкой; одноимённые районы разных городов не смешиваются"""
+        city = listing.get('city_key') or city_key(listing.get('city'))
+        district = (listing.get('district') or '').lower()
+        rooms = listing.get('rooms')
+        construction = (listing.get('construction_type') or '').lower()
+        return [(city, district, rooms, construction), (city, district, rooms), (city, district)]
+
+    @staticmethod
+    def feature_vector(listing: Dict) -> np.ndarray:
+        def number(value):
+            return float(value) if value is not None else np.nan
+        return np.array([number(listing.get('area')), number(listing.get('year_built')),
+                         parse_floor(listing.get('floor'))])
+
+    def build(self, rows: Iterable[Sequence]) -> None:
+        members: Dict[Tuple, List[Dict]] = {}
+        representatives: Dict[str, str] = {}
+        for row in rows:
+            listing = dict(zip(COLUMNS, row))
+            listing['price_sqm'] = float(listing['price_sqm'])
+            listing['price'] = float(listing['price']) if listing['price'] is not None else np.nan
+            self.listings[listing['source_id']] = listing
+            # представитель кластера — первая (самая свежая) копия, остальные в группы не входят
+            listing['representative'] = representatives.setdefault(listing['cluster'], listing['source_id'])
+            if listing['representative'] != listing['source_id']:
+                continue
+            for key in self.group_keys(listing):
+                members.setdefault(key, []).append(listing)
+
+        for key, listings in members.items():
+            self.groups[key] = ComparableGroup(
+                key=key,
+                source_ids=np.array([l['source_id'] for l in listings], dtype=object),
+                price=np.array([l['price'] for l in listings], dtype=np.float64),
+                price_sqm=np.array([l['price_sqm'] for l in listings], dtype=np.float64),
+                features=np.vstack([self.feature_vector(l) for l in listings]),
+                titles=np.array([l['title'] for l in listings], dtype=object),
+                urls=np.array([l['url'] for l in listings], dtype=object),
+            )
+
+    def age(self) -> float:
+        return time.monotonic() - self.loaded_at
+
+    @staticmethod
+    def own_id(listing: Dict) -> Optional[str]:
+        """Id, под которым объявление (или его кластер) представлено в группах"""
+        return listing.get('representative') or listing.get('source_id')
+
+    def comparable_group(self, listing: Dict) -> Optional[ComparableGroup]:
+        """Самая узкая группа, в которой хватает аналогов (не считая самого объявления)"""
+        source_id = self.own_id(listing)
+        fallback = None
+        for key in self.group_keys(listing):
+            group = self.groups.get(key)
+            if group is None or not group.size(source_id):
+                continue
+            if group.size(source_id) >= MIN_COMPARABLES:
+                return group
+            fallback = fallback or group
+        return fallback
+
+    def evaluate(self, listing: Dict, k: int = 5) -> Optional[Valuation]:
+        """Оценка произвольного объявления (dict с district, rooms, price_sqm, area, ...)"""
+        price_sqm = listing.get('price_sqm')
+        if not price_sqm:
+            return None
+        group = self.comparable_group(listing)
+        if group is None:
+            return None
+        source_id = self.own_id(listing)
+        nearest = group.nearest(self.feature_vector(listing), k, exclude=source_id)
+        comparables = [
+            {
+                'source_id': group.source_ids[i],
+                'title': group.titles[i],
+                'url': group.urls[i],
+                'price': group.price[i],
+                'price_sqm': group.price_sqm[i],
+                'area': group.features[i, 0],
+            }
+            for i in nearest
+        ]
+        return Valuation(
+            source_id=listing.get('source_id'),
+            price_sqm=float(price_sqm),
+            percentile=round(group.percentile(float(price_sqm), exclude=source_id), 1),
+            median_sqm=group.median(exclude=source_id),
+            group=group.key,
+            group_size=group.size(source_id),
+            comparables=comparables,
+        )
+
+    def evaluate_id(self, source_id: str, k: int = 5) -> Optional[Valuation]:
+        listing = self.listings.get(source_id)
+        return self.evaluate(listing, k) if listing else None
+
+    def evaluate_url(self, url: str, k: int = 5) -> Optional[Valuation]:
+        source_id = listing_id_from_url(url)
+        return self.evaluate_id(source_id, k) if source_id else None
@@ -0,0 +1,180 @@
+import asyncio
+import hmac
+import ipaddress
+import json
+import logging
+import signal
+from typing import Dict, Optional, Tuple
+
+from telegram import Update
+
+from imot_bg import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1 << 20  # Обновления Telegram — единицы килобайт
+IDLE_TIMEOUT = 75.0  # Сколько держать простаивающее keep-alive соединение
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class WebhookServer:
+    """
+    Встроенный HTTP-сервер вебхука на asyncio (без tornado/aiohttp).
+    Принимает POST с обновлением на url_path, проверяет секрет из заголовка
+    X-Telegram-Bot-Api-Secret-Token и кладёт Update в очередь приложения —
+    ответ 200 уходит сразу, обработку параллельно ведёт Application
+    (ApplicationBuilder.concurrent_updates). Соединения keep-alive переиспользуются.
+    """
+
+    def __init__(self, application, listen: str = "127.0.0.1", port: int = 8443,
+                 url_path: str = "/telegram", secret_token: Optional[str] = None):
+        if not secret_token and not is_loopback(listen):
+            # без секрета любой, кто достучится до порта, подделает апдейты от имени любого пользователя
+            raise ValueError(f"Вебхук на {listen} без секрета: задайте WEBHOOK_SECRET "
+                             f"или слушайте только 127.0.0.1 (за прокси)")
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.url_path = "/" + url_path.strip("/")
+        self.secret_token = secret_token
+        self.server = None
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self.handle, self.listen, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"🌐 Вебхук слушает http://{self.listen}:{self.port}{self.url_path}")
+
+    async def stop(self) -> None:
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status = await self.dispatch(method, path, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close" and status != 413
+                await self.respond(writer, status, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+        if not line:
+            return None
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_BYTES:
+            return method, path, {**headers, "connection": "close"}, b""
+        body = await asyncio.wait_for(reader.readexactly(length), IDLE_TIMEOUT) if length else b""
+        return method, path.split("?", 1)[0], headers, body
+
+    async def dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> int:
+        if path == "/healthz":
+            return 200
+        if path != self.url_path:
+            return 404
+        if method != "POST":
+            return 405
+        if int(headers.get("content-length") or 0) > MAX_BODY_BYTES:
+            return 413
+        if self.secret_token and not hmac.compare_digest(
+                headers.get(SECRET_HEADER, "").encode(), self.secret_token.encode()):
+            metrics.BOT_UPDATES_TOTAL.inc(result="forbidden")
+            logger.warning("⚠️ Вебхук: запрос с неверным секретом")
+            return 403
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                raise ValueError(f"ожидался объект JSON, получено {type(data).__name__}")
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            metrics.BOT_UPDATES_TOTAL.inc(result="invalid")
+            logger.warning(f"⚠️ Вебхук: некорректное обновление: {e}")
+            return 400
+        await self.application.update_queue.put(update)
+        metrics.BOT_UPDATES_TOTAL.inc(result="accepted")
+        return 200
+
+    @staticmethod
+    async def respond(writer: asyncio.StreamWriter, status: int, keep_alive: bool) -> None:
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+
+async def serve_webhook(application, webhook_url: Optional[str], listen: str = "127.0.0.1", port: int = 8443,
+                        url_path: str = "/telegram", secret_token: Optional[str] = None,
+                        drop_pending_updates: bool = False) -> None:
+    """
+    Полный жизненный цикл приложения в режиме вебхука (как run_polling: initialize,
+    post_init, start ... stop, shutdown, post_shutdown) до SIGINT/SIGTERM.
+    Без webhook_url вебхук в Telegram не регистрируется — сервер только слушает
+    (например, за прокси, где setWebhook вызывается отдельно). Публичный вебхук
+    (webhook_url или адрес не loopback) без secret_token не запускается.
+    """
+    if webhook_url and not secret_token:
+        raise ValueError("WEBHOOK_URL задан без WEBHOOK_SECRET: Telegram не сможет подписывать апдейты")
+    server = WebhookServer(application, listen, port, url_path, secret_token)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=webhook_url.rstrip("/") + server.url_path,
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=drop_pending_updates,
+            )
+            logger.info(f"🔗 Вебхук зарегистрирован: {webhook_url.rstrip('/')}{server.url_path}")
+        await application.start()
+        await stop.wait()
+    finally:
+        logger.info("🛑 Остановка вебхука")
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -1,8 +1,15 @@
 import logging
 import asyncio
+import argparse
+import datetime
 from concurrent.futures import ThreadPoolExecutor
+from typing import List
 
 from imot_bg.spiders.imot_debug import ImotBgSpider
+from imot_bg.spiders.imot_districts import ImotDistrictsSpider
+from imot_bg.targets import CrawlTarget, load_targets, parse_targets
+from imot_bg.profiling import profiled
+from imot_bg.logging_utils import setup_queue_logging
 from scrapy.utils.project import get_project_settings
 from scrapy.crawler import CrawlerProcess
 
@@ -11,21 +18,71 @@ logger = logging.getLogger(__name__)
 executor = ThreadPoolExecutor(max_workers=1)  # Можно увеличить при необходимости
 
 
-def run_spider_sync(city: str, district: str):
-    """Синхронный запуск паука Scrapy"""
-    logger.info(f"🚀 Запускаю парсинг для города: {city}, район: {district}")
+def make_job_id(city: str, district: str) -> str:
+    """Id нового задания: город_район_время"""
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{city}_{district}_{timestamp}".lower()
+
+
+def run_spider_sync(city: str, district: str, job_id: str = None, profile: bool = False):
+    """
+    Синхронный запуск паука Scrapy.
+    С job_id прогресс сохраняется в чекпойнт и повторный запуск с тем же id
+    продолжает задание с места остановки.
+    """
+    job_id = job_id or make_job_id(city, district)
+    run_batch_sync([CrawlTarget(city, district.strip().lower())], job_id, profile)
+
+
+def run_batch_sync(targets: List[CrawlTarget], job_id: str = None, profile: bool = False):
+    """
+    Синхронный запуск одного паука сразу по нескольким целям (город/район).
+    Все цели обходятся в одном CrawlerProcess: один браузер и одно соединение с БД.
+    С profile=True обход профилируется (cProfile + tracemalloc), отчёты — в exports/.
+    """
+    job_id = job_id or make_job_id("batch", str(len(targets)))
+    names = ", ".join(f"{t.city}/{t.district}" for t in targets)
+    logger.info(f"🚀 Запускаю парсинг для целей: {names}, задание: {job_id}")
+    print(f">>> job_id={job_id}", flush=True)
     try:
         settings = get_project_settings()
-        process = CrawlerProcess(settings)
-        process.crawl(ImotBgSpider, city=city, district=district)
-        process.start()
+        # корневой обработчик Scrapy не ставим: запись логов уходит в фоновый поток
+        process = CrawlerProcess(settings, install_root_handler=False)
+        setup_queue_logging(
+            settings.get("SPIDER_LOG_FILE"),
+            level=settings.get("LOG_LEVEL"),
+            json_format=settings.getbool("LOG_JSON"),
+            rates=settings.getdict("LOG_EVENT_RATES"),
+            console_level=settings.get("LOG_CONSOLE_LEVEL"),
+        )
+        process.crawl(ImotBgSpider, targets=targets, job_id=job_id)
+        # профилируем в этом же потоке: здесь работает реактор и все callback'и
+        with profiled(f"crawl_{job_id}", enabled=profile):
+            process.start()
         logger.info("✅ Парсинг завершён")
     except Exception as e:
         logger.error(f"❌ Ошибка при запуске паука: {e}")
         raise
 
 
-async def run_spider_async(city: str, district: str, is_new_search=False):
+def refresh_districts_sync(city: str):
+    """Обновление каталога районов города (DISTRICT_CATALOG_PATH)"""
+    logger.info(f"🗺 Обновляю каталог районов: {city}")
+    settings = get_project_settings()
+    process = CrawlerProcess(settings, install_root_handler=False)
+    setup_queue_logging(
+        settings.get("SPIDER_LOG_FILE"),
+        level=settings.get("LOG_LEVEL"),
+        json_format=settings.getbool("LOG_JSON"),
+        rates=settings.getdict("LOG_EVENT_RATES"),
+        console_level=settings.get("LOG_CONSOLE_LEVEL"),
+    )
+    process.crawl(ImotDistrictsSpider, city=city)
+    process.start()
+
+
+async def run_spider_async(city: str, district: str, is_new_search=False, job_id: str = None,
+                           profile: bool = False):
     """
     Асинхронный запуск паука.
     Если is_new_search == True → парсим заново.
@@ -38,7 +95,7 @@ async def run_spider_async(city: str, district: str, is_new_search=False):
     if is_new_search:
         logger.info(f"🔄 Новый парсинг включен: {city} - {district}")
         loop = asyncio.get_event_loop()
-        await loop.run_in_executor(executor, run_spider_sync, city, district)
+        await loop.run_in_executor(executor, run_spider_sync, city, district, job_id, profile)
     else:
         logger.info(f"📦 Данные берутся из базы: {city} - {district}")
         # Здесь должна быть логика получения из базы (если нужно)
@@ -48,17 +105,42 @@ async def run_spider_async(city: str, district: str, is_new_search=False):
 if __name__ == "__main__":
     print(">>> run_spider_async started", flush=True)
 
-    import sys
-    if len(sys.argv) != 4:
-        print("Использование: python run_spider_async.py <city> <district> <is_new_search>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Запуск паука imot.bg")
+    parser.add_argument("city", nargs="?")
+    parser.add_argument("district", nargs="?")
+    parser.add_argument("is_new_search", nargs="?", default="true")
+    parser.add_argument("--job-id", help="id задания; повторный запуск с тем же id возобновляет парсинг")
+    parser.add_argument("--target", action="append", default=[],
+                        help="цель <city>:<district>[:<priority>], можно указать несколько раз")
+    parser.add_argument("--targets-file", help="файл с целями, по одной на строку")
+    parser.add_argument("--profile", action="store_true", help="профилировать обход (отчёты в exports/)")
+    parser.add_argument("--refresh-districts", action="store_true",
+                        help="обновить каталог районов города <city> вместо парсинга объявлений")
+    args = parser.parse_args()
+
+    if args.refresh_districts:
+        refresh_districts_sync(args.city or "sofia")
+        raise SystemExit(0)
 
-    city = sys.argv[1]
-    district = sys.argv[2]
-    is_new_search = sys.argv[3].lower() == "true"
+    targets = parse_targets(args.target)
+    if args.targets_file:
+        targets = parse_targets(targets + load_targets(args.targets_file))
 
-    asyncio.run(run_spider_async(city, district, is_new_search))
+    if targets:
+        if args.city or args.district:
+            parser.error("укажите либо <city> <district>, либо --target/--targets-file")
+        run_batch_sync(targets, job_id=args.job_id, profile=args.profile)
+    elif args.city and args.district:
+        is_new_search = args.is_new_search.lower() == "true"
+        asyncio.run(run_spider_async(args.city, args.district, is_new_search, job_id=args.job_id,
+                                     profile=args.profile))
+    else:
+        parser.error("не указаны цели парсинга")
 
 # Пример ручного запуска:
 # asyncio.run(run_spider_async("sofia", "lyulin-5", force=True))
+# Пакетный запуск:
+# python run_spider_async.py --target sofia:lyulin-5:10 --target sofia:lozenets --job-id nightly
+# Каталог районов:
+# python run_spider_async.py sofia --refresh-districts
 